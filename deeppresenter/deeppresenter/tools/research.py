@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re
 from typing import Any, Literal
@@ -13,7 +14,7 @@ sch = SemanticScholar()
 
 
 @mcp.tool()
-def search_papers(
+async def search_papers(
     query: str,
     max_results: int | None = 5,
 ) -> dict[str, Any]:
@@ -40,6 +41,8 @@ def search_papers(
         max_results=PAGE_SIZE,
     )
 
+    # the arxiv client paginates with blocking HTTP requests, keep them off the event loop
+    results = await asyncio.to_thread(lambda: list(client.results(search)))
     papers = [
         {
             "title": paper.title,
@@ -48,7 +51,7 @@ def search_papers(
             "published": paper.published.strftime("%Y-%m-%d"),
             "pdf_url": paper.pdf_url,
         }
-        for paper in client.results(search)
+        for paper in results
     ]
     if max_results is not None:
         papers = papers[:max_results]
@@ -56,7 +59,7 @@ def search_papers(
 
 
 @mcp.tool()
-def get_paper_authors(arxiv_id: str) -> dict:
+async def get_paper_authors(arxiv_id: str) -> dict:
     """
     Get the authors of a paper by arxiv id.
     Args:
@@ -67,12 +70,14 @@ def get_paper_authors(arxiv_id: str) -> dict:
     if not re.fullmatch(r"ARXIV:\d{4}\.\d{4,5}(v\d+)?", arxiv_id):
         return {"error": "Invalid arxiv_id format. It should be like ARXIV:2501.03936"}
     fields = ["name", "citationCount", "affiliations"]
-    authors: list[Author] = list(sch.get_paper_authors(arxiv_id, fields=fields))
+    authors: list[Author] = await asyncio.to_thread(
+        lambda: list(sch.get_paper_authors(arxiv_id, fields=fields))
+    )
     return {"authors": [author._data for author in authors]}
 
 
 @mcp.tool()
-def get_scholar_details(
+async def get_scholar_details(
     author_id: str,
     paper_start_index: int = 0,
     sort_by: Literal["citationCount", "year"] | None = None,
@@ -103,7 +108,7 @@ def get_scholar_details(
         "papers.year",
         "name",
     ]
-    author = sch.get_author(author_id, fields=fields)
+    author = await asyncio.to_thread(sch.get_author, author_id, fields=fields)
     author, papers = author._data, author._data.pop("papers")
     processed_papers = []
     for p in papers:
@@ -121,4 +126,4 @@ def get_scholar_details(
 
 
 if __name__ == "__main__":
-    print(search_papers('ti:"Rethinking Reward Model Evaluation"'))
+    print(asyncio.run(search_papers('ti:"Rethinking Reward Model Evaluation"')))
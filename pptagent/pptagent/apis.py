@@ -541,3 +541,94 @@ class API_TYPES(Enum):
                 continue
             funcs |= {func.__name__: func for func in getattr(cls, attr).value}
         return funcs
+
+
+def _normalize(text: str | None) -> str:
+    return " ".join((text or "").split())
+
+
+def _claim(
+    candidates: dict[str, list], items: list[str], claimed: set[int]
+) -> list | None:
+    """
+    Match every item to exactly one unclaimed candidate with the same normalized text.
+    """
+    matches = []
+    for item in items:
+        key = _normalize(item)
+        unclaimed = [c for c in candidates.get(key, []) if id(c[-1]) not in claimed]
+        if len(unclaimed) != sum(_normalize(i) == key for i in items):
+            return None
+        claimed.add(id(unclaimed[0][-1]))
+        matches.append(unclaimed[0])
+    return matches
+
+
+def compile_commands(command_list: list[tuple], slide: SlidePage) -> str | None:
+    """
+    Compile editing commands into API calls without the coder agent.
+
+    Each element's old data must map one-to-one onto paragraphs or images of the template slide by their text or caption,
+    and paragraphs can only be cloned when the element's paragraphs end their text frame, so that clones follow them.
+
+    Args:
+        command_list (list[tuple]): The commands of `_generate_commands`: (element name, type, quantity change, old data, new data).
+        slide (SlidePage): The template slide to edit.
+
+    Returns:
+        str | None: The API calls, or None if the mapping is ambiguous and the coder agent is needed.
+    """
+    paragraphs, pictures = {}, {}
+    for shape in slide:
+        if isinstance(shape, Picture):
+            pictures.setdefault(_normalize(shape.caption), []).append((shape, shape))
+        elif shape.text_frame.is_textframe:
+            for para in shape.text_frame.paragraphs:
+                if para.idx != -1:
+                    paragraphs.setdefault(_normalize(para.text), []).append(
+                        (shape, para)
+                    )
+
+    claimed = set()
+    lines = []
+    for command in command_list:
+        _, el_type, _, old_data, new_data = command
+        if el_type == "image":
+            matches = _claim(pictures, old_data, claimed)
+        else:
+            matches = _claim(paragraphs, old_data, claimed)
+        if matches is None or (len(matches) == 0 and len(new_data) != 0):
+            return None
+
+        calls = []
+        if el_type == "image":
+            # images cannot be cloned, the exceeding ones are omitted
+            for (shape, _), image_path in zip(matches, new_data):
+                calls.append(f"replace_image({shape.shape_idx}, {image_path!r})")
+            for shape, _ in matches[len(new_data) :]:
+                calls.append(f"del_image({shape.shape_idx})")
+        else:
+            targets = [(shape.shape_idx, para.idx) for shape, para in matches]
+            num_clones = len(new_data) - len(matches)
+            if num_clones > 0:
+                shape, last_para = matches[-1]
+                if any(s is not shape for s, _ in matches) or (
+                    shape.text_frame.paragraphs[-1] is not last_para
+                ):
+                    return None
+                max_idx = max(para.idx for para in shape.text_frame.paragraphs)
+                for clone_idx in range(max_idx + 1, max_idx + 1 + num_clones):
+                    calls.append(f"clone_paragraph({shape.shape_idx}, {last_para.idx})")
+                    targets.append((shape.shape_idx, clone_idx))
+            for (div_id, para_id), text in zip(targets, new_data):
+                calls.append(f"replace_paragraph({div_id}, {para_id}, {text!r})")
+            for div_id, para_id in targets[len(new_data) :]:
+                calls.append(f"del_paragraph({div_id}, {para_id})")
+
+        if calls:
+            lines.append(f"# {command}".replace("\n", " "))
+            lines.extend(calls)
+
+    if not lines:
+        return None
+    return "\n".join(lines)
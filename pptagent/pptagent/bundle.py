@@ -0,0 +1,660 @@
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
+import stat
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from functools import cached_property
+from os.path import exists, expanduser, getsize, join
+from pathlib import Path
+
+from lxml import etree
+from pptagent_pptx.oxml import parse_xml
+
+from pptagent import __version__
+from pptagent.apis import API_TYPES, CodeExecutor
+from pptagent.multimodal import ImageLabler
+from pptagent.pptgen import hide_small_pics
+from pptagent.presentation import GroupShape, Layout, Presentation
+from pptagent.utils import Config, get_logger, package_join
+
+logger = get_logger(__name__)
+
+# bump when the layout of the bundle changes, bundles of other formats are recompiled
+BUNDLE_FORMAT = 1
+BUNDLE_MAGIC = b"PPTABNDL"
+BUNDLE_NAME = "template.bundle"
+SOURCE_FILES = ["source.pptx", "slide_induction.json", "image_stats.json"]
+# the settings `PPTAgent.set_reference` uses by default, the template HTML is rendered with them
+HIDE_SMALL_PIC_RATIO = 0.2
+KEEP_IN_BACKGROUND = True
+# residency budget of loaded templates, 0 means unlimited
+TEMPLATE_CACHE_SIZE = int(os.environ.get("PPTAGENT_TEMPLATE_CACHE_SIZE", 8))
+TEMPLATE_CACHE_MB = int(os.environ.get("PPTAGENT_TEMPLATE_CACHE_MB", 0))
+# bundles of read-only template directories are compiled here, only accessible by the current user
+BUNDLE_CACHE_DIR = os.environ.get(
+    "PPTAGENT_BUNDLE_CACHE",
+    join(expanduser("~"), ".cache", "pptagent", "bundles"),
+)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hashes(template_dir: Path) -> dict[str, str]:
+    """
+    Get the sha256 of the source files of a template, missing files are skipped.
+    """
+    return {
+        name: _sha256(template_dir / name)
+        for name in SOURCE_FILES + ["description.txt"]
+        if (template_dir / name).exists()
+    }
+
+
+def _is_trusted(path: Path) -> bool:
+    """
+    Check that a path can only be modified by the current user, as bundles are unpickled.
+
+    The path must be owned by the current user (or root) and not writable by group or others.
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        return False
+    if hasattr(os, "getuid") and st.st_uid not in (os.getuid(), 0):
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _private_dir(path: Path) -> Path:
+    """
+    Create a directory only accessible by the current user.
+    """
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not _is_trusted(path):
+        raise PermissionError(f"{path} is writable by other users")
+    return path
+
+
+def _restore_shape(cls: type, state: dict):
+    shape = object.__new__(cls)
+    shape.__dict__.update(state)
+    return shape
+
+
+class _SlidePickler(pickle.Pickler):
+    """
+    Pickle slides with their XML serialized, and media paths and configs stored as references,
+    so a bundle can be loaded into any directory.
+    """
+
+    def __init__(self, file, config: Config):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.config = config
+        self.image_prefix = join(config.IMAGE_DIR, "")
+        self.media: set[str] = set()
+
+    def reducer_override(self, obj):
+        if isinstance(obj, etree._Element):
+            return parse_xml, (etree.tostring(obj),)
+        # group shapes are instances of classes created at parsing, restore them as plain group shapes
+        if isinstance(obj, GroupShape) and type(obj) is not GroupShape:
+            return _restore_shape, (GroupShape, obj.__getstate__())
+        return NotImplemented
+
+    def persistent_id(self, obj):
+        if obj is self.config:
+            return ("config",)
+        if isinstance(obj, str) and obj.startswith(self.image_prefix):
+            self.media.add(obj)
+            return ("media", obj.removeprefix(self.image_prefix))
+        return None
+
+
+class _SlideUnpickler(pickle.Unpickler):
+    def __init__(self, file, config: Config):
+        super().__init__(file)
+        self.config = config
+
+    def persistent_load(self, pid):
+        if pid[0] == "config":
+            return self.config
+        if pid[0] == "media":
+            return join(self.config.IMAGE_DIR, pid[1])
+        raise pickle.UnpicklingError(f"Unknown persistent id {pid}")
+
+
+def compile_template(
+    template_dir: str | Path,
+    output: str | Path | None = None,
+    config: Config | None = None,
+) -> Path:
+    """
+    Compile a template directory into a bundle holding everything the agent needs from it.
+
+    The bundle holds the parsed presentation, the HTML and content schema of each layout's template slide,
+    the API docs and the media of the template, so loading it requires no parsing of the pptx.
+
+    Args:
+        template_dir (str | Path): The directory containing source.pptx, slide_induction.json and image_stats.json.
+        output (str | Path | None): The path of the bundle, defaults to `template.bundle` in the template directory.
+        config (Config | None): The configuration to parse the template with, defaults to the template directory.
+
+    Returns:
+        Path: The path of the compiled bundle.
+    """
+    template_dir = Path(template_dir)
+    output = Path(output) if output is not None else template_dir / BUNDLE_NAME
+    if config is None:
+        config = Config(str(template_dir))
+    presentation = Presentation.from_file(str(template_dir / "source.pptx"), config)
+    image_labler = ImageLabler(presentation, config)
+    image_labler.apply_stats(
+        json.loads((template_dir / "image_stats.json").read_text())
+    )
+    slide_induction = json.loads((template_dir / "slide_induction.json").read_text())
+    description_path = template_dir / "description.txt"
+    description = description_path.read_text() if description_path.exists() else ""
+
+    # render the template slides as `PPTAgent.set_reference` leaves them
+    layouts = {
+        k: Layout(title=k, **v)
+        for k, v in slide_induction.items()
+        if k not in ["language", "functional_keys"]
+    }
+    hidden = presentation.snapshot()
+    hide_small_pics(hidden, layouts, HIDE_SMALL_PIC_RATIO, KEEP_IN_BACKGROUND)
+    metadata = {
+        "name": template_dir.name,
+        "description": description,
+        "slide_induction": slide_induction,
+        "layouts": {
+            title: {
+                "template_id": layout.template_id,
+                "content_schema": layout.content_schema,
+            }
+            for title, layout in layouts.items()
+        },
+        "template_html": {
+            layout.template_id: hidden.slides[layout.template_id - 1].to_html()
+            for layout in layouts.values()
+        },
+        "hide_small_pic_ratio": HIDE_SMALL_PIC_RATIO,
+        "keep_in_background": KEEP_IN_BACKGROUND,
+        "api_docs": CodeExecutor.get_apis_docs(API_TYPES.Agent.value),
+    }
+
+    buffer = io.BytesIO()
+    pickler = _SlidePickler(buffer, config)
+    pickler.dump(
+        {
+            "slides": presentation.slides,
+            "error_history": presentation.error_history,
+            "slide_width": presentation.slide_width,
+            "slide_height": presentation.slide_height,
+            "num_pages": presentation.num_pages,
+        }
+    )
+    sections = {
+        "metadata": json.dumps(metadata, ensure_ascii=False).encode("utf-8"),
+        "slides": buffer.getvalue(),
+        "source.pptx": (template_dir / "source.pptx").read_bytes(),
+    }
+    for path in sorted(pickler.media):
+        sections["media/" + path.removeprefix(pickler.image_prefix)] = Path(
+            path
+        ).read_bytes()
+
+    offsets, position = {}, 0
+    for name, data in sections.items():
+        offsets[name] = [position, len(data)]
+        position += len(data)
+    header = json.dumps(
+        {
+            "format": BUNDLE_FORMAT,
+            "version": __version__,
+            "name": template_dir.name,
+            "sources": source_hashes(template_dir),
+            "sections": offsets,
+        }
+    ).encode("utf-8")
+
+    # write to a temporary file first, so that readers never see a partial bundle
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=".bundle", dir=output.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(BUNDLE_MAGIC + struct.pack("<I", len(header)) + header)
+            for data in sections.values():
+                f.write(data)
+        os.replace(temp_path, output)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logger.info(
+        "Compiled template %s into %s (%d bytes)",
+        template_dir.name,
+        output,
+        getsize(output),
+    )
+    return output
+
+
+class TemplateBundle:
+    """
+    A compiled template, memory-mapped on open and loaded section by section on access.
+    """
+
+    def __init__(self, path: str | Path):
+        """
+        Open a bundle, only its header is read.
+
+        Args:
+            path (str | Path): The path of the bundle.
+
+        Raises:
+            ValueError: If the file is not a bundle or its format is not supported.
+        """
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic_size = len(BUNDLE_MAGIC)
+        if self._mmap[:magic_size] != BUNDLE_MAGIC:
+            raise ValueError(f"{self.path} is not a template bundle")
+        (header_size,) = struct.unpack("<I", self._mmap[magic_size : magic_size + 4])
+        self._data_offset = magic_size + 4 + header_size
+        self.header = json.loads(self._mmap[magic_size + 4 : self._data_offset])
+        if self.header["format"] != BUNDLE_FORMAT:
+            raise ValueError(
+                f"Bundle {self.path} has format {self.header['format']}, expected {BUNDLE_FORMAT}, please recompile it"
+            )
+
+    def _section(self, name: str) -> memoryview:
+        offset, size = self.header["sections"][name]
+        start = self._data_offset + offset
+        return memoryview(self._mmap)[start : start + size]
+
+    @property
+    def name(self) -> str:
+        return self.header["name"]
+
+    @property
+    def media(self) -> list[str]:
+        """
+        The file names of the media in the bundle.
+        """
+        return [
+            name.removeprefix("media/")
+            for name in self.header["sections"]
+            if name.startswith("media/")
+        ]
+
+    def is_stale(self, template_dir: str | Path | None = None) -> bool:
+        """
+        Check whether the bundle was compiled by another version of pptagent, or from other source files.
+
+        Args:
+            template_dir (str | Path | None): The directory of the source files, skip checking them if not given.
+        """
+        if self.header["version"] != __version__:
+            return True
+        if template_dir is None:
+            return False
+        return self.header["sources"] != source_hashes(Path(template_dir))
+
+    @cached_property
+    def metadata(self) -> dict:
+        return json.loads(bytes(self._section("metadata")))
+
+    @property
+    def description(self) -> str:
+        return self.metadata["description"]
+
+    @property
+    def slide_induction(self) -> dict:
+        """
+        A fresh copy of the slide induction, as `PPTAgent.set_reference` consumes it.
+        """
+        return json.loads(json.dumps(self.metadata["slide_induction"]))
+
+    @property
+    def content_schemas(self) -> dict[str, str]:
+        return {
+            title: layout["content_schema"]
+            for title, layout in self.metadata["layouts"].items()
+        }
+
+    @property
+    def api_docs(self) -> str:
+        return self.metadata["api_docs"]
+
+    def template_html(
+        self,
+        hide_small_pic_ratio: float | None = HIDE_SMALL_PIC_RATIO,
+        keep_in_background: bool = KEEP_IN_BACKGROUND,
+    ) -> dict[int, str] | None:
+        """
+        Get the pre-rendered HTML of the template slides, if they were rendered with the given settings.
+        """
+        if (
+            hide_small_pic_ratio != self.metadata["hide_small_pic_ratio"]
+            or keep_in_background != self.metadata["keep_in_background"]
+        ):
+            return None
+        return {int(k): v for k, v in self.metadata["template_html"].items()}
+
+    def extract_media(self, config: Config):
+        """
+        Write the source pptx and media of the bundle into the directories of `config`, skipping existing files.
+        """
+        targets = {
+            "source.pptx": join(config.RUN_DIR, "source.pptx"),
+        } | {"media/" + name: join(config.IMAGE_DIR, name) for name in self.media}
+        for section, target in targets.items():
+            data = self._section(section)
+            if exists(target) and getsize(target) == len(data):
+                continue
+            with open(target, "wb") as f:
+                f.write(data)
+
+    def load_presentation(self, config: Config) -> Presentation:
+        """
+        Load the presentation of the bundle, with its media extracted into the directories of `config`.
+
+        Args:
+            config (Config): The configuration to load the presentation with.
+
+        Returns:
+            Presentation: The parsed presentation.
+        """
+        self.extract_media(config)
+        fields = _SlideUnpickler(io.BytesIO(self._section("slides")), config).load()
+        return Presentation(source_file=join(config.RUN_DIR, "source.pptx"), **fields)
+
+    def close(self):
+        self._mmap.close()
+
+    def __repr__(self) -> str:
+        return f"TemplateBundle({self.name}, {self.path})"
+
+
+def load_bundle(template_dir: str | Path) -> TemplateBundle:
+    """
+    Open the bundle of a template directory, compiling it first if it is missing or stale.
+
+    Bundles of template directories other users can write to are compiled into `BUNDLE_CACHE_DIR` instead,
+    and bundles are only opened from directories and files no other user can write to, as they are unpickled.
+
+    Args:
+        template_dir (str | Path): The directory of the template.
+
+    Returns:
+        TemplateBundle: The bundle of the template.
+    """
+    template_dir = Path(template_dir)
+    candidates = [template_dir / BUNDLE_NAME]
+    if BUNDLE_CACHE_DIR:
+        # keyed by the full path, templates of the same name may live in different directories
+        key = hashlib.sha256(str(template_dir.resolve()).encode()).hexdigest()[:16]
+        candidates.append(
+            Path(BUNDLE_CACHE_DIR) / f"{template_dir.name}-{key}" / BUNDLE_NAME
+        )
+    for path in candidates:
+        if not path.exists():
+            continue
+        if not (_is_trusted(path.parent) and _is_trusted(path)):
+            logger.warning("Ignoring bundle %s writable by other users", path)
+            continue
+        try:
+            bundle = TemplateBundle(path)
+        except ValueError as e:
+            logger.info("Ignoring bundle %s: %s", path, e)
+            continue
+        if not bundle.is_stale(template_dir):
+            return bundle
+        bundle.close()
+
+    for path in candidates:
+        try:
+            if path.parent != template_dir:
+                _private_dir(path.parent)
+            elif not _is_trusted(template_dir):
+                continue
+            return TemplateBundle(compile_template(template_dir, path))
+        except OSError as e:
+            logger.warning("Failed to write bundle %s: %s", path, e)
+    raise OSError(f"Unable to compile template {template_dir.name}")
+
+
+@dataclass
+class LoadedTemplate:
+    """
+    A template loaded from its bundle, the presentation is shared and must not be modified.
+    The bundle is closed on eviction, its metadata stays available.
+    """
+
+    name: str
+    bundle: TemplateBundle
+    presentation: Presentation
+
+    @property
+    def size(self) -> int:
+        """
+        The estimated memory footprint, by the size of the pickled slides.
+        """
+        return self.bundle.header["sections"]["slides"][1]
+
+    @property
+    def description(self) -> str:
+        return self.bundle.description
+
+    @property
+    def slide_induction(self) -> dict:
+        return self.bundle.slide_induction
+
+    def template_html(self) -> dict[int, str] | None:
+        return self.bundle.template_html()
+
+
+class TemplateCache:
+    """
+    Load templates on first use, and keep the recently used ones resident under a count and memory budget.
+
+    The descriptions of all templates are indexed at creation without opening any template.
+    """
+
+    def __init__(
+        self,
+        templates_dir: str | Path,
+        max_templates: int = TEMPLATE_CACHE_SIZE,
+        max_bytes: int = TEMPLATE_CACHE_MB << 20,
+    ):
+        """
+        Initialize the TemplateCache.
+
+        Args:
+            templates_dir (str | Path): The directory containing a directory for each template.
+            max_templates (int): The number of resident templates, 0 means unlimited.
+            max_bytes (int): The estimated memory of resident templates, 0 means unlimited.
+        """
+        self.templates_dir = Path(templates_dir)
+        self.max_templates = max_templates
+        self.max_bytes = max_bytes
+        self.descriptions = self._build_index()
+        self._resident: OrderedDict[str, LoadedTemplate] = OrderedDict()
+        self._loading: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _build_index(self) -> dict[str, str]:
+        index = {}
+        for template_dir in sorted(self.templates_dir.iterdir()):
+            if not (template_dir / "source.pptx").exists():
+                continue
+            description_path = template_dir / "description.txt"
+            index[template_dir.name] = (
+                description_path.read_text() if description_path.exists() else ""
+            )
+        return index
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.descriptions
+
+    def __len__(self) -> int:
+        return len(self.descriptions)
+
+    def keys(self) -> list[str]:
+        return list(self.descriptions)
+
+    def get(self, name: str) -> LoadedTemplate:
+        """
+        Get a template, loading it from its bundle if it is not resident.
+
+        Args:
+            name (str): The name of the template.
+
+        Returns:
+            LoadedTemplate: The loaded template.
+
+        Raises:
+            KeyError: If the template does not exist.
+        """
+        if name not in self.descriptions:
+            raise KeyError(f"Template {name} not found")
+        # the lock is only held for bookkeeping, concurrent loads of a template wait for the same future
+        with self._lock:
+            template = self._resident.get(name)
+            if template is not None:
+                self.hits += 1
+                self._resident.move_to_end(name)
+                return template
+            future = self._loading.get(name)
+            if future is None:
+                self.misses += 1
+                future = self._loading[name] = Future()
+                loading = True
+            else:
+                loading = False
+        if not loading:
+            return future.result()
+
+        try:
+            template = self._load(name)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[name]
+            self._resident[name] = template
+            self._evict()
+            logger.debug(
+                "Loaded template %s, %d templates resident", name, len(self._resident)
+            )
+        future.set_result(template)
+        return template
+
+    def _load(self, name: str) -> LoadedTemplate:
+        template_dir = self.templates_dir / name
+        bundle = load_bundle(template_dir)
+        try:
+            presentation = bundle.load_presentation(Config(str(template_dir)))
+            # read while mapped, sessions still use the metadata after the bundle is evicted
+            bundle.metadata
+        except BaseException:
+            bundle.close()
+            raise
+        return LoadedTemplate(name, bundle, presentation)
+
+    def _evict(self):
+        # the most recently used template is always kept, even if it exceeds the budget alone
+        while len(self._resident) > 1 and (
+            (self.max_templates and len(self._resident) > self.max_templates)
+            or (self.max_bytes and self.resident_size > self.max_bytes)
+        ):
+            name, template = self._resident.popitem(last=False)
+            template.bundle.close()
+            self.evictions += 1
+            logger.debug("Evicted template %s", name)
+
+    @property
+    def resident(self) -> list[str]:
+        return list(self._resident)
+
+    @property
+    def resident_size(self) -> int:
+        return sum(template.size for template in self._resident.values())
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "templates": len(self.descriptions),
+            "resident": len(self._resident),
+            "resident_size": self.resident_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile PPTAgent templates into bundles for instant loading."
+    )
+    parser.add_argument(
+        "template_dirs",
+        nargs="*",
+        help="Template directories, defaults to all templates shipped with pptagent.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Path of the bundle, only valid with a single template directory.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Recompile bundles which are up to date.",
+    )
+    args = parser.parse_args()
+    template_dirs = [Path(d) for d in args.template_dirs] or [
+        p for p in Path(package_join("templates")).iterdir() if p.is_dir()
+    ]
+    if args.output is not None and len(template_dirs) != 1:
+        parser.error("--output requires exactly one template directory")
+
+    for template_dir in template_dirs:
+        output = Path(args.output or template_dir / BUNDLE_NAME)
+        if not args.force and output.exists():
+            try:
+                bundle = TemplateBundle(output)
+                stale = bundle.is_stale(template_dir)
+                bundle.close()
+                if not stale:
+                    print(f"{template_dir.name}: up to date")
+                    continue
+            except ValueError:
+                pass
+        compile_template(template_dir, output)
+        print(f"{template_dir.name}: compiled to {output}")
+
+
+if __name__ == "__main__":
+    main()
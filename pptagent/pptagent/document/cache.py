@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import threading
+from dataclasses import fields
+from functools import cache
+from os.path import exists, join
+from typing import Any
+
+from pydantic import BaseModel
+
+from pptagent.llms import AsyncLLM
+from pptagent.utils import get_logger, package_join
+
+from .element import Media, Section, Table
+
+logger = get_logger(__name__)
+
+# the directory of the on-disk document cache, unset to disable
+DOCUMENT_CACHE_DIR = os.environ.get("PPTAGENT_DOCUMENT_CACHE") or None
+# the fields of a model that do not affect its responses
+IGNORED_MODEL_FIELDS = {"api_key", "timeout", "cache"}
+# bump when the layout of cached entries or the parsing of documents changes
+DOCUMENT_CACHE_FORMAT = 2
+# the prompts whose outputs end up in a parsed document
+PROMPT_FILES = [
+    ("roles", "doc_extractor.yaml"),
+    ("prompts", "document", "heading_extract.txt"),
+    ("prompts", "document", "markdown_image_caption.txt"),
+    ("prompts", "document", "markdown_table_caption.txt"),
+    ("prompts", "document", "merge_metadata.txt"),
+]
+# resolved again whenever a cached section is loaded
+MEDIA_STATE = {"content": {"__all__": {"path", "caption"}}}
+
+
+@cache
+def prompt_versions() -> dict[str, str]:
+    """
+    Get the content hash of each prompt used to parse a document.
+    """
+    versions = {}
+    for parts in PROMPT_FILES:
+        with open(package_join(*parts), "rb") as f:
+            versions["/".join(parts)] = hashlib.sha256(f.read()).hexdigest()[:16]
+    return versions
+
+
+def model_identity(model: AsyncLLM) -> dict[str, Any]:
+    """
+    Get everything about a model that may change its responses: its class, its fields and the endpoint of its client.
+    """
+    identity = {
+        field.name: getattr(model, field.name)
+        for field in fields(model)
+        if field.name not in IGNORED_MODEL_FIELDS
+    }
+    identity["class"] = type(model).__qualname__
+    identity["client"] = {
+        "class": type(model.client).__qualname__,
+        "base_url": str(model.client.base_url),
+    }
+    return identity
+
+
+def content_hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class DocumentCache:
+    """
+    An on-disk cache of parsed documents, shared across runs and processes.
+
+    Entries are grouped in a namespace per (language model, vision model, prompt versions), and keyed by content hash:
+    - documents: the serialised `Document` of a whole markdown file, reused when the markdown is unchanged.
+    - chunks: the metadata and `Section` extracted from a chunk, so an edited document only reprocesses changed chunks.
+    - captions: the caption of an image (by image bytes and context) or a table (by markdown and context).
+
+    A model is identified by its class, fields and client endpoint, see `model_identity`.
+    Cached sections do not carry media paths or captions: paths are resolved again against the image directory,
+    and captions are looked up by the current content of the media, so replaced images are captioned again.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        language_model: AsyncLLM,
+        vision_model: AsyncLLM,
+    ):
+        """
+        Initialize the DocumentCache.
+
+        Args:
+            cache_dir (str): The root directory of the cache.
+            language_model (AsyncLLM): The model extracting sections, metadata and table captions.
+            vision_model (AsyncLLM): The model captioning images.
+        """
+        namespace = {
+            "format": DOCUMENT_CACHE_FORMAT,
+            "language_model": model_identity(language_model),
+            "vision_model": model_identity(vision_model),
+            "prompts": prompt_versions(),
+        }
+        self.namespace = hashlib.sha256(
+            json.dumps(namespace, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+        self.store_dir = join(cache_dir, self.namespace)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+        if not exists(join(self.store_dir, "namespace.json")):
+            with open(join(self.store_dir, "namespace.json"), "w") as f:
+                json.dump(namespace, f, indent=2, default=str)
+
+    def _path(self, kind: str, key: str) -> str:
+        return join(self.store_dir, kind, key[:2], key + ".json")
+
+    def _read(self, kind: str, key: str):
+        path = self._path(kind, key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            value = None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring corrupted document cache entry %s: %s", path, e)
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _write(self, kind: str, key: str, value):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temporary file first, readers never see partial entries
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _dump_section(section: Section) -> dict:
+        return section.model_dump(mode="json", exclude=MEDIA_STATE)
+
+    def get_document(self, markdown_content: str) -> dict | None:
+        """
+        Get the serialised document parsed from the markdown, with media paths and captions left unset.
+        """
+        document = self._read("documents", content_hash(markdown_content))
+        if document is not None:
+            document["sections"] = [
+                Section(**section) for section in document["sections"]
+            ]
+        return document
+
+    def put_document(self, markdown_content: str, document: BaseModel):
+        self._write(
+            "documents",
+            content_hash(markdown_content),
+            document.model_dump(
+                mode="json",
+                exclude={"image_dir": True, "sections": {"__all__": MEDIA_STATE}},
+            ),
+        )
+
+    def get_chunk(self, markdown_chunk: str) -> tuple[list[dict], Section] | None:
+        """
+        Get the metadata and section extracted from a markdown chunk, with media paths and captions left unset.
+        """
+        chunk = self._read("chunks", content_hash(markdown_chunk))
+        if chunk is None:
+            return None
+        return chunk["metadata"], Section(**chunk["section"])
+
+    def put_chunk(self, markdown_chunk: str, metadata: list[dict], section: Section):
+        self._write(
+            "chunks",
+            content_hash(markdown_chunk),
+            {"metadata": metadata, "section": self._dump_section(section)},
+        )
+
+    @staticmethod
+    def caption_key(media: Media) -> str:
+        if isinstance(media, Table):
+            return content_hash("table", media.markdown_content, *media.near_chunks)
+        with open(media.path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return content_hash("image", digest, *media.near_chunks)
+
+    def load_captions(self, medias: list[Media]) -> dict[str, Media]:
+        """
+        Fill in the cached captions of parsed medias.
+
+        Returns:
+            dict[str, Media]: The medias without a cached caption, by caption key, to be saved with `save_captions`.
+        """
+        missing = {}
+        for media in medias:
+            if media.caption is not None:
+                continue
+            key = self.caption_key(media)
+            entry = self._read("captions", key)
+            if entry is None:
+                missing[key] = media
+            else:
+                media.caption = entry["caption"]
+        return missing
+
+    def save_captions(self, medias: dict[str, Media]):
+        for key, media in medias.items():
+            if media.caption is not None:
+                self._write("captions", key, {"caption": media.caption})
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,13 +1,15 @@
 import os
 import re
+from bisect import bisect_left, bisect_right
 from contextvars import ContextVar
+from dataclasses import dataclass
 
 from bs4 import BeautifulSoup
 from jinja2 import Environment, StrictUndefined
 from pydantic import BaseModel
 
 from pptagent.llms import AsyncLLM
-from pptagent.utils import edit_distance, package_join
+from pptagent.utils import most_similar, package_join
 
 env = Environment(undefined=StrictUndefined)
 
@@ -26,112 +28,149 @@ MIN_CHUNK_SIZE: int = os.getenv("MIN_CHUNK_SIZE", 512)
 MAX_CHUNK_SIZE: int = os.getenv("MAX_CHUNK_SIZE", 32768)
 
 
-def count_markdown_chunks(markdown_text):
-    """
-    Count characters in each heading chunk of a Markdown document
-
-    Args:
-        markdown_text (str): Markdown text content
+HEADING_REGEX = re.compile(r"^(#{1,6})[^\S\n]+(.+)", re.MULTILINE)
+HEADING_LINE_REGEX = re.compile(r"^#.*", re.MULTILINE)
 
-    Returns:
-        list: List containing heading information and character counts
-    """
-    lines = markdown_text.split("\n")
-    chunks = []
-    current_heading = None
-    current_content = []
-    current_level = 0
-
-    for line in lines:
-        # Check if the line is a heading
-        heading_match = re.match(r"^(#{1,6})\s+(.+)", line)
-
-        if heading_match:
-            # Save the previous chunk if exists
-            if current_heading is not None:
-                content_text = "\n".join(current_content)
-                char_count = len(content_text.strip())
-                chunks.append(
-                    {
-                        "level": current_level,
-                        "heading": current_heading,
-                        "char_count": char_count,
-                        "content": content_text.strip(),
-                    }
-                )
-
-            # Start a new chunk
-            current_level = len(heading_match.group(1))
-            current_heading = heading_match.group(2).strip()
-            current_content = []
-        else:
-            # Non-heading line, add to current content
-            current_content.append(line)
-
-    # Handle the last chunk
-    if current_heading is not None:
-        content_text = "\n".join(current_content)
-        char_count = len(content_text.strip())
-        chunks.append(
-            {
-                "level": current_level,
-                "heading": current_heading,
-                "char_count": char_count,
-                "content": content_text.strip(),
-            }
-        )
 
-    return chunks
+def strip_span(text: str, start: int, end: int) -> tuple[int, int]:
+    """Shrink a span of the text to exclude leading and trailing whitespace, like `str.strip` without copying."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
 
 
-def calculate_hierarchical_counts(chunks):
+def iter_heading_lines(text: str, pattern: re.Pattern = HEADING_LINE_REGEX):
     """
-    Calculate character statistics including parent-child relationships
-
-    Args:
-        chunks (list): Original chunk list
-
-    Returns:
-        list: Chunk list with hierarchical statistics
+    Match a pattern at the start of every line beginning with `#`.
+    Jumping between candidate lines with `str.find` is much faster than a multiline regex scan of the whole text.
+    """
+    pos = 0 if text.startswith("#") else text.find("\n#")
+    while pos != -1:
+        if text[pos] == "\n":
+            pos += 1
+        match = pattern.match(text, pos)
+        if match is not None:
+            yield match
+        pos = text.find("\n#", pos)
+
+
+@dataclass
+class OutlineNode:
+    """
+    A heading of a markdown document, located by character offsets:
+    the heading line starts at `start`, its direct content spans `content_start` to `content_end`,
+    and its subtree (content and all descendants) ends at `end`.
     """
 
-    def get_children_count(parent_index, parent_level):
-        """Recursively calculate total character count of child headings"""
-        total = 0
-        for i in range(parent_index + 1, len(chunks)):
-            current_level = chunks[i]["level"]
-
-            # Stop if encountering same or higher level heading
-            if current_level <= parent_level:
-                break
-
-            # Count all child direct character counts
-            if current_level > parent_level:
-                total += chunks[i]["char_count"]
-
-        return total
-
-    # Add hierarchical statistics to each chunk
-    for i, chunk in enumerate(chunks):
-        # Direct content character count
-        chunk["direct_char_count"] = chunk["char_count"]
+    level: int
+    heading: str
+    start: int
+    content_start: int
+    content_end: int = 0
+    end: int = 0
+    parent: int | None = None
+    char_count: int = 0
+    children_char_count: int = 0
 
-        # Children content character count
-        children_count = get_children_count(i, chunk["level"])
-        chunk["children_char_count"] = children_count
+    @property
+    def total_char_count(self) -> int:
+        return self.char_count + self.children_char_count
 
-        # Total character count (self + all children)
-        chunk["total_char_count"] = chunk["char_count"] + children_count
 
-    return chunks
+class MarkdownOutline:
+    """
+    The heading tree of a markdown document, built in a single stack-based scan.
 
+    Each heading knows its parent, the size of its direct content, of its descendants and in total,
+    and the offsets of its heading line, content and subtree, so the document is sliced without re-splitting lines.
+    """
 
-def display_results(chunks):
+    def __init__(self, text: str):
+        self.text = text
+        self.nodes: list[OutlineNode] = []
+        stack: list[int] = []
+        for match in iter_heading_lines(text, HEADING_REGEX):
+            self._close_content(match.start())
+            level = len(match.group(1))
+            while stack and self.nodes[stack[-1]].level >= level:
+                self._close_subtree(stack.pop(), match.start())
+            self.nodes.append(
+                OutlineNode(
+                    level=level,
+                    heading=match.group(2).strip(),
+                    start=match.start(),
+                    content_start=match.end(),
+                    parent=stack[-1] if stack else None,
+                )
+            )
+            stack.append(len(self.nodes) - 1)
+        self._close_content(len(text))
+        while stack:
+            self._close_subtree(stack.pop(), len(text))
+        self.starts = [node.start for node in self.nodes]
+
+    def _close_content(self, end: int):
+        if self.nodes:
+            node = self.nodes[-1]
+            node.content_end = end
+            start, end = strip_span(self.text, node.content_start, end)
+            node.char_count = end - start
+
+    def _close_subtree(self, idx: int, end: int):
+        node = self.nodes[idx]
+        node.end = end
+        if node.parent is not None:
+            self.nodes[node.parent].children_char_count += node.total_char_count
+
+    def slice(self, span: tuple[int, int]) -> str:
+        return self.text[span[0] : span[1]]
+
+    def split_span(self, start: int, end: int, max_size: int) -> list[tuple[int, int]]:
+        """
+        Split a span of the text into stripped spans of at most `max_size` characters,
+        cutting at the heading nearest the middle until the spans fit or have no heading to cut at.
+
+        Args:
+            start (int): The start offset of the span.
+            end (int): The end offset of the span.
+            max_size (int): The maximum number of characters of a span.
+
+        Returns:
+            list[tuple[int, int]]: The (start, end) offsets of the spans, in order.
+        """
+        spans = []
+        pending = [strip_span(self.text, start, end)]
+        while pending:
+            start, end = pending.pop()
+            if end <= start:
+                continue
+            # headings strictly inside the span, cutting at the first line would not make progress
+            lo = bisect_right(self.starts, start)
+            hi = bisect_left(self.starts, end)
+            if end - start <= max_size or lo >= hi:
+                spans.append((start, end))
+                continue
+            middle = (start + end) // 2
+            idx = bisect_left(self.starts, middle, lo, hi)
+            if idx == hi or (
+                idx > lo and middle - self.starts[idx - 1] <= self.starts[idx] - middle
+            ):
+                idx -= 1
+            cut = self.starts[idx]
+            # the second part is pushed first so the first part is processed first
+            pending.append(strip_span(self.text, cut, end))
+            pending.append(strip_span(self.text, start, cut))
+        return spans
+
+
+def display_results(outline: MarkdownOutline):
     """
     Format and display statistics results
 
     Args:
-        chunks (list): Heading chunk list
+        outline (MarkdownOutline): The outline of a markdown document
     """
     print("Markdown Heading Character Statistics:")
     print("=" * 80)
@@ -139,25 +178,25 @@ def display_results(chunks):
     total_chars = 0
     root_total = 0
 
-    for i, chunk in enumerate(chunks, 1):
-        indent = "  " * (chunk["level"] - 1)
-        heading_prefix = "#" * chunk["level"]
+    for i, node in enumerate(outline.nodes, 1):
+        indent = "  " * (node.level - 1)
+        heading_prefix = "#" * node.level
 
-        print(f"{i}. {indent}{heading_prefix} {chunk['heading']}")
-        print(f"   {indent}├─ Direct content: {chunk['direct_char_count']} characters")
+        print(f"{i}. {indent}{heading_prefix} {node.heading}")
+        print(f"   {indent}├─ Direct content: {node.char_count} characters")
 
-        if chunk["children_char_count"] > 0:
+        if node.children_char_count > 0:
             print(
-                f"   {indent}├─ Children content: {chunk['children_char_count']} characters"
+                f"   {indent}├─ Children content: {node.children_char_count} characters"
             )
-            print(f"   {indent}└─ Total: {chunk['total_char_count']} characters")
+            print(f"   {indent}└─ Total: {node.total_char_count} characters")
         else:
-            print(f"   {indent}└─ Total: {chunk['total_char_count']} characters")
+            print(f"   {indent}└─ Total: {node.total_char_count} characters")
 
-        total_chars += chunk["direct_char_count"]
+        total_chars += node.char_count
 
-        if chunk["level"] == 1:
-            root_total += chunk["total_char_count"]
+        if node.level == 1:
+            root_total += node.total_char_count
 
         print()
 
@@ -166,64 +205,31 @@ def display_results(chunks):
     print(f"Root level total: {root_total}")
 
 
-def get_tree_structure(markdown: str, add_tag: bool = True):
+def get_tree_structure(markdown: str | MarkdownOutline, add_tag: bool = True):
     """
     Display tree structure statistics
 
     Args:
-        markdown (str): Markdown content
+        markdown (str | MarkdownOutline): Markdown content, or its outline
     """
-    chunks = count_markdown_chunks(markdown.strip())
-    chunks_with_hierarchy = calculate_hierarchical_counts(chunks)
+    if isinstance(markdown, str):
+        markdown = MarkdownOutline(markdown.strip())
 
-    tree = ""
-    for chunk in chunks_with_hierarchy:
-        indent = "  " * (chunk["level"] - 1)
-        tree_symbol = "├─" if chunk["level"] > 1 else "■"
+    tree = []
+    for node in markdown.nodes:
+        indent = "  " * (node.level - 1)
+        tree_symbol = "├─" if node.level > 1 else "■"
         if add_tag:
-            heading = f"<title>{chunk['heading']}</title>"
+            heading = f"<title>{node.heading}</title>"
         else:
-            heading = chunk["heading"]
+            heading = node.heading
 
-        tree += (
+        tree.append(
             f"{indent}{tree_symbol} {heading} "
-            f"[Total Characters:{chunk['total_char_count']}]\n"
+            f"[Total Characters:{node.total_char_count}]\n"
         )
 
-    return tree
-
-
-def find_middle_heading_position(text: str) -> int:
-    """
-    Find a heading position near the middle of the text.
-
-    Args:
-        text (str): Markdown text to analyze
-
-    Returns:
-        int: Position index of the chosen heading, or -1 if no headings found
-    """
-    lines = text.splitlines()
-    middle_char_pos = len(text) // 2
-
-    # Find all headings and their positions
-    heading_positions = []
-    char_pos = 0
-
-    for i, line in enumerate(lines):
-        if re.match(r"^#{1,6}\s+.+", line):
-            heading_positions.append((i, char_pos))
-        char_pos += len(line)
-
-    if len(heading_positions) < 2:
-        return -1
-
-    # Find heading closest to the middle
-    closest_heading = min(heading_positions, key=lambda x: abs(x[1] - middle_char_pos))[
-        0
-    ]
-
-    return closest_heading
+    return "".join(tree)
 
 
 def split_large_chunks(sections: list[str]) -> list[str]:
@@ -241,42 +247,69 @@ def split_large_chunks(sections: list[str]) -> list[str]:
         if len(section) <= MAX_CHUNK_SIZE:
             result.append(section)
             continue
+        outline = MarkdownOutline(section)
+        result.extend(
+            outline.slice(span)
+            for span in outline.split_span(0, len(section), MAX_CHUNK_SIZE)
+        )
+    return result
 
-        # Try to split the section at a heading near the middle
-        lines = section.splitlines()
-        middle_heading_idx = find_middle_heading_position(section)
 
-        # If no headings found or can't split further, just keep as is
-        if middle_heading_idx == -1:
-            result.append(section)
-            continue
+class HeadingIndex:
+    """
+    An index of heading lines, built once per document.
 
-        # Split the section at the middle heading
-        first_part = "\n".join(lines[:middle_heading_idx]).strip()
-        second_part = "\n".join(lines[middle_heading_idx:]).strip()
+    `resolve` maps a heading picked by the model to the closest heading line: an exact hash lookup of the line,
+    then of its title (the line without the leading `#`), and a bounded fuzzy match only for the remaining misses.
+    `match` tells whether a line starts with one of the headings: a hash lookup, then a compiled alternation.
+    """
 
-        # Recursively split if still too large
-        result.extend(split_large_chunks([first_part, second_part]))
+    def __init__(self, headings: list[str]):
+        self.headings = list(dict.fromkeys(headings))
+        self._lines = set(self.headings)
+        # the shortest heading line of a title is the most similar to the bare title
+        self._titles: dict[str, str] = {}
+        for heading in self.headings:
+            title = heading.lstrip("#").strip()
+            if len(heading) < len(self._titles.get(title, heading + " ")):
+                self._titles[title] = heading
+        # longer alternatives first, so a heading is never shadowed by its own prefix
+        self._prefix = re.compile(
+            "|".join(re.escape(h) for h in sorted(self.headings, key=len, reverse=True))
+        )
 
-    return result
+    def resolve(self, heading: str) -> str | None:
+        if heading in self._lines:
+            return heading
+        title = self._titles.get(heading.lstrip("#").strip())
+        if title is not None:
+            return title
+        return most_similar(heading, self.headings)
+
+    def match(self, line: str) -> bool:
+        if not self.headings:
+            return False
+        return line in self._lines or self._prefix.match(line) is not None
 
 
 # global context variable for allowed headings, used to validate headings in async context
-_allowed_headings: ContextVar[list[str]] = ContextVar("allowed_headings", default=[])
+_allowed_headings: ContextVar[HeadingIndex] = ContextVar(
+    "allowed_headings", default=HeadingIndex([])
+)
 
 
 class LogicHeadings(BaseModel):
     headings: list[str]
 
     def model_post_init(self, _):
-        self.headings = [
-            max(_allowed_headings.get(), key=lambda x: edit_distance(x, h))
-            for h in self.headings
-        ]
+        index = _allowed_headings.get()
+        if not index.headings:
+            raise ValueError("No allowed headings to resolve the headings against")
+        self.headings = [index.resolve(h) for h in self.headings]
 
     @classmethod
     def response_model(cls, allowed_headings: list[str]):
-        _allowed_headings.set(allowed_headings)
+        _allowed_headings.set(HeadingIndex(allowed_headings))
         return cls
 
 
@@ -285,6 +318,7 @@ async def split_markdown_by_headings(
     headings: list[str],
     document_tree: str,
     language_model: AsyncLLM,
+    outline: MarkdownOutline | None = None,
 ) -> list[str]:
     """
     Split markdown content using headings as separators.
@@ -292,8 +326,9 @@ async def split_markdown_by_headings(
     Args:
         markdown_content (str): The markdown content to split
         headings (list[str]): List of heading strings to split by
-        adjusted_headings (list[str], optional): List of adjusted heading strings
-        min_chunk_size (int, optional): Minimum chunk size. Defaults to 64.
+        document_tree (str): The heading tree of the document, for the model to pick the logical headings
+        language_model (AsyncLLM): The model picking the logical headings
+        outline (MarkdownOutline, optional): The outline of the stripped markdown content, built if not given
 
     Returns:
         list[str]: List of content sections
@@ -308,30 +343,34 @@ async def split_markdown_by_headings(
         )
         logic_headings = LogicHeadings(**logic_headings).headings
 
-    sections = []
-    current_section = []
-
-    for line in markdown_content.splitlines():
-        if any(line.startswith(h) for h in logic_headings):
-            if len(current_section) != 0:
-                sections.append("\n".join(current_section).strip())
-            current_section = [line]
-        else:
-            current_section.append(line)
-
-    if len(current_section) != 0:
-        sections.append("\n".join(current_section).strip())
+    if outline is None:
+        outline = MarkdownOutline(markdown_content.strip())
+    text = outline.text
+    # any line starting with a logical heading is a cut, not only the well-formed headings of the outline
+    index = HeadingIndex(logic_headings)
+    cuts = [
+        match.start()
+        for match in iter_heading_lines(text)
+        if index.match(match.group())
+    ]
+    bounds = [0, *cuts, len(text)]
+    spans = [strip_span(text, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    spans = [span for span in spans if span[1] > span[0]]
 
     # if a chunk is too small, merge it with the previous chunk
-    for i in reversed(range(1, len(sections))):
-        if len(sections[i]) < MIN_CHUNK_SIZE:
-            sections[i - 1] += "\n\n" + sections.pop(i)
+    for i in reversed(range(1, len(spans))):
+        if spans[i][1] - spans[i][0] < MIN_CHUNK_SIZE:
+            spans[i - 1] = (spans[i - 1][0], spans.pop(i)[1])
 
-    if len(sections) > 1 and len(sections[0]) < MIN_CHUNK_SIZE:
-        sections[0] += "\n\n" + sections.pop(1)
+    if len(spans) > 1 and spans[0][1] - spans[0][0] < MIN_CHUNK_SIZE:
+        spans[0] = (spans[0][0], spans.pop(1)[1])
 
     # Split sections that exceed MAX_CHUNK_SIZE
-    sections = split_large_chunks(sections)
+    sections = [
+        outline.slice(piece)
+        for span in spans
+        for piece in outline.split_span(*span, MAX_CHUNK_SIZE)
+    ]
 
     return sections
 
@@ -343,14 +382,16 @@ def process_markdown_content(
     """
     Process markdown content into paragraphs and media elements.
 
+    The context of a media is the text paragraphs right before and after it, each side growing paragraph by paragraph
+    until it exceeds `max_chunk_size` characters. Both sides are found by bisecting the prefix sums of the paragraph
+    lengths and sliced out of the cleaned markdown, so the cost per media does not depend on its position.
+
     Args:
         markdown_content (str): The original markdown text
         max_chunk_size (int, optional): Maximum chunk size. Defaults to 256.
-        table_regex (Pattern, optional): Regex to identify tables
-        image_regex (Pattern, optional): Regex to identify images
 
     Returns:
-        list: List of media elements with their context
+        tuple[str, list[dict]]: The markdown without medias, and the media elements with their context
     """
     paragraphs = []
     medias_chunks = []
@@ -361,37 +402,42 @@ def process_markdown_content(
         if not para:
             continue
 
-        paragraph = {"markdown_content": para, "index": i}
-
         if MARKDOWN_TABLE_REGEX.match(para):
-            paragraph["type"] = "table"
-            medias_chunks.append(paragraph)
+            media_type = "table"
         elif MARKDOWN_IMAGE_REGEX.match(para):
-            paragraph["type"] = "image"
-            medias_chunks.append(paragraph)
+            media_type = "image"
         else:
-            paragraphs.append(paragraph)
+            paragraphs.append(para)
+            continue
+        # the number of text paragraphs before the media, i.e. its position among them
+        medias_chunks.append(
+            {
+                "markdown_content": para,
+                "index": i,
+                "type": media_type,
+                "position": len(paragraphs),
+            }
+        )
+
+    # offsets[k] is where the k-th text paragraph starts in `context`, each paragraph followed by a blank line
+    context = "".join(f"{para}\n\n" for para in paragraphs)
+    offsets = [0]
+    for para in paragraphs:
+        offsets.append(offsets[-1] + len(para) + 2)
 
     # Add context to each media element
     for media in medias_chunks:
-        pre_chunk = ""
-        after_chunk = ""
-
-        # Get preceding context
-        for chunk in paragraphs[: media["index"]]:
-            pre_chunk += chunk["markdown_content"] + "\n\n"
-            if len(pre_chunk) > max_chunk_size:
-                break
-
-        # Get following context
-        for chunk in paragraphs[media["index"] + 1 :]:
-            after_chunk += chunk["markdown_content"] + "\n\n"
-            if len(after_chunk) > max_chunk_size:
-                break
-
-        media["near_chunks"] = (pre_chunk, after_chunk)
+        position = media.pop("position")
+        end = offsets[position]
+        # the preceding paragraphs start after the last offset leaving more than max_chunk_size characters
+        start = offsets[max(bisect_left(offsets, end - max_chunk_size) - 1, 0)]
+        # the following paragraphs end at the first offset with more than max_chunk_size characters
+        after_end = offsets[
+            min(bisect_right(offsets, end + max_chunk_size), len(offsets) - 1)
+        ]
+        media["near_chunks"] = (context[start:end], context[end:after_end])
 
-    cleaned_markdown = "\n\n".join([p["markdown_content"] for p in paragraphs])
+    cleaned_markdown = context[:-2]
     return cleaned_markdown, medias_chunks
 
 
@@ -5,18 +5,24 @@ from contextlib import AsyncExitStack
 from os.path import basename, exists, join
 
 from jinja2 import Environment, StrictUndefined
-from pydantic import BaseModel, Field, create_model
+from pydantic import BaseModel, Field, PrivateAttr, create_model
 
 from pptagent.agent import Agent
 from pptagent.llms import AsyncLLM
 from pptagent.model_utils import language_id
 from pptagent.utils import (
+    FuzzyIndex,
     Language,
+    TableRenderer,
     get_logger,
+    monitor_event_loop,
     package_join,
+    run_in_thread,
 )
 
+from .cache import DOCUMENT_CACHE_DIR, DocumentCache
 from .doc_utils import (
+    MarkdownOutline,
     get_tree_structure,
     process_markdown_content,
     split_markdown_by_headings,
@@ -40,6 +46,14 @@ class Document(BaseModel):
     language: Language
     metadata: dict[str, str]
     sections: list[Section]
+    _sections: dict[str, int] = PrivateAttr(default_factory=dict)
+    _positions: list[tuple[int, int]] = PrivateAttr(default_factory=list)
+    _position_of: dict[int, int] = PrivateAttr(default_factory=dict)
+    _media_by_path: dict[str, int] = PrivateAttr(default_factory=dict)
+    _media_by_caption: dict[str, int] = PrivateAttr(default_factory=dict)
+    _indexed: tuple[int, int] | None = PrivateAttr(default=None)
+    _section_states: list[tuple[Section, int, int]] = PrivateAttr(default_factory=list)
+    _media_index: FuzzyIndex | None = PrivateAttr(default=None)
 
     def validate_medias(self, image_dir: str | None = None):
         """Validate and fix media file paths"""
@@ -77,14 +91,74 @@ class Document(BaseModel):
         for section in self.sections:
             yield from section.iter_medias()
 
+    @property
+    def media_index(self) -> FuzzyIndex:
+        """The approximate-match index over media paths, rebuilt when the paths change"""
+        paths = [media.path for media in self.iter_medias()]
+        if self._media_index is None or self._media_index.items != paths:
+            self._media_index = FuzzyIndex(paths)
+        return self._media_index
+
+    async def render_tables(self, max_at_once: int | None = 8):
+        """Render the images of all tables in the document concurrently"""
+        await TableRenderer.render_many(
+            [
+                (media.markdown_content, media.path)
+                for media in self.iter_medias()
+                if isinstance(media, Table) and media.path is not None
+            ],
+            max_at_once=max_at_once,
+        )
+
     def find_media(self, caption: str | None = None, path: str | None = None):
-        """Find media by caption or path"""
-        for media in self.iter_medias():
-            if caption is not None and media.caption == caption:
-                return media
-            if path is not None and media.path == path:
-                return media
-        raise ValueError(f"Image caption or path not found: {caption} or {path}")
+        """Find media by caption or path, the earliest one if both match"""
+        found = [
+            self._lookup_media("caption", caption),
+            self._lookup_media("path", path),
+        ]
+        found = [position for position in found if position is not None]
+        if not found:
+            raise ValueError(f"Image caption or path not found: {caption} or {path}")
+        return self[min(found)]
+
+    @classmethod
+    async def _parse_medias(
+        cls,
+        section: Section,
+        image_dir: str,
+        language_model: AsyncLLM,
+        vision_model: AsyncLLM,
+        cache: DocumentCache | None = None,
+        render_existing: bool = True,
+    ):
+        """Resolve the media paths of a section, render its tables and caption its medias"""
+        async with asyncio.TaskGroup() as tg:
+            for media in section.iter_medias():
+                if isinstance(media, Table):
+                    tg.create_task(media.parse_async(image_dir))
+                else:
+                    tg.create_task(run_in_thread(media.parse, image_dir))
+        await TableRenderer.render_many(
+            [
+                (media.markdown_content, media.path)
+                for media in section.iter_medias()
+                if isinstance(media, Table)
+                and (render_existing or not exists(media.path))
+            ]
+        )
+        uncaptioned = {}
+        if cache is not None:
+            uncaptioned = await run_in_thread(
+                cache.load_captions, list(section.iter_medias())
+            )
+        async with asyncio.TaskGroup() as tg:
+            for media in section.iter_medias():
+                if isinstance(media, Table):
+                    tg.create_task(media.get_caption(language_model))
+                else:
+                    tg.create_task(media.get_caption(vision_model))
+        if uncaptioned:
+            await run_in_thread(cache.save_captions, uncaptioned)
 
     @classmethod
     async def _parse_chunk(
@@ -95,26 +169,36 @@ class Document(BaseModel):
         language_model: AsyncLLM,
         vision_model: AsyncLLM,
         limiter: asyncio.Semaphore | AsyncExitStack,
+        cache: DocumentCache | None = None,
     ):
-        markdown, medias = process_markdown_content(
-            markdown_chunk,
-        )
+        cached = None
+        if cache is not None:
+            cached = await run_in_thread(cache.get_chunk, markdown_chunk)
         async with limiter:
-            _, section = await extractor(
-                markdown_document=markdown,
-                response_format=Section.response_model(),
+            if cached is not None:
+                metadata, section = cached
+            else:
+                markdown, medias = process_markdown_content(
+                    markdown_chunk,
+                )
+                _, section = await extractor(
+                    markdown_document=markdown,
+                    response_format=Section.response_model(),
+                )
+                metadata = section.pop("metadata", {})
+                section["content"] = section.pop("subsections")
+                section = Section(**section, markdown_content=markdown_chunk)
+                link_medias(medias, section)
+            await cls._parse_medias(
+                section,
+                image_dir,
+                language_model,
+                vision_model,
+                cache,
+                render_existing=cached is None,
             )
-            metadata = section.pop("metadata", {})
-            section["content"] = section.pop("subsections")
-            section = Section(**section, markdown_content=markdown_chunk)
-            link_medias(medias, section)
-            async with asyncio.TaskGroup() as tg:
-                for media in section.iter_medias():
-                    media.parse(image_dir)
-                    if isinstance(media, Table):
-                        tg.create_task(media.get_caption(language_model))
-                    else:
-                        tg.create_task(media.get_caption(vision_model))
+        if cache is not None and cached is None:
+            await run_in_thread(cache.put_chunk, markdown_chunk, metadata, section)
         return metadata, section
 
     @classmethod
@@ -125,15 +209,55 @@ class Document(BaseModel):
         vision_model: AsyncLLM,
         image_dir: str,
         max_at_once: int | None = None,
+        cache_dir: str | None = DOCUMENT_CACHE_DIR,
     ):
+        """
+        Parse a markdown document into sections, with captioned images and tables.
+
+        Args:
+            markdown_content (str): The markdown content of the document.
+            language_model (AsyncLLM): The model extracting sections, metadata and table captions.
+            vision_model (AsyncLLM): The model captioning images.
+            image_dir (str): The directory of the images, rendered tables are saved here too.
+            max_at_once (int | None): The maximum number of chunks parsed at once.
+            cache_dir (str | None): The document cache directory, unchanged documents and chunks are reused, None to disable.
+
+        Returns:
+            Document: The parsed document.
+        """
+        monitor_event_loop()
+        cache = (
+            DocumentCache(cache_dir, language_model, vision_model)
+            if cache_dir
+            else None
+        )
+        if cache is not None:
+            cached = await run_in_thread(cache.get_document, markdown_content)
+            if cached is not None:
+                async with asyncio.TaskGroup() as tg:
+                    for section in cached["sections"]:
+                        tg.create_task(
+                            cls._parse_medias(
+                                section,
+                                image_dir,
+                                language_model,
+                                vision_model,
+                                cache,
+                                render_existing=False,
+                            )
+                        )
+                logger.debug("Reused the cached document of %s", image_dir)
+                return cls(**cached, image_dir=image_dir)
+
         doc_extractor = Agent(
             "doc_extractor",
             llm_mapping={"language": language_model, "vision": vision_model},
         )
-        document_tree = get_tree_structure(markdown_content)
+        outline = MarkdownOutline(markdown_content.strip())
+        document_tree = get_tree_structure(outline)
         headings = re.findall(r"^#+\s+.*", markdown_content, re.MULTILINE)
         splited_chunks = await split_markdown_by_headings(
-            markdown_content, headings, document_tree, language_model
+            markdown_content, headings, document_tree, language_model, outline
         )
 
         metadata = []
@@ -156,6 +280,7 @@ class Document(BaseModel):
                             language_model,
                             vision_model,
                             limiter,
+                            cache,
                         )
                     )
                 )
@@ -176,49 +301,141 @@ class Document(BaseModel):
             ),
         )
         metadata = {meta["name"]: meta["value"] for meta in merged_metadata["metadata"]}
-        return cls(
+        document = cls(
             image_dir=image_dir,
             language=language_id(markdown_content),
             metadata=metadata,
             sections=sections,
         )
+        if cache is not None:
+            await run_in_thread(cache.put_document, markdown_content, document)
+            logger.debug("Document cache: %s", cache.stats())
+        return document
+
+    def model_post_init(self, _) -> None:
+        self.reindex()
+
+    def reindex(self):
+        """
+        Rebuild the lookup indexes: section by title, flat positions of the content items, and media by path and caption.
+        Mutations through the document keep the indexes updated, and lookups detect sections changed in place.
+        """
+        sections, positions, position_of = {}, [], {}
+        media_by_path, media_by_caption = {}, {}
+        for section_idx, section in enumerate(self.sections):
+            sections.setdefault(section.title, section_idx)
+            for local_idx, content in enumerate(section.content):
+                position_of[id(content)] = len(positions)
+                if isinstance(content, Media):
+                    if content.path is not None:
+                        media_by_path.setdefault(content.path, len(positions))
+                    if content.caption is not None:
+                        media_by_caption.setdefault(content.caption, len(positions))
+                positions.append((section_idx, local_idx))
+        self._sections = sections
+        self._positions = positions
+        self._position_of = position_of
+        self._media_by_path = media_by_path
+        self._media_by_caption = media_by_caption
+        self._indexed = (id(self.sections), len(self.sections))
+        self._section_states = [
+            (section, id(section.content), len(section.content))
+            for section in self.sections
+        ]
+
+    def _section_changed(self, section_idx: int) -> bool:
+        """Check whether a section was replaced, or its content changed in place, since the last reindex"""
+        section = self.sections[section_idx]
+        indexed, content_id, content_len = self._section_states[section_idx]
+        return (
+            section is not indexed
+            or content_id != id(section.content)
+            or content_len != len(section.content)
+        )
+
+    def _position(self, index: int) -> tuple[Section, int]:
+        """Locate a flat position, checking in O(1) that its section was not changed in place"""
+        if self._indexed != (id(self.sections), len(self.sections)):
+            self.reindex()
+        section_idx, local_idx = self._positions[index]
+        if self._section_changed(section_idx):
+            self.reindex()
+            section_idx, local_idx = self._positions[index]
+        return self.sections[section_idx], local_idx
+
+    def _lookup_media(self, field: str, key: str | None) -> int | None:
+        if key is None:
+            return None
+        position = getattr(self, f"_media_by_{field}").get(key)
+        if position is not None:
+            try:
+                section, local_idx = self._position(position)
+            except IndexError:
+                # content was removed in place, the position is past the end after the reindex
+                pass
+            else:
+                if getattr(section.content[local_idx], field, None) == key:
+                    return position
+        # medias are relocated and captioned in place, so a miss may come from a stale index
+        self.reindex()
+        return getattr(self, f"_media_by_{field}").get(key)
 
     def index(self, target_item: SubSection | Media | Table):
         """Get the index position of a content item"""
-        for i, (_, content) in enumerate(self):
-            if content is target_item:
-                return i
+        for retry in range(2):
+            position = self._position_of.get(id(target_item))
+            if position is not None:
+                try:
+                    section, local_idx = self._position(position)
+                except IndexError:
+                    pass
+                else:
+                    if section.content[local_idx] is target_item:
+                        return position
+            if retry == 0:
+                self.reindex()
         raise ValueError("Item not found in document")
 
     def pop(self, index: int):
         """Remove and return content item at specified index position"""
-        for idx, (section, content) in enumerate(self):
-            if idx == index:
-                return section.content.pop(section.content.index(content))
-        raise IndexError("Index out of range")
+        try:
+            section, local_idx = self._position(index)
+        except IndexError:
+            raise IndexError("Index out of range")
+        content = section.content.pop(local_idx)
+        section.reindex()
+        self.reindex()
+        return content
 
     def insert(self, item: SubSection | Media | Table, target_index: int):
-        """Insert content item after the specified index position"""
-        for idx, (section, content) in enumerate(self):
-            if idx == target_index:
-                section.content.insert(section.content.index(content), item)
-                return
-
-        self.sections[-1].content.append(item)
+        """Insert content item before the content item at the specified index position"""
+        try:
+            section, local_idx = self._position(target_index)
+        except IndexError:
+            section, local_idx = self.sections[-1], len(self.sections[-1].content)
+        section.content.insert(local_idx, item)
+        section.reindex()
+        self.reindex()
 
     def remove(self, target_item: SubSection | Media | Table):
         """Remove content item from document"""
-        for section, content in self:
-            if content is target_item:
-                section.content.remove(target_item)
-                return
-        raise ValueError("Item not found in document")
+        section, local_idx = self._position(self.index(target_item))
+        section.content.pop(local_idx)
+        section.reindex()
+        self.reindex()
+
+    def _find_section(self, key: str) -> Section | None:
+        if self._indexed == (id(self.sections), len(self.sections)):
+            section_idx = self._sections.get(key)
+            if section_idx is not None and self.sections[section_idx].title == key:
+                return self.sections[section_idx]
+        # sections are renamed and replaced in place, so a miss may come from a stale index
+        self.reindex()
+        section_idx = self._sections.get(key)
+        return self.sections[section_idx] if section_idx is not None else None
 
     def __contains__(self, key: str):
-        for section in self.sections:
-            if section.title == key:
-                return True
-        return False
+        return self._find_section(key) is not None
 
     def __iter__(self):
         for section in self.sections:
@@ -228,14 +445,21 @@ class Document(BaseModel):
     def __getitem__(self, key: int | slice | str):
         """Get content item by index, slice or section title"""
         if isinstance(key, slice):
-            return [content for _, content in list(self)[key]]
-        else:
-            for i, (sec, content) in enumerate(self):
-                if i == key:
-                    return content
-                elif sec.title == key:
-                    return sec
+            self.reindex()
+            return [
+                self.sections[section_idx].content[local_idx]
+                for section_idx, local_idx in self._positions[key]
+            ]
+        if isinstance(key, str):
+            section = self._find_section(key)
+            if section is not None:
+                return section
+            raise IndexError(f"Index out of range: {key}")
+        try:
+            section, local_idx = self._position(key)
+        except IndexError:
             raise IndexError(f"Index out of range: {key}")
+        return section.content[local_idx]
 
     @property
     def metainfo(self):
@@ -4,14 +4,17 @@ from os.path import exists, join
 
 from jinja2 import Environment, StrictUndefined
 from PIL import Image
-from pydantic import BaseModel, Field, create_model
+from pydantic import BaseModel, Field, PrivateAttr, create_model
 
 from pptagent.llms import AsyncLLM
 from pptagent.utils import (
-    edit_distance,
+    FuzzyIndex,
+    TableRenderer,
     get_html_table_image,
     get_logger,
     package_join,
+    run_in_process,
+    run_in_thread,
 )
 
 from .doc_utils import parse_table_with_merges
@@ -34,6 +37,9 @@ IMAGE_CAPTION_PROMPT = env.from_string(
 
 logger = get_logger(__name__)
 
+# tables larger than this are parsed in the process executor, as parsing holds the GIL
+LARGE_TABLE_CHARS = 20000
+
 
 class Media(BaseModel):
     markdown_content: str
@@ -44,7 +50,8 @@ class Media(BaseModel):
     @property
     def size(self):
         assert self.path is not None, "Path is required to get size"
-        return Image.open(self.path).size
+        with Image.open(self.path) as image:
+            return image.size
 
     def parse(self, image_dir: str):
         """
@@ -76,17 +83,53 @@ class Table(Media):
     cells: list[list[str]] | None = None
     merge_area: list[tuple[int, int, int, int]] | None = None
 
-    def parse(self, image_dir: str):
-        cells, merges = parse_table_with_merges(self.markdown_content)
+    def parse(self, image_dir: str, render: bool = True):
+        """
+        Parse the table cells and merged areas, and render the table to an image.
+
+        Args:
+            image_dir (str): The directory to save the table image.
+            render (bool): Whether to render the image now, otherwise call `render` later.
+        """
+        self._set_table(*parse_table_with_merges(self.markdown_content), image_dir)
+        if render:
+            get_html_table_image(self.markdown_content, self.path)
+
+    async def parse_async(self, image_dir: str):
+        """
+        Parse the table cells and merged areas off the event loop, without rendering the image.
+        Large tables are parsed in a separate process.
+
+        Args:
+            image_dir (str): The directory to save the table image.
+        """
+        run = (
+            run_in_process
+            if len(self.markdown_content) > LARGE_TABLE_CHARS
+            else run_in_thread
+        )
+        self._set_table(
+            *await run(parse_table_with_merges, self.markdown_content), image_dir
+        )
+
+    def _set_table(
+        self,
+        cells: list[list[str]],
+        merges: list[tuple[int, int, int, int]],
+        image_dir: str,
+    ):
         self.cells = cells
         self.merge_area = merges
-
         if self.path is None:
             self.path = join(
                 image_dir,
                 f"table_{hashlib.md5(str(self.cells).encode()).hexdigest()[:4]}.png",
             )
-        get_html_table_image(self.markdown_content, self.path)
+
+    async def render(self):
+        """Render the table to its image path with the shared browser."""
+        assert self.path is not None, "Path is required to render the table"
+        await TableRenderer.render(self.markdown_content, self.path)
 
     async def get_caption(self, language_model: AsyncLLM):
         if self.caption is None:
@@ -114,6 +157,20 @@ class Section(BaseModel):
     summary: str
     content: list[SubSection | Media | Table]
     markdown_content: str | None = None
+    _blocks: dict[str, int] = PrivateAttr(default_factory=dict)
+    _indexed: tuple[int, int] | None = PrivateAttr(default=None)
+
+    def model_post_init(self, _) -> None:
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild the lookup of block positions by subsection title, media path and media caption"""
+        blocks = {}
+        for idx, block in enumerate(self.content):
+            for key in _block_keys(block):
+                blocks.setdefault(key, idx)
+        self._blocks = blocks
+        self._indexed = (id(self.content), len(self.content))
 
     def iter_medias(self):
         for block in self.content:
@@ -133,14 +190,22 @@ class Section(BaseModel):
         )
 
     def __getitem__(self, key: str):
-        for block in self.content:
-            if isinstance(block, SubSection) and block.title == key:
-                return block
-            elif isinstance(block, Media) and (
-                block.path == key or block.caption == key
-            ):
-                return block
-        raise KeyError(f"No subsection or media with title {key} found")
+        if self._indexed != (id(self.content), len(self.content)):
+            self.reindex()
+        idx = self._blocks.get(key)
+        if idx is None or key not in _block_keys(self.content[idx]):
+            # blocks are replaced, relocated and captioned in place, so a miss may come from a stale index
+            self.reindex()
+            idx = self._blocks.get(key)
+        if idx is None:
+            raise KeyError(f"No subsection or media with title {key} found")
+        return self.content[idx]
+
+
+def _block_keys(block: SubSection | Media) -> tuple[str, ...]:
+    if isinstance(block, SubSection):
+        return (block.title,)
+    return tuple(key for key in (block.path, block.caption) if key is not None)
 
 
 def link_medias(
@@ -167,21 +232,22 @@ def link_medias(
         else:
             media_instances.append(Media(**media_dict))
 
+    # Index the SubSections once, medias are only inserted around them
+    subsections = [block for block in section.content if isinstance(block, SubSection)]
+    index = FuzzyIndex([block.content for block in subsections])
+
     # Find the best insertion position for each media
     for media in media_instances:
         if len(media.near_chunks[0]) < max_chunk_size:
             # If context is small, insert at the beginning
             section.content.insert(0, media)
-        else:
-            # Find the most similar SubSection based on content
-            best_match_idx = 0
-            best_similarity = 0
-
-            for i, block in enumerate(section.content):
-                if isinstance(block, SubSection):
-                    similarity = edit_distance(media.near_chunks[0], block.content)
-                    if similarity > best_similarity:
-                        best_similarity = similarity
-                        best_match_idx = i
-
-            section.content.insert(best_match_idx + 1, media)
+            continue
+        # Find the most similar SubSection based on content
+        best_match_idx = 0
+        match = index.best(media.near_chunks[0])
+        if match is not None and match[1] > 0:
+            block = subsections[match[0]]
+            best_match_idx = next(
+                i for i, b in enumerate(section.content) if b is block
+            )
+        section.content.insert(best_match_idx + 1, media)
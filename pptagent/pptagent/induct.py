@@ -22,6 +22,7 @@ from pptagent.utils import (
     get_logger,
     is_image_path,
     package_join,
+    run_in_thread,
 )
 
 logger = get_logger(__name__)
@@ -50,6 +51,8 @@ class SlideInducter:
         language_model: AsyncLLM,
         vision_model: AsyncLLM,
         use_assert: bool = True,
+        pooling: str = "cls",
+        sim_bound: float = 0.85,
     ):
         """
         Initialize the SlideInducter.
@@ -60,6 +63,9 @@ class SlideInducter:
             template_image_folder (str): The folder containing normalized slide images.
             config (Config): The configuration object.
             image_models (list): A list of image models.
+            pooling (str): The pooling of the slide embeddings, see `get_image_embedding`.
+            sim_bound (float): The similarity threshold for clustering slides, matching `pooling`:
+                CLS features of slides are more similar than the features of all tokens (clustered at 0.65).
         """
         self.prs = prs
         self.config = config
@@ -68,6 +74,8 @@ class SlideInducter:
         self.language_model = language_model
         self.vision_model = vision_model
         self.image_models = image_models
+        self.pooling = pooling
+        self.sim_bound = sim_bound
         self.schema_extractor = Agent(
             "schema_extractor",
             {
@@ -115,7 +123,12 @@ class SlideInducter:
         """
         Async version: Cluster slides into different layouts.
         """
-        embeddings = get_image_embedding(self.template_image_folder, *self.image_models)
+        embeddings = await run_in_thread(
+            get_image_embedding,
+            self.template_image_folder,
+            *self.image_models,
+            pooling=self.pooling,
+        )
         assert len(embeddings) == len(self.prs)
         content_split = defaultdict(list)
         for slide_idx in content_slides_index:
@@ -130,7 +143,7 @@ class SlideInducter:
                     embeddings[f"slide_{slide_idx:04d}.jpg"] for slide_idx in slides
                 ]
                 similarity = images_cosine_similarity(sub_embeddings)
-                for cluster in get_cluster(similarity):
+                for cluster in get_cluster(similarity, self.sim_bound):
                     slide_indexs = [slides[i] for i in cluster]
                     template_id = max(
                         slide_indexs,
@@ -1,19 +1,515 @@
+import asyncio
 import base64
+import hashlib
+import json
+import os
 import re
+import sqlite3
 import threading
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
+from time import sleep, time
 
+import httpx
 from oaib import Auto
-from openai import AsyncOpenAI, OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 
-from pptagent.utils import get_json_from_response, get_logger, tenacity_decorator
+from pptagent.utils import (
+    CircuitBreaker,
+    get_json_from_response,
+    get_logger,
+    is_transient,
+    retry_after,
+    tenacity_decorator,
+)
 
 logger = get_logger(__name__)
 MAX_CONTEXT_SIZE = 32768
 
 
+class ResponseCache(ABC):
+    """
+    A cache of model responses, keyed by a hash of everything that determines a response:
+    the model, the formatted messages (including image bytes), the response format schema and the sampling kwargs.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: list,
+        response_format: BaseModel | None = None,
+        client_kwargs: dict | None = None,
+    ) -> str:
+        schema = None
+        if response_format is not None:
+            schema = response_format.model_json_schema()
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": messages,
+                "response_format": schema,
+                "client_kwargs": client_kwargs or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        response = self._get(key)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def set(self, key: str, response: str):
+        self._set(key, response)
+
+    @abstractmethod
+    def _get(self, key: str) -> str | None: ...
+
+    @abstractmethod
+    def _set(self, key: str, response: str): ...
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def __deepcopy__(self, memo: dict):
+        # copies of an LLM keep sharing the same cache
+        return self
+
+
+class MemoryCache(ResponseCache):
+    """
+    An in-process LRU response cache.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float | None = None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            created, response = self._entries[key]
+            if self.ttl is not None and time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def _set(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = (time(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class SQLiteCache(ResponseCache):
+    """
+    An on-disk response cache backed by SQLite, shared across runs and processes.
+    Entries expire after `ttl` seconds, the least recently used entries are evicted beyond `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float | None = None,
+        max_bytes: int = 1 << 30,
+    ):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect()
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT, size INTEGER, "
+                "created REAL, accessed REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)"
+            )
+
+    def _get(self, key: str) -> str | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time(), key)
+            )
+            return row[0]
+
+    def _set(self, key: str, response: str):
+        now = time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode()), now, now),
+            )
+            if self.ttl is not None:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+                )
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                # evict the least recently used entries until the cache fits
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS kept "
+                    "FROM responses) WHERE kept > ?)",
+                    (self.max_bytes,),
+                )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        state["_conn"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._connect()
+
+
+_DEFAULT_CACHE: ResponseCache | None = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+
+def get_default_cache() -> ResponseCache | None:
+    """
+    Get the process-wide response cache configured by environment variables:
+    `PPTAGENT_LLM_CACHE` ("memory" or the path of a SQLite file, unset to disable)
+    and `PPTAGENT_LLM_CACHE_TTL` (seconds).
+    """
+    global _DEFAULT_CACHE
+    backend = os.environ.get("PPTAGENT_LLM_CACHE")
+    if not backend:
+        return None
+    with _DEFAULT_CACHE_LOCK:
+        if _DEFAULT_CACHE is None:
+            ttl = os.environ.get("PPTAGENT_LLM_CACHE_TTL")
+            ttl = float(ttl) if ttl else None
+            if backend == "memory":
+                _DEFAULT_CACHE = MemoryCache(ttl=ttl)
+            else:
+                _DEFAULT_CACHE = SQLiteCache(backend, ttl=ttl)
+    return _DEFAULT_CACHE
+
+
+# per-endpoint rate limits, 0 means unlimited
+LLM_RPM = int(os.environ.get("PPTAGENT_LLM_RPM", 0))
+LLM_TPM = int(os.environ.get("PPTAGENT_LLM_TPM", 0))
+LLM_MAX_CONNECTIONS = int(os.environ.get("PPTAGENT_LLM_MAX_CONNECTIONS", 256))
+IMAGE_TOKENS = 765
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled continuously at `per_minute` tokens per minute.
+    Callers reserve tokens up front and wait for the returned delay, so waiters are served in order.
+    """
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Reserve tokens from the bucket.
+
+        Returns:
+            float: The seconds to wait before the reservation is covered.
+        """
+        if self.per_minute <= 0:
+            return 0
+        with self._lock:
+            now = time()
+            rate = self.per_minute / 60
+            self.tokens = min(
+                self.per_minute, self.tokens + (now - self.updated) * rate
+            )
+            self.updated = now
+            self.tokens -= min(amount, self.per_minute)
+            return max(0, -self.tokens / rate)
+
+    def refund(self, amount: float):
+        if self.per_minute <= 0:
+            return
+        with self._lock:
+            self.tokens = min(self.per_minute, self.tokens + amount)
+
+
+class Endpoint:
+    """
+    The clients, connection pool, rate limits and metrics shared by every LLM talking to an endpoint.
+    Use `get_endpoint` instead of creating it directly.
+    """
+
+    def __init__(self, base_url: str | None, api_key: str | None, timeout: int):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.request_bucket = TokenBucket(LLM_RPM)
+        self.token_bucket = TokenBucket(LLM_TPM)
+        self.breaker = CircuitBreaker(base_url or "default")
+        self.in_flight = 0
+        self.queued = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.tokens = 0
+        self._client = None
+        self._default_async_client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # copies and unpickled instances resolve to the process-wide endpoint
+        return get_endpoint, (self.base_url, self.api_key, self.timeout)
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS // 4,
+            keepalive_expiry=60,
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        with self._lock:
+            if self._client is None:
+                self._client = OpenAI(
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=self.limits),
+                )
+            return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """
+        The async client of the running event loop, as httpx connections cannot be shared across loops.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with self._lock:
+            client = (
+                self._async_clients.get(loop)
+                if loop is not None
+                else self._default_async_client
+            )
+            if client is None:
+                client = AsyncOpenAI(
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=self.limits),
+                )
+                if loop is not None:
+                    self._async_clients[loop] = client
+                else:
+                    self._default_async_client = client
+            return client
+
+    def set_limits(self, rpm: int | None = None, tpm: int | None = None):
+        """
+        Set the requests and tokens per minute allowed for this endpoint, 0 means unlimited.
+        """
+        if rpm is not None:
+            self.request_bucket = TokenBucket(rpm)
+        if tpm is not None:
+            self.token_bucket = TokenBucket(tpm)
+
+    def _reserve(self, tokens: int) -> float:
+        self.breaker.before_call()
+        with self._lock:
+            self.queued += 1
+        return max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens))
+
+    def _start(self):
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+            self.requests += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _finish(self, exception: BaseException | None):
+        with self._lock:
+            self.in_flight -= 1
+        if exception is None:
+            self.breaker.record_success()
+        elif is_transient(exception):
+            self.breaker.record_failure(retry_after(exception))
+        else:
+            self.breaker.record_cancel()
+
+    @asynccontextmanager
+    async def limit(self, tokens: int):
+        """
+        Wait for the rate limits to admit a request estimated at `tokens` tokens.
+        """
+        delay = self._reserve(tokens)
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            self.breaker.record_cancel()
+            raise
+        self._start()
+        try:
+            yield
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._finish(None)
+
+    @contextmanager
+    def limit_sync(self, tokens: int):
+        """
+        Synchronous version of `limit`.
+        """
+        delay = self._reserve(tokens)
+        if delay > 0:
+            sleep(delay)
+        self._start()
+        try:
+            yield
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._finish(None)
+
+    def settle(self, estimated: int, completion: ChatCompletion):
+        """
+        Correct the token bucket with the actual usage reported by the completion.
+        """
+        usage = getattr(completion, "usage", None)
+        if usage is None or usage.total_tokens is None:
+            actual = estimated
+        else:
+            actual = usage.total_tokens
+            if actual > estimated:
+                self.token_bucket.reserve(actual - estimated)
+            else:
+                self.token_bucket.refund(estimated - actual)
+        with self._lock:
+            self.tokens += actual
+
+    def metrics(self) -> dict[str, int | str]:
+        return {
+            "circuit": self.breaker.state,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "requests": self.requests,
+            "tokens": self.tokens,
+        }
+
+
+_ENDPOINTS: dict[tuple, Endpoint] = {}
+_ENDPOINTS_LOCK = threading.Lock()
+
+
+def get_endpoint(
+    base_url: str | None, api_key: str | None, timeout: int = 360
+) -> Endpoint:
+    """
+    Get the process-wide endpoint for `(base_url, api_key, timeout)`, creating it on first use.
+    """
+    key = (base_url, api_key, timeout)
+    with _ENDPOINTS_LOCK:
+        if key not in _ENDPOINTS:
+            _ENDPOINTS[key] = Endpoint(base_url, api_key, timeout)
+        return _ENDPOINTS[key]
+
+
+def endpoint_metrics() -> dict[str, dict[str, int | str]]:
+    """
+    Get the concurrency and queue-depth metrics of every endpoint in use.
+    """
+    with _ENDPOINTS_LOCK:
+        endpoints = list(_ENDPOINTS.values())
+    metrics = {}
+    for endpoint in endpoints:
+        name = endpoint.base_url or "default"
+        if name in metrics:
+            name = f"{name} ({len(metrics)})"
+        metrics[name] = endpoint.metrics()
+    return metrics
+
+
+def estimate_tokens(messages: list[dict], client_kwargs: dict) -> int:
+    """
+    Roughly estimate the tokens a request consumes for rate limiting, actual usage is settled afterwards.
+    """
+    chars, images = 0, 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                images += 1
+            else:
+                chars += len(part.get("text", ""))
+    completion = client_kwargs.get(
+        "max_tokens", client_kwargs.get("max_completion_tokens", 1024)
+    )
+    return chars // 4 + images * IMAGE_TOKENS + completion
+
+
 @dataclass
 class LLM:
     """
@@ -24,11 +520,27 @@ class LLM:
     base_url: str | None = None
     api_key: str | None = None
     timeout: int = 360
+    cache: ResponseCache | None = None
 
     def __post_init__(self):
-        self.client = OpenAI(
-            base_url=self.base_url, api_key=self.api_key, timeout=self.timeout
-        )
+        self.endpoint = get_endpoint(self.base_url, self.api_key, self.timeout)
+        self._client = None
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is not None:
+            return self._client
+        return self.endpoint.client
+
+    @client.setter
+    def client(self, client: OpenAI):
+        self._client = client
+
+    @property
+    def response_cache(self) -> ResponseCache | None:
+        if self.cache is not None:
+            return self.cache
+        return get_default_cache()
 
     @tenacity_decorator
     def __call__(
@@ -60,27 +572,44 @@ class LLM:
         if history is None:
             history = []
         system, message = self.format_message(content, images, system_message)
-        try:
-            if response_format is not None:
-                completion: ChatCompletion = self.client.chat.completions.parse(
-                    model=self.model,
-                    messages=system + history + message,
-                    response_format=response_format,
-                    **client_kwargs,
-                )
-            else:
-                completion: ChatCompletion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=system + history + message,
-                    **client_kwargs,
+        cache, cache_key = self.response_cache, None
+        if cache is not None:
+            cache_key = cache.make_key(
+                self.model, system + history + message, response_format, client_kwargs
+            )
+            response = cache.get(cache_key)
+            if response is not None:
+                message.append({"role": "assistant", "content": response})
+                return self.__post_process__(
+                    response, message, return_json, return_message
                 )
+        tokens = estimate_tokens(system + history + message, client_kwargs)
+        try:
+            with self.endpoint.limit_sync(tokens):
+                if response_format is not None:
+                    completion: ChatCompletion = self.client.chat.completions.parse(
+                        model=self.model,
+                        messages=system + history + message,
+                        response_format=response_format,
+                        **client_kwargs,
+                    )
+                else:
+                    completion: ChatCompletion = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=system + history + message,
+                        **client_kwargs,
+                    )
+            self.endpoint.settle(tokens, completion)
 
         except Exception as e:
             logger.warning("Error in LLM (%s) service: %s", self.model, e)
             raise e
         response = completion.choices[0].message.content
         message.append({"role": "assistant", "content": response})
-        return self.__post_process__(response, message, return_json, return_message)
+        result = self.__post_process__(response, message, return_json, return_message)
+        if cache_key is not None and response is not None:
+            cache.set(cache_key, response)
+        return result
 
     def __post_process__(
         self,
@@ -208,6 +737,7 @@ class LLM:
             base_url=self.base_url,
             api_key=self.api_key,
             timeout=self.timeout,
+            cache=self.cache,
         )
 
 
@@ -227,11 +757,9 @@ class AsyncLLM(LLM):
             base_url (str): The base URL for the API.
             api_key (str): API key for authentication. Defaults to environment variable.
         """
-        self.client = AsyncOpenAI(
-            base_url=self.base_url,
-            api_key=self.api_key,
-            timeout=self.timeout,
-        )
+        self.endpoint = get_endpoint(self.base_url, self.api_key, self.timeout)
+        self._client = None
+        self.batch = None
         if self.use_batch:
             self.batch = Auto(
                 base_url=self.base_url,
@@ -240,6 +768,16 @@ class AsyncLLM(LLM):
                 loglevel=0,
             )
 
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is not None:
+            return self._client
+        return self.endpoint.async_client
+
+    @client.setter
+    def client(self, client: AsyncOpenAI):
+        self._client = client
+
     @tenacity_decorator
     async def __call__(
         self,
@@ -281,62 +819,75 @@ class AsyncLLM(LLM):
         if history is None:
             history = []
         system, message = self.format_message(content, images, system_message)
-        try:
-            if self.use_batch:
-                await self.batch.add(
-                    "chat.completions.create",
-                    model=self.model,
-                    messages=system + history + message,
-                    response_format=response_format,
-                    **client_kwargs,
+        cache, cache_key = self.response_cache, None
+        if cache is not None:
+            cache_key = cache.make_key(
+                self.model, system + history + message, response_format, client_kwargs
+            )
+            response = cache.get(cache_key)
+            if response is not None:
+                message.append({"role": "assistant", "content": response})
+                return self.__post_process__(
+                    response, message, return_json, return_message
                 )
-                completion = await self.batch.run()
-                if "result" not in completion or len(completion["result"]) != 1:
-                    raise ValueError(
-                        f"The length of completion result should be 1, but got {completion}.\nRace condition may have occurred if multiple values are returned.\nOr, there was an error in the LLM call, use the synchronous version to check."
-                    )
-                completion = ChatCompletion(**completion["result"][0])
-            else:
-                if response_format is None:
-                    completion = await self.client.chat.completions.create(
-                        model=self.model,
-                        messages=system + history + message,
-                        **client_kwargs,
-                    )
-                else:
-                    completion = await self.client.chat.completions.parse(
+        tokens = estimate_tokens(system + history + message, client_kwargs)
+        try:
+            async with self.endpoint.limit(tokens):
+                if self.use_batch:
+                    await self.batch.add(
+                        "chat.completions.create",
                         model=self.model,
                         messages=system + history + message,
                         response_format=response_format,
                         **client_kwargs,
                     )
+                    completion = await self.batch.run()
+                    if "result" not in completion or len(completion["result"]) != 1:
+                        raise ValueError(
+                            f"The length of completion result should be 1, but got {completion}.\nRace condition may have occurred if multiple values are returned.\nOr, there was an error in the LLM call, use the synchronous version to check."
+                        )
+                    completion = ChatCompletion(**completion["result"][0])
+                else:
+                    if response_format is None:
+                        completion = await self.client.chat.completions.create(
+                            model=self.model,
+                            messages=system + history + message,
+                            **client_kwargs,
+                        )
+                    else:
+                        completion = await self.client.chat.completions.parse(
+                            model=self.model,
+                            messages=system + history + message,
+                            response_format=response_format,
+                            **client_kwargs,
+                        )
+            self.endpoint.settle(tokens, completion)
 
         except Exception as e:
             logger.error("Error in AsyncLLM call: %s", e)
             raise e
         response = completion.choices[0].message.content
         message.append({"role": "assistant", "content": response})
-        return self.__post_process__(response, message, return_json, return_message)
+        result = self.__post_process__(response, message, return_json, return_message)
+        if cache_key is not None and response is not None:
+            cache.set(cache_key, response)
+        return result
 
     def __getstate__(self):
         state = self.__dict__.copy()
-        state["client"] = None
+        state["_client"] = None
         state["batch"] = None
         return state
 
     def __setstate__(self, state: dict):
         self.__dict__.update(state)
-        self.client = AsyncOpenAI(
-            base_url=self.base_url,
-            api_key=self.api_key,
-            timeout=self.timeout,
-        )
-        self.batch = Auto(
-            base_url=self.base_url,
-            api_key=self.api_key,
-            timeout=self.timeout,
-            loglevel=0,
-        )
+        if self.use_batch:
+            self.batch = Auto(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                timeout=self.timeout,
+                loglevel=0,
+            )
 
     async def test_connection(self) -> bool:
         """
@@ -379,7 +930,12 @@ class AsyncLLM(LLM):
         """
         Convert the AsyncLLM to a synchronous LLM.
         """
-        return LLM(model=self.model, base_url=self.base_url, api_key=self.api_key)
+        return LLM(
+            model=self.model,
+            base_url=self.base_url,
+            api_key=self.api_key,
+            cache=self.cache,
+        )
 
 
 def get_model_abbr(llms: LLM | list[LLM]) -> str:
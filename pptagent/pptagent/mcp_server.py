@@ -1,32 +1,42 @@
-import json
+import asyncio
 import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from math import ceil
 from os.path import exists
 from pathlib import Path
 from random import shuffle
 
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
 from mistune import html as markdown_to_html
 
+from pptagent.bundle import TemplateCache
 from pptagent.llms import AsyncLLM
-from pptagent.multimodal import ImageLabler
 from pptagent.pptgen import PPTAgent, get_length_factor
-from pptagent.presentation import Presentation
-from pptagent.presentation.layout import Layout
+from pptagent.presentation import Layout, SlidePage
 from pptagent.response.pptgen import (
     EditorOutput,
     SlideElement,
 )
 from pptagent.utils import (
-    Config,
     Language,
-    get_html_table_image,
+    TableRenderer,
     get_logger,
+    monitor_event_loop,
     package_join,
+    run_in_thread,
 )
 
 logger = get_logger(__name__)
 
+# sessions idle for longer than this many seconds are evicted
+SESSION_TTL = int(os.getenv("PPTAGENT_SESSION_TTL", 3600))
+MAX_SESSIONS = int(os.getenv("PPTAGENT_MAX_SESSIONS", 64))
+# tool calls of a session running at once, calls beyond it wait for their turn
+SESSION_CONCURRENCY = int(os.getenv("PPTAGENT_SESSION_CONCURRENCY", 1))
+
 
 def mcp_slide_validate(editor_output: EditorOutput, layout: Layout, prs_lang: Language):
     warnings = []
@@ -53,15 +63,102 @@ def mcp_slide_validate(editor_output: EditorOutput, layout: Layout, prs_lang: La
     return warnings, errors
 
 
-class PPTAgentServer(PPTAgent):
+@dataclass
+class MCPSession(PPTAgent):
+    """
+    The state of a client session: the selected template, the slide being written and the generated slides.
+    Sessions share the language model and the template cache of the server.
+    """
+
     roles = ["coder"]
 
-    def __init__(self):
+    def __post_init__(self):
+        super().__post_init__()
         self.source_doc = None
-        self.mcp = FastMCP("PPTAgent")
-        self.slides = []
+        self.slides: list[SlidePage] = []
         self.layout: Layout | None = None
         self.editor_output: EditorOutput | None = None
+        self.template_name: str | None = None
+        self.last_active = time.monotonic()
+        self.running = 0
+        self.semaphore = asyncio.Semaphore(SESSION_CONCURRENCY)
+
+    @property
+    def idle_time(self) -> float:
+        return 0.0 if self.running else time.monotonic() - self.last_active
+
+
+class SessionManager:
+    """
+    Sessions keyed by their id, created on first use and evicted after being idle for `ttl` seconds,
+    or when the number of sessions exceeds `max_sessions`, least recently used first.
+    """
+
+    def __init__(
+        self,
+        language_model: AsyncLLM,
+        ttl: float = SESSION_TTL,
+        max_sessions: int = MAX_SESSIONS,
+    ):
+        self.language_model = language_model
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions: OrderedDict[str, MCPSession] = OrderedDict()
+
+    def evict_idle(self):
+        for session_id, session in list(self.sessions.items()):
+            if session.idle_time > self.ttl:
+                self.close(session_id)
+
+    def close(self, session_id: str):
+        if self.sessions.pop(session_id, None) is not None:
+            logger.debug("Closed session %s", session_id)
+
+    def get(self, session_id: str) -> MCPSession:
+        """
+        Get a session, creating it if it does not exist.
+
+        Raises:
+            RuntimeError: If the server is full and all sessions are running.
+        """
+        self.evict_idle()
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                idle = [sid for sid, s in self.sessions.items() if not s.running]
+                if not idle:
+                    raise RuntimeError(
+                        f"Too many sessions ({self.max_sessions}) running, please retry later"
+                    )
+                self.close(idle[0])
+            session = MCPSession(
+                language_model=self.language_model,
+                vision_model=self.language_model,
+            )
+            self.sessions[session_id] = session
+            logger.debug("Created session %s", session_id)
+        self.sessions.move_to_end(session_id)
+        return session
+
+    @asynccontextmanager
+    async def use(self, session_id: str):
+        """
+        Run a tool call in a session, waiting while the session is running `SESSION_CONCURRENCY` calls.
+        """
+        monitor_event_loop()
+        session = self.get(session_id)
+        session.running += 1
+        try:
+            async with session.semaphore:
+                yield session
+        finally:
+            session.running -= 1
+            session.last_active = time.monotonic()
+
+
+class PPTAgentServer:
+    def __init__(self):
+        self.mcp = FastMCP("PPTAgent")
         model = AsyncLLM(
             os.getenv("PPTAGENT_MODEL"),
             os.getenv("PPTAGENT_API_BASE"),
@@ -75,45 +172,12 @@ class PPTAgentServer(PPTAgent):
             msg = "Unable to connect to the model, please set the PPTAGENT_MODEL, PPTAGENT_API_BASE, and PPTAGENT_API_KEY environment variables correctly"
             logger.error(msg)
             raise Exception(msg)
-        super().__init__(language_model=model, vision_model=model)
-
-        # load templates, a directory containing pptx, json, and description for each template
-        templates_dir = Path(package_join("templates"))
-        templates = [p for p in templates_dir.iterdir() if p.is_dir()]
-        self.template_description = {}
-        self.templates = {}
-
-        for template in templates:
-            try:
-                desc_path = template / "description.txt"
-                self.template_description[template.name] = desc_path.read_text()
-
-                # Load template configuration
-                template_folder = template
-                prs_config = Config(str(template_folder))
-                prs = Presentation.from_file(
-                    str(template_folder / "source.pptx"), prs_config
-                )
-                image_labler = ImageLabler(prs, prs_config)
-                image_stats_path = template_folder / "image_stats.json"
-                image_labler.apply_stats(json.loads(image_stats_path.read_text()))
-
-                slide_induction = json.loads(
-                    (template_folder / "slide_induction.json").read_text()
-                )
-
-                self.templates[template.name] = {
-                    "presentation": prs,
-                    "slide_induction": slide_induction,
-                    "config": prs_config,
-                }
-
-            except Exception as e:
-                logger.warning(f"Failed to load template {template.name}: {e}")
-                continue
+        self.sessions = SessionManager(model)
 
+        # load templates on first use, a directory containing pptx, json, and description for each template
+        self.templates = TemplateCache(package_join("templates"))
         logger.info(
-            f"{len(self.templates)} templates loaded successfully: "
+            f"{len(self.templates)} templates available: "
             + ", ".join(self.templates.keys())
         )
 
@@ -122,9 +186,17 @@ class PPTAgentServer(PPTAgent):
         templates_dir = Path(package_join("templates"))
         return [p.name for p in templates_dir.iterdir() if p.is_dir()]
 
+    def session(self, ctx: Context, session_id: str | None = None):
+        """
+        Use the session given by `session_id`, or the MCP session of the request.
+        """
+        return self.sessions.use(session_id or ctx.session_id)
+
     def register_tools(self):
         @self.mcp.tool()
-        def markdown_table_to_image(markdown_table: str, path: str, css: str) -> str:
+        async def markdown_table_to_image(
+            markdown_table: str, path: str, css: str
+        ) -> str:
             """
             Convert a markdown table to an image and save it to the specified path.
 
@@ -139,29 +211,34 @@ class PPTAgentServer(PPTAgent):
                 str: Confirmation message with the path to the saved image
             """
             html = markdown_to_html(markdown_table)
-            get_html_table_image(html, path, css)
+            await TableRenderer.render(html, path, css)
             return f"Markdown table converted to image and saved to {path}"
 
         @self.mcp.tool()
-        def list_templates() -> list[dict]:
+        def list_templates() -> dict:
             """List all available templates."""
             return {
                 "message": "Please choose one the following templates by calling `set_template`",
                 "templates": [
                     {
                         "name": template_name,
-                        "description": self.template_description[template_name],
+                        "description": description,
                     }
-                    for template_name in self.templates.keys()
+                    for template_name, description in self.templates.descriptions.items()
                 ],
             }
 
         @self.mcp.tool()
-        def set_template(template_name: str = "default"):
+        async def set_template(
+            ctx: Context,
+            template_name: str = "default",
+            session_id: str | None = None,
+        ):
             """Select a PowerPoint template by name.
 
             Args:
                 template_name: The name of the template to select
+                session_id: Optional id to isolate this presentation from others of the same client, defaults to the MCP session
 
             Returns:
                 dict: Success message and list of available layouts
@@ -170,48 +247,62 @@ class PPTAgentServer(PPTAgent):
                 f"Template {template_name} not available, please choose from {', '.join(self.templates.keys())}"
             )
 
-            template_data = self.templates[template_name]
-            self.set_reference(
-                slide_induction=template_data["slide_induction"],
-                presentation=template_data["presentation"],
-            )
+            async with self.session(ctx, session_id) as session:
+                template = await run_in_thread(self.templates.get, template_name)
+                session.set_reference(
+                    slide_induction=template.slide_induction,
+                    presentation=template.presentation.snapshot(),
+                    template_html=template.template_html(),
+                )
+                session.template_name = template_name
 
-            return {
-                "message": "Template set successfully, please select layout from given layouts later",
-                "template_description": self.template_description[template_name],
-                "available_layouts": list(self.layouts.keys()),
-            }
+                return {
+                    "message": "Template set successfully, please select layout from given layouts later",
+                    "template_description": template.description,
+                    "available_layouts": list(session.layouts.keys()),
+                }
 
         @self.mcp.tool()
-        async def create_slide(layout: str):
+        async def create_slide(
+            ctx: Context, layout: str, session_id: str | None = None
+        ):
             """Create a slide with a given layout.
 
             Args:
                 layout: Name of the layout to use. Must be one of the available layouts given by set_template.
+                session_id: The session id given to `set_template`, if any
 
             Returns:
                 dict: Success message, instructions, and content schema for the selected layout.
             """
-            assert self._initialized, (
-                "PPTAgent not initialized, please call `set_template` first"
-            )
-            assert layout in self.layouts, (
-                "Given layout was not in available layouts: " + ", ".join(self.layouts)
-            )
-            if self.layout is not None:
-                message = "Layout update from " + self.layout.title + " to " + layout
-                message += "\nDid you forget to call `generate_slide` after setting slide content?"
-            else:
-                message = "Layout " + layout + " selected successfully"
-            self.layout = self.layouts[layout]
-            return {
-                "message": message,
-                "instructions": "Generate slide content strictly following the schema below",
-                "schema": self.layout.content_schema,
-            }
+            async with self.session(ctx, session_id) as session:
+                assert session._initialized, (
+                    "PPTAgent not initialized, please call `set_template` first"
+                )
+                assert layout in session.layouts, (
+                    "Given layout was not in available layouts: "
+                    + ", ".join(session.layouts)
+                )
+                if session.layout is not None:
+                    message = (
+                        "Layout update from " + session.layout.title + " to " + layout
+                    )
+                    message += "\nDid you forget to call `generate_slide` after setting slide content?"
+                else:
+                    message = "Layout " + layout + " selected successfully"
+                session.layout = session.layouts[layout]
+                return {
+                    "message": message,
+                    "instructions": "Generate slide content strictly following the schema below",
+                    "schema": session.layout.content_schema,
+                }
 
         @self.mcp.tool()
-        async def write_slide(structured_slide_elements: list[dict]):
+        async def write_slide(
+            ctx: Context,
+            structured_slide_elements: list[dict],
+            session_id: str | None = None,
+        ):
             """Write the slide elements for generating a PowerPoint slide.
             Note that this function will not generate a slide, you should call `generate_slide`.
 
@@ -226,81 +317,90 @@ class PPTAgentServer(PPTAgent):
                         // OR array of image paths for image elements: ["/path/to/image1.jpg", "/path/to/image2.png"]
                     }
                 ]
+                session_id: The session id given to `set_template`, if any
             Returns:
                 dict: Success message, warnings, and errors
             """
-            self.structured_slide_elements = structured_slide_elements
-            assert self.layout is not None, (
-                "Layout is not selected, please call `create_slide` before writing slide"
-            )
-            editor_output = EditorOutput(
-                elements=[SlideElement(**e) for e in structured_slide_elements]
-            )
-            warnings, errors = mcp_slide_validate(
-                editor_output, self.layout, self.reference_lang
-            )
-            if errors:
-                raise ValueError("Errors:\n" + "\n".join(errors))
-
-            self.editor_output = editor_output
-            if warnings:
+            async with self.session(ctx, session_id) as session:
+                assert session.layout is not None, (
+                    "Layout is not selected, please call `create_slide` before writing slide"
+                )
+                editor_output = EditorOutput(
+                    elements=[SlideElement(**e) for e in structured_slide_elements]
+                )
+                warnings, errors = mcp_slide_validate(
+                    editor_output, session.layout, session.reference_lang
+                )
+                if errors:
+                    raise ValueError("Errors:\n" + "\n".join(errors))
+
+                session.editor_output = editor_output
+                if warnings:
+                    return {
+                        "message": "Slide elements set with warnings. Consider reset the slide content, or proceed if acceptable.",
+                        "warnings": warnings,
+                    }
                 return {
-                    "message": "Slide elements set with warnings. Consider reset the slide content, or proceed if acceptable.",
-                    "warnings": warnings,
+                    "message": "Slide elements set successfully. Ready to generate slide."
                 }
-            return {
-                "message": "Slide elements set successfully. Ready to generate slide."
-            }
 
         @self.mcp.tool()
-        async def generate_slide():
+        async def generate_slide(ctx: Context, session_id: str | None = None):
             """Generate a PowerPoint slide after layout and slide elements are set.
 
+            Args:
+                session_id: The session id given to `set_template`, if any
+
             Returns:
                 dict: Success message with slide number and next steps
             """
-            if self.editor_output is None:
-                raise ValueError(
-                    "Slide elements are not set, please call `write_slide` before generating slide"
+            async with self.session(ctx, session_id) as session:
+                if session.editor_output is None:
+                    raise ValueError(
+                        "Slide elements are not set, please call `write_slide` before generating slide"
+                    )
+
+                command_list, template_id = session._generate_commands(
+                    session.editor_output, session.layout
                 )
+                slide, _ = await session._edit_slide(command_list, template_id)
 
-            command_list, template_id = self._generate_commands(
-                self.editor_output, self.layout
-            )
-            slide, _ = await self._edit_slide(command_list, template_id)
-
-            # Reset state after successful generation
-            self.layout = None
-            self.editor_output = None
-            self.slides.append(slide)
+                # Reset state after successful generation
+                session.layout = None
+                session.editor_output = None
+                session.slides.append(slide)
 
-            slide_number = len(self.slides)
-            available_layouts = list(self.layouts.keys())
-            shuffle(available_layouts)
+                slide_number = len(session.slides)
+                available_layouts = list(session.layouts.keys())
+                shuffle(available_layouts)
 
-            return {
-                "message": f"Slide {slide_number:02d} generated successfully",
-                "next_steps": "You can now save the slides or continue generating more slides",
-                "available_layouts": available_layouts,
-            }
+                return {
+                    "message": f"Slide {slide_number:02d} generated successfully",
+                    "next_steps": "You can now save the slides or continue generating more slides",
+                    "available_layouts": available_layouts,
+                }
 
         @self.mcp.tool()
-        async def save_generated_slides(pptx_path: str):
+        async def save_generated_slides(
+            ctx: Context, pptx_path: str, session_id: str | None = None
+        ):
             """Save the generated slides to a PowerPoint file.
 
             Args:
                 pptx_path: The path to save the PowerPoint file
+                session_id: The session id given to `set_template`, if any
             """
-            pptx = Path(pptx_path)
-            assert len(self.slides), (
-                "No slides generated, please call `generate_slide` first"
-            )
-            pptx.parent.mkdir(parents=True, exist_ok=True)
-            self.empty_prs.slides = self.slides
-            self.empty_prs.save(pptx_path)
-            self.slides = []
-            self._initialized = False
-            return f"total {len(self.empty_prs.slides)} slides saved to {pptx}"
+            async with self.session(ctx, session_id) as session:
+                pptx = Path(pptx_path)
+                assert len(session.slides), (
+                    "No slides generated, please call `generate_slide` first"
+                )
+                pptx.parent.mkdir(parents=True, exist_ok=True)
+                session.empty_prs.slides = session.slides
+                await run_in_thread(session.empty_prs.save, pptx_path)
+                session.slides = []
+                session._initialized = False
+                return f"total {len(session.empty_prs.slides)} slides saved to {pptx}"
 
 
 def main():
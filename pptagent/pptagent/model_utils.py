@@ -1,11 +1,16 @@
+import hashlib
+import json
 import os
 import tempfile
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from os.path import join
+from os.path import exists, expanduser, join
 
 import aiofiles
 import aiohttp
+import numpy as np
 from PIL import Image
 
 from pptagent.llms import AsyncLLM
@@ -52,6 +57,12 @@ MINERU_API = os.environ.get("MINERU_API", None)
 if MINERU_API is None:
     logger.debug("MINERU_API is not set, PDF parsing is not available")
 
+# set to an empty string to disable the on-disk image embedding cache
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "PPTAGENT_EMBEDDING_CACHE",
+    join(expanduser("~"), ".cache", "pptagent", "embeddings"),
+)
+
 
 class ModelManager:
     """
@@ -73,8 +84,12 @@ class ModelManager:
             vision_model_name = os.environ.get("VISION_MODEL", "gpt-4.1")
         self._image_model = None
 
+        # both models share the process-wide client of their endpoint
         self.language_model = AsyncLLM(language_model_name, api_base)
-        self.vision_model = AsyncLLM(vision_model_name, api_base)
+        if vision_model_name == language_model_name:
+            self.vision_model = self.language_model
+        else:
+            self.vision_model = AsyncLLM(vision_model_name, api_base)
 
     @property
     def image_model(self):
@@ -194,17 +209,136 @@ async def parse_pdf(pdf_path: str, output_folder: str):
     return open(join(output_folder, "source.md"), encoding="utf-8").read()
 
 
+class EmbeddingStore:
+    """
+    A content-addressed, append-only store of image embeddings.
+
+    Embeddings are kept in a memory-mapped float16 matrix (`embeddings.f16`),
+    rows are located through an index file (`index.json`) mapping content hashes to row numbers.
+    Each namespace (model + preprocessing) lives in its own sub-directory.
+    Writers are serialized across processes by a lock file, readers only see published rows.
+    """
+
+    def __init__(self, cache_dir: str, namespace: dict):
+        self.namespace = hashlib.sha256(
+            json.dumps(namespace, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        self.store_dir = join(cache_dir, self.namespace)
+        self.index_path = join(self.store_dir, "index.json")
+        self.data_path = join(self.store_dir, "embeddings.f16")
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+        if not exists(join(self.store_dir, "namespace.json")):
+            with open(join(self.store_dir, "namespace.json"), "w") as f:
+                json.dump(namespace, f, indent=2)
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _load_index(self) -> dict:
+        if not exists(self.index_path):
+            return {"dim": None, "rows": {}}
+        with open(self.index_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def get(self, keys: list[str]):
+        """
+        Look up embeddings by content hash.
+
+        Returns:
+            dict: A mapping from the found keys to their embeddings (float16 arrays).
+        """
+        try:
+            index = self._load_index()
+            found = {k: index["rows"][k] for k in keys if k in index["rows"]}
+            if len(found) == 0:
+                return {}
+            # only the published rows are mapped, a writer may be appending more
+            matrix = np.memmap(
+                self.data_path,
+                dtype=np.float16,
+                mode="r",
+                shape=(max(found.values()) + 1, index["dim"]),
+            )
+            return {k: np.array(matrix[row]) for k, row in found.items()}
+        except (OSError, ValueError) as e:
+            logger.warning(
+                "Ignoring unreadable embedding cache %s: %s", self.store_dir, e
+            )
+            return {}
+
+    def put(self, embeddings: dict):
+        """
+        Append embeddings keyed by content hash, existing keys are skipped.
+        """
+        # filelock comes with torch, which computing embeddings requires anyway
+        from filelock import FileLock
+
+        with self._lock, FileLock(self.index_path + ".lock"):
+            # read under the lock, other processes may have appended rows meanwhile
+            index = self._load_index()
+            new_items = {k: v for k, v in embeddings.items() if k not in index["rows"]}
+            if len(new_items) == 0:
+                return
+            matrix = np.stack(
+                [
+                    np.asarray(v, dtype=np.float16).reshape(-1)
+                    for v in new_items.values()
+                ]
+            )
+            if index["dim"] is None:
+                index["dim"] = matrix.shape[1]
+            elif index["dim"] != matrix.shape[1]:
+                raise ValueError(
+                    f"Embedding dimension mismatch: {matrix.shape[1]} != {index['dim']}"
+                )
+            # rows are appended before the index is published, readers never see partial rows
+            num_rows = (
+                os.path.getsize(self.data_path) // (2 * index["dim"])
+                if exists(self.data_path)
+                else 0
+            )
+            with open(self.data_path, "ab") as f:
+                f.truncate(num_rows * 2 * index["dim"])
+                f.write(matrix.tobytes())
+            for i, key in enumerate(new_items):
+                index["rows"][key] = num_rows + i
+            tmp_path = self.index_path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+
+def _load_image(path: str, transform):
+    with Image.open(path) as image:
+        return transform(image.convert("RGB"))
+
+
 def get_image_embedding(
-    image_dir: str, extractor, model, batchsize: int = 16
-) -> dict[str, list[float]]:
+    image_dir: str,
+    extractor,
+    model,
+    batchsize: int = 16,
+    cache_dir: str | None = EMBEDDING_CACHE_DIR,
+    pooling: str = "flatten",
+    num_workers: int | None = None,
+) -> dict[str, np.ndarray]:
     """
     Generate image embeddings for images in a directory.
 
+    Images are decoded by a thread pool, the next batch is prefetched while the model runs the current one.
+
     Args:
         image_dir (str): The directory containing images.
         extractor: The feature extractor for images.
         model: The model used for generating embeddings.
         batchsize (int): The batch size for processing images.
+        cache_dir (str | None): The embedding cache directory, only images not seen before are embedded, None to disable.
+        pooling (str): How to pool the last hidden state: "flatten" (all tokens), "cls" or "mean".
+            The default `sim_bound` of `get_cluster` is tuned for flattened features, `SlideInducter` passes its own for CLS features.
+        num_workers (int | None): The number of image decoding threads.
 
     Returns:
         dict: A dictionary mapping image filenames to their embeddings.
@@ -212,6 +346,8 @@ def get_image_embedding(
     import torch
     import torchvision.transforms as T
 
+    if pooling not in ("cls", "mean", "flatten"):
+        raise ValueError(f"Unsupported pooling: {pooling}")
     transform = T.Compose(
         [
             T.Resize(int((256 / 224) * extractor.size["height"])),
@@ -221,55 +357,110 @@ def get_image_embedding(
         ]
     )
 
-    inputs = []
-    embeddings = []
     images = [i for i in sorted(os.listdir(image_dir)) if is_image_path(i)]
-    for file in images:
-        image = Image.open(join(image_dir, file)).convert("RGB")
-        inputs.append(transform(image))
-        if len(inputs) % batchsize == 0 or file == images[-1]:
-            batch = {"pixel_values": torch.stack(inputs).to(model.device)}
-            embeddings.extend(model(**batch).last_hidden_state.detach())
-            inputs.clear()
-    return {
-        image: embedding.flatten().tolist()
-        for image, embedding in zip(images, embeddings)
-    }
-
-
-def images_cosine_similarity(embeddings: list[list[float]]) -> list[float]:
+    store = None
+    cached = {}
+    if cache_dir:
+        try:
+            store = EmbeddingStore(
+                cache_dir,
+                {
+                    "model": model.name_or_path,
+                    "dtype": str(model.dtype),
+                    "transform": repr(transform),
+                    "output": pooling,
+                },
+            )
+        except OSError as e:
+            logger.warning(
+                "Embedding cache disabled, %s is not writable: %s", cache_dir, e
+            )
+    if store is not None:
+        hashes = {
+            file: EmbeddingStore.hash_file(join(image_dir, file)) for file in images
+        }
+        cached = store.get(list(set(hashes.values())))
+        logger.debug("Embedding cache hit: %d/%d", len(cached), len(images))
+
+    embeddings = {}
+    uncached = [i for i in images if store is None or hashes[i] not in cached]
+    batches = [uncached[i : i + batchsize] for i in range(0, len(uncached), batchsize)]
+    with (
+        ThreadPoolExecutor(
+            max_workers=num_workers or min(8, os.cpu_count() or 1)
+        ) as executor,
+        torch.inference_mode(),
+    ):
+
+        def prefetch(batch: list[str]):
+            return [
+                executor.submit(_load_image, join(image_dir, file), transform)
+                for file in batch
+            ]
+
+        pending = prefetch(batches[0]) if batches else []
+        for batch_idx, batch in enumerate(batches):
+            pixel_values = torch.stack([future.result() for future in pending])
+            if batch_idx + 1 < len(batches):
+                pending = prefetch(batches[batch_idx + 1])
+            hidden = model(pixel_values=pixel_values.to(model.device)).last_hidden_state
+            if pooling == "cls":
+                hidden = hidden[:, 0]
+            elif pooling == "mean":
+                hidden = hidden.mean(dim=1)
+            else:
+                hidden = hidden.flatten(1)
+            # round to float16 so fresh and cached embeddings are identical
+            embeddings.update(zip(batch, hidden.to(torch.float16).cpu().numpy()))
+
+    if store is not None:
+        try:
+            store.put({hashes[i]: embeddings[i] for i in uncached})
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to cache embeddings in %s: %s", store.store_dir, e)
+        for file in images:
+            if file not in embeddings:
+                embeddings[file] = cached[hashes[file]]
+    return {image: embeddings[image].astype(np.float32) for image in images}
+
+
+def images_cosine_similarity(embeddings):
     """
     Calculate the cosine similarity matrix for a list of embeddings.
+
+    Embeddings are L2-normalised once and the full matrix is computed with a single matmul.
+    The diagonal is set to zero so a slide is never paired with itself.
+
     Args:
-        embeddings (list[torch.Tensor]): A list of image embeddings.
+        embeddings (list[np.ndarray] | torch.Tensor): A list (or NxD tensor) of image embeddings.
 
     Returns:
         torch.Tensor: A NxN similarity matrix.
     """
     import torch
 
-    embeddings = [torch.tensor(embedding) for embedding in embeddings]
-    sim_matrix = torch.zeros((len(embeddings), len(embeddings)))
-    for i in range(len(embeddings)):
-        for j in range(i + 1, len(embeddings)):
-            sim_matrix[i, j] = sim_matrix[j, i] = torch.nn.functional.cosine_similarity(
-                embeddings[i], embeddings[j], -1
-            )
-    return sim_matrix.tolist()
+    if not isinstance(embeddings, torch.Tensor):
+        embeddings = torch.from_numpy(np.asarray(embeddings, dtype=np.float32))
+    embeddings = embeddings.float()
+    if embeddings.ndim == 1:
+        embeddings = embeddings.unsqueeze(0)
+    embeddings = embeddings.flatten(1)
+    normalized = torch.nn.functional.normalize(embeddings, dim=-1, eps=1e-8)
+    sim_matrix = normalized @ normalized.T
+    sim_matrix.fill_diagonal_(0)
+    return sim_matrix
 
 
 IMAGENET_MEAN = (0.485, 0.456, 0.406)
 IMAGENET_STD = (0.229, 0.224, 0.225)
 
 
-def average_distance(
-    similarity: list[list[float]], idx: int, cluster_idx: list[int]
-) -> float:
+def average_distance(similarity, idx: int, cluster_idx: list[int]) -> float:
     """
     Calculate the average distance between a point (idx) and a cluster (cluster_idx).
 
     Args:
-        similarity (list[list[float]]): The similarity matrix.
+        similarity (list[list[float]] | torch.Tensor): The similarity matrix.
         idx (int): The index of the point.
         cluster_idx (list): The indices of the cluster.
 
@@ -278,21 +469,22 @@ def average_distance(
     """
     import torch
 
-    similarity = torch.tensor(similarity)
     if idx in cluster_idx:
         return 0
-    total_similarity = 0
-    for idx_in_cluster in cluster_idx:
-        total_similarity += similarity[idx, idx_in_cluster]
-    return total_similarity / len(cluster_idx)
+    similarity = torch.as_tensor(similarity)
+    return similarity[idx, cluster_idx].mean()
 
 
-def get_cluster(similarity: list[list[float]], sim_bound: float = 0.65):
+def get_cluster(similarity, sim_bound: float = 0.65):
     """
     Cluster points based on similarity.
 
+    Greedily grows existing clusters with the point of highest average similarity,
+    otherwise seeds a new cluster with the most similar remaining pair.
+    Per-cluster similarity sums are maintained incrementally, so every greedy step is a single argmax.
+
     Args:
-        similarity (list[list[float]]): The similarity matrix.
+        similarity (list[list[float]] | torch.Tensor): The similarity matrix.
         sim_bound (float): The similarity threshold for clustering.
 
     Returns:
@@ -300,46 +492,50 @@ def get_cluster(similarity: list[list[float]], sim_bound: float = 0.65):
     """
     import torch
 
-    similarity = torch.tensor(similarity)
-    sim_copy = similarity.clone()
+    sim_copy = torch.as_tensor(similarity, dtype=torch.float32).clone()
     num_points = sim_copy.shape[0]
-    clusters = []
-    added = [False] * num_points
+    clusters: list[list[int]] = []
+    added = torch.zeros(num_points, dtype=torch.bool)
+    # cluster_sums[c, p] is the summed similarity of point p to the members of cluster c,
+    # taken over `sim_copy`, in which the rows and columns of added points are zeroed
+    cluster_sums = sim_copy.new_zeros((0, num_points))
+    cluster_sizes = sim_copy.new_zeros(0)
+
+    def mark_added(point: int):
+        added[point] = True
+        sim_copy[point, :] = 0
+        sim_copy[:, point] = 0
+        cluster_sums[:, point] = 0
 
     while True:
-        max_avg_dist = sim_bound
-        best_cluster = None
-        best_point = None
-
-        for c in clusters:
-            for point_idx in range(num_points):
-                if added[point_idx]:
-                    continue
-                avg_dist = average_distance(sim_copy, point_idx, c)
-                if avg_dist > max_avg_dist:
-                    max_avg_dist = avg_dist
-                    best_cluster = c
-                    best_point = point_idx
-
-        if best_point is not None:
-            best_cluster.append(best_point)
-            added[best_point] = True
-            sim_copy[best_point, :] = 0
-            sim_copy[:, best_point] = 0
-        else:
-            if sim_copy.max() < sim_bound:
-                # append the remaining points individual cluster
-                for i in range(num_points):
-                    if not added[i]:
-                        clusters.append([i])
-                break
-            i, j = torch.unravel_index(torch.argmax(sim_copy), sim_copy.shape)
-            clusters.append([int(i), int(j)])
-            added[i] = True
-            added[j] = True
-            sim_copy[i, :] = 0
-            sim_copy[:, i] = 0
-            sim_copy[j, :] = 0
-            sim_copy[:, j] = 0
+        if len(clusters) != 0 and not bool(added.all()):
+            avg_dist = cluster_sums / cluster_sizes.unsqueeze(1)
+            avg_dist[:, added] = float("-inf")
+            # argmax returns the first maximum, i.e. the first cluster and then the first point
+            best = int(torch.argmax(avg_dist))
+            best_cluster, best_point = divmod(best, num_points)
+            if avg_dist[best_cluster, best_point] > sim_bound:
+                clusters[best_cluster].append(best_point)
+                mark_added(best_point)
+                cluster_sums[best_cluster] += sim_copy[:, best_point]
+                cluster_sizes[best_cluster] += 1
+                continue
+
+        if num_points == 0 or sim_copy.max() < sim_bound:
+            # append the remaining points individual cluster
+            for i in range(num_points):
+                if not added[i]:
+                    clusters.append([i])
+            break
+        i, j = (
+            int(k) for k in torch.unravel_index(torch.argmax(sim_copy), sim_copy.shape)
+        )
+        clusters.append([i, j])
+        mark_added(i)
+        mark_added(j)
+        cluster_sums = torch.cat(
+            [cluster_sums, (sim_copy[:, i] + sim_copy[:, j]).unsqueeze(0)]
+        )
+        cluster_sizes = torch.cat([cluster_sizes, sim_copy.new_tensor([2.0])])
 
     return clusters
@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Any
+
+from pptagent.utils import get_logger, run_in_thread
+
+logger = get_logger(__name__)
+
+# default number of workers for each stage of slide generation
+STAGE_WORKERS = {
+    "select_layout": 8,
+    "generate_content": 8,
+    "edit_slide": 8,
+    "execute_actions": 4,
+    "validate": 1,
+}
+# stages running deterministic CPU work, executed in threads to keep the event loop free
+CPU_STAGES = {"execute_actions", "validate"}
+# releases the admission slot of the current slide, see `Admission`
+_ADMISSION_RELEASE: contextvars.ContextVar[Callable[[], None] | None] = (
+    contextvars.ContextVar("admission_release", default=None)
+)
+
+
+class Stage:
+    """
+    A stage of slide generation with its own queue, number of workers and timing statistics.
+    Slides only hold a worker of the stage they are in, so different stages overlap across slides.
+    """
+
+    def __init__(self, name: str, workers: int, in_thread: bool = False):
+        """
+        Initialize the Stage.
+
+        Args:
+            name (str): The name of the stage.
+            workers (int): The number of jobs of this stage running at once.
+            in_thread (bool): Whether to run jobs in a thread, for synchronous CPU-bound functions.
+        """
+        self.name = name
+        self.workers = workers
+        self.in_thread = in_thread
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.service_time = 0.0
+        self.max_service_time = 0.0
+        self._semaphore = None
+        self._loop = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to the loop they are first used in
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.workers)
+            self._loop = loop
+        return self._semaphore
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Queue a job in the stage and wait for its result.
+
+        Args:
+            func (Callable): The function to run, a coroutine function unless the stage runs in threads.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+
+        Returns:
+            Any: The result of the function.
+        """
+        semaphore = self.semaphore
+        enqueued = perf_counter()
+        self.queued += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.queued -= 1
+        release_admission = _ADMISSION_RELEASE.get()
+        if release_admission is not None:
+            release_admission()
+        started = perf_counter()
+        self.wait_time += started - enqueued
+        self.running += 1
+        try:
+            if self.in_thread:
+                result = await run_in_thread(func, *args, **kwargs)
+            else:
+                result = await func(*args, **kwargs)
+        except BaseException:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return result
+        finally:
+            elapsed = perf_counter() - started
+            self.service_time += elapsed
+            self.max_service_time = max(self.max_service_time, elapsed)
+            self.running -= 1
+            semaphore.release()
+
+    def metrics(self) -> dict[str, int | float]:
+        """
+        Get the queue depth and service time of the stage.
+        """
+        finished = max(self.completed + self.failed, 1)
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": self.wait_time / finished,
+            "avg_service": self.service_time / finished,
+            "max_service": self.max_service_time,
+        }
+
+
+class Admission:
+    """
+    Bound the number of slides admitted into the pipeline but not yet started.
+    A slide holds its slot only until it gets a worker of its first stage, from there the stage workers govern concurrency.
+    """
+
+    def __init__(self, limit: int | None = None):
+        """
+        Initialize the Admission.
+
+        Args:
+            limit (int | None): The maximum number of slides waiting for their first stage, unbounded if None.
+        """
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Wait for an admission slot, released by the first stage job or on exit, whichever comes first.
+        """
+        if self._semaphore is None:
+            yield
+            return
+        await self._semaphore.acquire()
+        held = True
+
+        def release():
+            nonlocal held
+            if held:
+                held = False
+                self._semaphore.release()
+
+        token = _ADMISSION_RELEASE.set(release)
+        try:
+            yield
+        finally:
+            _ADMISSION_RELEASE.reset(token)
+            release()
+
+
+class StagePipeline:
+    """
+    The stages of slide generation, each with a separate queue and worker count.
+    """
+
+    def __init__(self, workers: dict[str, int] | None = None):
+        """
+        Initialize the StagePipeline.
+
+        Args:
+            workers (dict[str, int] | None): Number of workers per stage, overriding `STAGE_WORKERS`.
+        """
+        workers = STAGE_WORKERS | (workers or {})
+        self.stages = {
+            name: Stage(name, num, in_thread=name in CPU_STAGES)
+            for name, num in workers.items()
+        }
+
+    def __getitem__(self, name: str) -> Stage:
+        return self.stages[name]
+
+    def metrics(self) -> dict[str, dict[str, int | float]]:
+        return {name: stage.metrics() for name, stage in self.stages.items()}
+
+    def log_metrics(self):
+        for name, metrics in self.metrics().items():
+            logger.debug(
+                "Stage %s: %d done, %d failed, avg wait %.2fs, avg service %.2fs, max service %.2fs",
+                name,
+                metrics["completed"],
+                metrics["failed"],
+                metrics["avg_wait"],
+                metrics["avg_service"],
+                metrics["max_service"],
+            )
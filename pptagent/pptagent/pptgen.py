@@ -1,19 +1,25 @@
 import asyncio
 import json
 import os
+import re
 import traceback
 from abc import ABC, abstractmethod
-from contextlib import AsyncExitStack
-from copy import deepcopy
+from bisect import bisect_left
+from collections.abc import AsyncGenerator
+from contextlib import AsyncExitStack, aclosing
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
+from math import ceil
 from random import shuffle
 
+from jinja2 import StrictUndefined, Template
+
 from pptagent.agent import Agent
-from pptagent.apis import API_TYPES, CodeExecutor
+from pptagent.apis import API_TYPES, CodeExecutor, compile_commands
 from pptagent.document import Document
 from pptagent.llms import AsyncLLM
+from pptagent.pipeline import Admission, StagePipeline
 from pptagent.presentation import (
     GroupShape,
     Layout,
@@ -22,11 +28,19 @@ from pptagent.presentation import (
     SlidePage,
     StyleArg,
 )
-from pptagent.response import EditorOutput, LayoutChoice, Outline, OutlineItem
+from pptagent.response import (
+    EditorOutput,
+    LayoutChoice,
+    Outline,
+    OutlineItem,
+    SlideElement,
+)
 from pptagent.utils import (
     Language,
     edit_distance,
     get_logger,
+    monitor_event_loop,
+    package_join,
     tenacity_decorator,
 )
 
@@ -60,6 +74,137 @@ FunctionalContent = {
 }
 
 
+POLISH_FUNCTIONAL_PROMPT = Template(
+    open(package_join("prompts", "polish_functional.txt"), encoding="utf-8").read(),
+    undefined=StrictUndefined,
+)
+TOC_TITLES = {"zh": "目录", "ja": "目次", "ko": "목차"}
+ENDING_TITLES = {"zh": "谢谢！", "ja": "ありがとうございました", "ko": "감사합니다"}
+METADATA_KEYWORDS = {
+    "affiliation": [
+        "affiliation",
+        "organization",
+        "organisation",
+        "institution",
+        "school",
+        "university",
+        "department",
+        "company",
+    ],
+    "presenter": ["presenter", "author", "speaker", "name"],
+}
+NUMBERING_REGEX = re.compile(
+    r"^\s*(?:(?:chapter|section|part)\s*\d+[.:：]?|章节?[一二三四五六七八九十\d]+[.。、:：]?"
+    r"|[一二三四五六七八九十]+[、.．]|\d+(?:\.\d+)*[.、)）]?)\s*",
+    re.IGNORECASE,
+)
+
+
+def strip_numbering(text: str) -> str:
+    return NUMBERING_REGEX.sub("", text, count=1).strip() or text.strip()
+
+
+def fit_length(text: str, limit: int) -> str:
+    """
+    Shorten a text exceeding the limit at a natural separator, or else at a word boundary.
+    """
+    if len(text) <= limit:
+        return text
+    for sep in (":", "：", " - ", " — ", "(", "（", "，", ","):
+        head = text.split(sep)[0].strip()
+        if limit // 3 <= len(head) <= limit:
+            return head
+    head = text[:limit]
+    if " " in head:
+        head = head.rsplit(" ", 1)[0]
+    elif head.isascii():
+        # never break a latin word apart
+        return text
+    return head.rstrip(" ,.;:，。；：")
+
+
+def find_metadata(
+    metadata: dict[str, str], keywords: list[str], excludes: list[str] | None = None
+) -> str | None:
+    """
+    Find the metadata value of the keywords, from a key equal to one of them,
+    or else from the first key containing one of them but none of the more specific `excludes`.
+    """
+    for keyword in keywords:
+        if metadata.get(keyword):
+            return metadata[keyword]
+    for key, value in metadata.items():
+        if (
+            value
+            and any(keyword in key for keyword in keywords)
+            and not any(exclude in key for exclude in excludes or [])
+        ):
+            return value
+    return None
+
+
+def element_role(name: str) -> str:
+    """
+    Guess what an element of a functional layout holds from its name.
+    """
+    name = name.lower()
+    if "info" in name or " and " in name:
+        return "composite"
+    if "number" in name:
+        return "number"
+    if "date" in name:
+        return "date"
+    roles = [
+        role
+        for role, keywords in METADATA_KEYWORDS.items()
+        if any(keyword in name for keyword in keywords)
+    ]
+    # e.g. "presenter affiliation" holds both
+    if len(roles) > 1:
+        return "composite"
+    if roles:
+        return roles[0]
+    if "sub" in name and "title" in name:
+        return "subtitle"
+    if any(keyword in name for keyword in ("title", "message", "heading")):
+        return "title"
+    if any(keyword in name for keyword in ("list", "bullet", "item", "content")):
+        return "list"
+    return "body"
+
+
+def hide_small_pics(
+    presentation: Presentation,
+    layouts: dict[str, Layout],
+    area_ratio: float,
+    keep_in_background: bool,
+):
+    """
+    Remove pictures smaller than `area_ratio` of the slide from the template slides of the layouts,
+    turning layouts without pictures left into text layouts.
+    """
+    for layout in list(layouts.values()):
+        template_slide = presentation.slides[layout.template_id - 1]
+        pictures: list[tuple[SlidePage | GroupShape, Picture]] = list(
+            template_slide.shape_filter(Picture, return_father=True)
+        )
+        if len(pictures) == 0:
+            continue
+        for father, pic in pictures:
+            if pic.area / pic.slide_area < area_ratio:
+                father.shapes.remove(pic)
+                if keep_in_background:
+                    template_slide.backgrounds.append(pic)
+                layout.remove_item(pic.caption)
+
+        if len(list(template_slide.shape_filter(Picture))) == 0:
+            logger.debug(
+                "All pictures in layout %s are too small, set to pure text layout",
+                layout.title,
+            )
+            layouts[layout.title.replace(":image", ":text")] = layouts.pop(layout.title)
+
+
 @dataclass
 class PPTGen(ABC):
     """
@@ -82,10 +227,24 @@ class PPTGen(ABC):
     force_pages: bool = False
     error_exit: bool = False
     record_cost: bool = False
+    stage_workers: dict[str, int] | None = None
+    compile_commands: bool = True
+    fast_functional: bool = True
+    polish_functional: bool = False
     _initialized: bool = False
 
     def __post_init__(self):
         self._hire_staffs(self.record_cost, self.language_model, self.vision_model)
+        self.pipeline = StagePipeline(self.stage_workers)
+        self.command_stats = {"compiled": 0, "coder": 0}
+
+    @property
+    def compile_coverage(self) -> float:
+        """
+        The ratio of slides whose commands were compiled without the coder agent.
+        """
+        total = self.command_stats["compiled"] + self.command_stats["coder"]
+        return self.command_stats["compiled"] / total if total else 0.0
 
     def set_reference(
         self,
@@ -93,6 +252,7 @@ class PPTGen(ABC):
         presentation: Presentation,
         hide_small_pic_ratio: float | None = 0.2,
         keep_in_background: bool = True,
+        template_html: dict[int, str] | None = None,
     ):
         """
         Set the reference presentation and extracted presentation information.
@@ -100,6 +260,7 @@ class PPTGen(ABC):
         Args:
             presentation (Presentation): The presentation object.
             slide_induction (dict): The slide induction data.
+            template_html (dict[int, str] | None): Pre-rendered HTML of the template slides by template id, rendered on demand if not given.
 
         Returns:
             PPTGen: The updated PPTGen object.
@@ -112,12 +273,13 @@ class PPTGen(ABC):
         self.layouts: dict[str, Layout] = {
             k: Layout(title=k, **v) for k, v in slide_induction.items()
         }
-        self.empty_prs = deepcopy(self.presentation)
+        self.empty_prs = self.presentation.snapshot()
         assert hide_small_pic_ratio is None or hide_small_pic_ratio > 0, (
             "hide_small_pic_ratio must be positive or None"
         )
         if hide_small_pic_ratio is not None:
             self._hide_small_pics(hide_small_pic_ratio, keep_in_background)
+        self.template_html = dict(template_html or {})
 
         self.text_layouts = [
             k
@@ -159,11 +321,151 @@ class PPTGen(ABC):
             dst_language (Language | None): The destination language.
             length_factor (float | None): The length factor.
             auto_length_factor (bool): Whether to automatically calculate the length factor.
-            max_at_once (int | None): The maximum number of slides to generate at once.
+            max_at_once (int | None): The maximum number of slides admitted but waiting for their first stage, the concurrency of each stage is set by `stage_workers`.
 
         Returns:
             tuple[Presentation, dict]: A tuple containing the generated presentation and the history of the agents.
         """
+        await self._prepare_generation(
+            source_doc,
+            num_slides,
+            outline,
+            image_dir,
+            dst_language,
+            length_factor,
+            auto_length_factor,
+        )
+        succ_flag = True
+        slide_results: dict[int, tuple[SlidePage, CodeExecutor]] = {}
+        # closed on exit, so unfinished slides are cancelled as soon as we stop early
+        async with aclosing(self._iter_slides(num_slides, max_at_once)) as slides:
+            async for slide_idx, result in slides:
+                if isinstance(result, Exception):
+                    if self.error_exit:
+                        succ_flag = False
+                        break
+                    continue
+                if result is not None:
+                    slide_results[slide_idx] = result
+
+        generated_slides = []
+        code_executors = []
+        for slide_idx in sorted(slide_results):
+            slide, code_executor = slide_results[slide_idx]
+            generated_slides.append(slide)
+            code_executors.append(code_executor)
+
+        history = self._collect_history(
+            sum(code_executors, start=CodeExecutor(self.retry_times))
+        )
+
+        if succ_flag:
+            self.empty_prs.slides = generated_slides
+            prs = self.empty_prs
+        else:
+            prs = None
+
+        self.empty_prs = self.presentation.snapshot()
+        return prs, history
+
+    async def generate_pres_stream(
+        self,
+        source_doc: Document,
+        num_slides: int | None = None,
+        outline: list[OutlineItem] | None = None,
+        image_dir: str | None = None,
+        dst_language: Language | None = None,
+        length_factor: float | None = None,
+        auto_length_factor: bool = True,
+        max_at_once: int | None = None,
+        slide_timeout: float | None = None,
+        output_file: str | None = None,
+    ) -> AsyncGenerator[tuple[int, SlidePage | None, dict], None]:
+        """
+        Generate a PowerPoint presentation, yielding slides in the order they complete.
+
+        The finished slides are kept in `self.partial_prs` in outline order, and saved to `output_file` after each slide,
+        so the file is always a valid presentation of the slides generated so far.
+        Once the stream is exhausted, the history of the agents is available in `self.history`.
+
+        Args:
+            source_doc (Document): The source document.
+            num_slides (int | None): The number of slides to generate.
+            outline (list[OutlineItem] | None): The outline of the presentation.
+            image_dir (str | None): The directory of the images.
+            dst_language (Language | None): The destination language.
+            length_factor (float | None): The length factor.
+            auto_length_factor (bool): Whether to automatically calculate the length factor.
+            max_at_once (int | None): The maximum number of slides admitted but waiting for their first stage, the concurrency of each stage is set by `stage_workers`.
+            slide_timeout (float | None): The seconds a slide may take once started, before it is abandoned.
+            output_file (str | None): The file to progressively save the presentation to.
+
+        Yields:
+            tuple[int, SlidePage | None, dict]: The index of the slide in the outline, the slide (None if it failed) and its history.
+        """
+        await self._prepare_generation(
+            source_doc,
+            num_slides,
+            outline,
+            image_dir,
+            dst_language,
+            length_factor,
+            auto_length_factor,
+        )
+        self.partial_prs = self.presentation.snapshot()
+        self.partial_prs.clear_slides()
+        self.partial_prs.slides = []
+        finished_idxs = []
+        code_executors = {}
+        async with aclosing(
+            self._iter_slides(num_slides, max_at_once, slide_timeout)
+        ) as slides:
+            async for slide_idx, result in slides:
+                if isinstance(result, Exception):
+                    if self.error_exit:
+                        raise result
+                    yield slide_idx, None, {"error": repr(result)}
+                    continue
+                if result is None:
+                    continue
+                slide, code_executor = result
+                code_executors[slide_idx] = code_executor
+                position = bisect_left(finished_idxs, slide_idx)
+                finished_idxs.insert(position, slide_idx)
+                self.partial_prs.insert_slide(slide, position)
+                if output_file is not None:
+                    self.partial_prs.save_built(output_file)
+                yield (
+                    slide_idx,
+                    slide,
+                    {
+                        "command_history": code_executor.command_history,
+                        "code_history": code_executor.code_history,
+                        "api_history": code_executor.api_history,
+                    },
+                )
+
+        self.history = self._collect_history(
+            sum(
+                [code_executors[i] for i in finished_idxs],
+                start=CodeExecutor(self.retry_times),
+            )
+        )
+        self.empty_prs = self.presentation.snapshot()
+
+    async def _prepare_generation(
+        self,
+        source_doc: Document,
+        num_slides: int | None,
+        outline: list[OutlineItem] | None,
+        image_dir: str | None,
+        dst_language: Language | None,
+        length_factor: float | None,
+        auto_length_factor: bool,
+    ):
+        """
+        Validate the source document, then settle the length factor and the outline.
+        """
         # validate image existence
         source_doc.validate_medias(image_dir)
         source_doc.metadata["presentation-date"] = datetime.now().strftime("%Y-%m-%d")
@@ -177,7 +479,6 @@ class PPTGen(ABC):
             self.length_factor = get_length_factor(self.reference_lang, self.dst_lang)
         else:
             self.length_factor = length_factor
-        succ_flag = True
         if outline is None:
             self.outline = await self.generate_outline(num_slides, source_doc)
         else:
@@ -195,46 +496,66 @@ class PPTGen(ABC):
             self.simple_outline += f"Slide {slide_idx + 1}: {item.purpose}\n"
         logger.debug(f"==========Outline Generated==========\n{self.simple_outline}")
 
-        if max_at_once:
-            semaphore = asyncio.Semaphore(max_at_once)
-        else:
-            semaphore = AsyncExitStack()
+    async def _iter_slides(
+        self,
+        num_slides: int | None,
+        max_at_once: int | None,
+        slide_timeout: float | None = None,
+    ) -> AsyncGenerator[tuple[int, tuple[SlidePage, CodeExecutor] | Exception], None]:
+        """
+        Generate the slides of the outline concurrently, yielding `(slide_idx, result)` as each slide completes.
+        Failed slides yield their exception, unfinished slides are cancelled when the iteration is closed early.
+        """
+        monitor = monitor_event_loop()
+        admission = Admission(max_at_once)
 
-        slide_tasks = []
+        async def run_slide(slide_idx: int, outline_item: OutlineItem):
+            # the timeout starts once the slide is admitted into the pipeline
+            async with admission.slot():
+                return await asyncio.wait_for(
+                    self.generate_slide(
+                        slide_idx, outline_item, semaphore=AsyncExitStack()
+                    ),
+                    slide_timeout,
+                )
+
+        tasks = {}
         for slide_idx, outline_item in enumerate(self.outline):
             if self.force_pages and slide_idx == num_slides:
                 break
-            slide_tasks.append(
-                self.generate_slide(slide_idx, outline_item, semaphore=semaphore)
-            )
-
-        slide_results = await asyncio.gather(*slide_tasks, return_exceptions=True)
-
-        generated_slides = []
-        code_executors = []
-        for result in slide_results:
-            if isinstance(result, Exception):
-                if self.error_exit:
-                    succ_flag = False
-                    break
-                continue
-            if result is not None:
-                slide, code_executor = result
-                generated_slides.append(slide)
-                code_executors.append(code_executor)
-
-        history = self._collect_history(
-            sum(code_executors, start=CodeExecutor(self.retry_times))
-        )
-
-        if succ_flag:
-            self.empty_prs.slides = generated_slides
-            prs = self.empty_prs
-        else:
-            prs = None
+            tasks[asyncio.create_task(run_slide(slide_idx, outline_item))] = slide_idx
 
-        self.empty_prs = deepcopy(self.presentation)
-        return prs, history
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=tasks.get):
+                    if task.exception() is not None:
+                        exception = task.exception()
+                        if isinstance(exception, asyncio.TimeoutError):
+                            logger.warning(
+                                "Slide %d timed out after %ss",
+                                tasks[task],
+                                slide_timeout,
+                            )
+                        yield tasks[task], exception
+                    else:
+                        yield tasks[task], task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            self.pipeline.log_metrics()
+            if monitor is not None:
+                monitor.log_report()
+            logger.debug(
+                "Compiled commands of %d slides, coverage: %.2f",
+                self.command_stats["compiled"],
+                self.compile_coverage,
+            )
 
     async def generate_outline(
         self,
@@ -317,29 +638,151 @@ class PPTGen(ABC):
             pre_section = item.topic
         return full_outline
 
-    def _hide_small_pics(self, area_ratio: float, keep_in_background: bool):
-        for layout in list(self.layouts.values()):
-            template_slide = self.presentation.slides[layout.template_id - 1]
-            pictures: list[tuple[SlidePage | GroupShape, Picture]] = list(
-                template_slide.shape_filter(Picture, return_father=True)
+    async def _fill_functional(
+        self, slide_idx: int, outline_item: OutlineItem, layout: Layout
+    ) -> EditorOutput | None:
+        """
+        Fill a functional slide from the outline and the document metadata without the editor agent.
+
+        Returns:
+            EditorOutput | None: The content of the slide, or None if it cannot be determined and the editor agent is needed.
+        """
+        purpose = outline_item.purpose
+        dst_lang = getattr(self, "dst_lang", None) or self.source_doc.language
+        if dst_lang.lid != self.source_doc.language.lid and not self.polish_functional:
+            return None
+
+        metadata = {k.lower(): v for k, v in self.source_doc.metadata.items() if v}
+        presenter_keywords = METADATA_KEYWORDS["presenter"]
+        affiliation_keywords = METADATA_KEYWORDS["affiliation"]
+
+        title = None
+        summary = None
+        numbers = {"slide": str(slide_idx + 1)}
+        if purpose == FunctionalLayouts.OPENING.value:
+            title = find_metadata(
+                metadata,
+                ["title"],
+                ["subtitle", *presenter_keywords, *affiliation_keywords],
             )
-            if len(pictures) == 0:
-                continue
-            for father, pic in pictures:
-                if pic.area / pic.slide_area < area_ratio:
-                    father.shapes.remove(pic)
-                    if keep_in_background:
-                        template_slide.backgrounds.append(pic)
-                    layout.remove_item(pic.caption)
-
-            if len(list(template_slide.shape_filter(Picture))) == 0:
-                logger.debug(
-                    "All pictures in layout %s are too small, set to pure text layout",
-                    layout.title,
-                )
-                self.layouts[layout.title.replace(":image", ":text")] = (
-                    self.layouts.pop(layout.title)
-                )
+            summary = find_metadata(metadata, ["subtitle"])
+        elif purpose == FunctionalLayouts.TOC.value:
+            title = TOC_TITLES.get(dst_lang.lid, "Contents")
+        elif purpose == FunctionalLayouts.SECTION_OUTLINE.value:
+            section, sec_idx = outline_item.indexes
+            title = strip_numbering(section)
+            numbers["section"] = str(sec_idx + 1)
+            try:
+                summary = self.source_doc[section].summary
+            except IndexError:
+                pass
+        elif purpose == FunctionalLayouts.ENDING.value:
+            title = ENDING_TITLES.get(dst_lang.lid, "Thank you!")
+        if title is None:
+            return None
+
+        # "author affiliation" is an affiliation, "company name" is not a presenter
+        presenter = find_metadata(metadata, presenter_keywords, affiliation_keywords)
+        affiliation = find_metadata(metadata, affiliation_keywords)
+        date = self.source_doc.metadata.get("presentation-date")
+        roles = {el.name: element_role(el.name) for el in layout.elements}
+        if purpose == FunctionalLayouts.TOC.value:
+            # the table of contents goes to the text element listing the most items
+            text_elements = [
+                el
+                for el in layout.elements
+                if el.type == "text" and roles[el.name] in ("list", "body")
+            ]
+            if not text_elements:
+                return None
+            roles[max(text_elements, key=lambda el: len(el.data)).name] = "list"
+
+        factor = float(self.length_factor or 1)
+        elements = []
+        title_filled = False
+        for el in layout.elements:
+            role = roles[el.name]
+            data = []
+            if el.type == "image":
+                pass
+            elif purpose == FunctionalLayouts.ENDING.value:
+                if role == "title" and not title_filled:
+                    data = [title]
+            elif role == "title" and not title_filled:
+                data = [title]
+            elif role == "subtitle" or (role == "body" and summary is not None):
+                data = [summary] if summary else []
+            elif role == "list" and purpose == FunctionalLayouts.TOC.value:
+                data = [
+                    strip_numbering(item.topic)
+                    for idx, item in enumerate(self.outline)
+                    if item.topic != "Functional"
+                    and all(item.topic != i.topic for i in self.outline[:idx])
+                ]
+            elif role == "number":
+                kind = "slide" if any(k in el.name for k in ("page", "slide")) else None
+                data = [numbers.get(kind) or numbers.get("section", numbers["slide"])]
+            elif role == "date":
+                data = [date] if date else []
+            elif role == "presenter":
+                data = [presenter] if presenter else []
+            elif role == "affiliation":
+                data = [affiliation] if affiliation else []
+            elif role == "composite":
+                data = [v for v in (presenter, affiliation, date) if v][: len(el.data)]
+            fixed = role == "title" and purpose in (
+                FunctionalLayouts.TOC.value,
+                FunctionalLayouts.ENDING.value,
+            )
+            title_filled |= bool(data) and role == "title"
+            if el.type == "text" and not fixed:
+                limit = ceil(el.suggested_characters * factor) + 5
+                data = [fit_length(item, limit) for item in data]
+            if el.variable_length is not None and not (
+                el.variable_length[0] <= len(data) <= el.variable_length[1]
+            ):
+                return None
+            elements.append(SlideElement(name=el.name, data=data))
+
+        if not title_filled:
+            return None
+        editor_output = EditorOutput(elements=elements)
+        if self.polish_functional:
+            editor_output = await self._polish_functional(
+                editor_output, layout, dst_lang
+            )
+        return editor_output
+
+    async def _polish_functional(
+        self, editor_output: EditorOutput, layout: Layout, dst_lang: Language
+    ) -> EditorOutput:
+        """
+        Polish the drafted content of a functional slide with a single language model call.
+        """
+        try:
+            polished = await self.language_model(
+                POLISH_FUNCTIONAL_PROMPT.render(
+                    language=dst_lang.lid,
+                    schema=layout.content_schema,
+                    metadata=self.source_doc.metainfo,
+                    draft=editor_output.model_dump_json(indent=2),
+                ),
+                return_json=True,
+                response_format=EditorOutput.response_model(
+                    [el.name for el in layout.elements]
+                ),
+            )
+            polished = EditorOutput(**polished)
+            for el in editor_output.elements:
+                if len(polished[el.name].data) != len(el.data):
+                    raise ValueError(f"The quantity of {el.name} changed")
+            return polished
+        except Exception as e:
+            logger.warning("Failed to polish functional slide, keep the draft: %s", e)
+            return editor_output
+
+    def _hide_small_pics(self, area_ratio: float, keep_in_background: bool):
+        hide_small_pics(self.presentation, self.layouts, area_ratio, keep_in_background)
 
     def _collect_history(self, code_executor: CodeExecutor):
         """
@@ -396,9 +839,14 @@ class PPTAgent(PPTGen):
         Asynchronously generate a slide from the outline item.
         """
         async with semaphore:
+            editor_output = None
             if outline_item.topic == "Functional":
                 layout = self.layouts[outline_item.purpose]
                 slide_desc = FunctionalContent[outline_item.purpose]
+                if self.fast_functional:
+                    editor_output = await self._fill_functional(
+                        slide_idx, outline_item, layout
+                    )
                 if outline_item.purpose == FunctionalLayouts.SECTION_OUTLINE.value:
                     section, sec_idx = outline_item.indexes
                     slide_desc = slide_desc.format(section, sec_idx + 1)
@@ -417,13 +865,18 @@ class PPTAgent(PPTGen):
                 header, _, _ = outline_item.retrieve(slide_idx, self.source_doc)
                 header += slide_desc
             else:
-                layout, header, slide_content = await self._select_layout(
-                    slide_idx, outline_item
-                )
+                layout, header, slide_content = await self.pipeline[
+                    "select_layout"
+                ].run(self._select_layout, slide_idx, outline_item)
             try:
-                command_list, template_id = await self._generate_content(
-                    layout, slide_content, header
-                )
+                if editor_output is not None:
+                    command_list, template_id = self._generate_commands(
+                        editor_output, layout
+                    )
+                else:
+                    command_list, template_id = await self.pipeline[
+                        "generate_content"
+                    ].run(self._generate_content, layout, slide_content, header)
                 slide, code_executor = await self._edit_slide(command_list, template_id)
             except Exception as e:
                 logger.error(f"Failed to generate slide {slide_idx}, error: {e}")
@@ -496,18 +949,39 @@ class PPTAgent(PPTGen):
         """
         Asynchronously edit the slide.
         """
+        if self.compile_commands:
+            edit_actions = compile_commands(
+                command_list, self.presentation.slides[template_id - 1]
+            )
+            if edit_actions is not None:
+                code_executor = CodeExecutor(self.retry_times)
+                code_executor.command_history.append(command_list)
+                edit_slide, feedback = await self.pipeline["execute_actions"].run(
+                    self._execute_actions, code_executor, edit_actions, template_id
+                )
+                if feedback is None:
+                    self.command_stats["compiled"] += 1
+                    await self.pipeline["validate"].run(
+                        self.empty_prs.validate, edit_slide
+                    )
+                    return edit_slide, code_executor
+                logger.debug(
+                    "Compiled commands failed, fallback to the coder: %s", feedback[1]
+                )
+
+        self.command_stats["coder"] += 1
         code_executor = CodeExecutor(self.retry_times)
         code_executor.command_history.append(command_list)
-        turn_id, edit_actions = await self.staffs["coder"](
+        turn_id, edit_actions = await self.pipeline["edit_slide"].run(
+            self.staffs["coder"],
             api_docs=code_executor.get_apis_docs(API_TYPES.Agent.value),
-            edit_target=self.presentation.slides[template_id - 1].to_html(),
+            edit_target=self.get_template_html(template_id),
             command_list="\n".join([str(i) for i in command_list]),
         )
 
         for error_idx in range(self.retry_times):
-            edit_slide: SlidePage = deepcopy(self.presentation.slides[template_id - 1])
-            feedback = code_executor.execute_actions(
-                edit_actions, edit_slide, self.source_doc
+            edit_slide, feedback = await self.pipeline["execute_actions"].run(
+                self._execute_actions, code_executor, edit_actions, template_id
             )
             if feedback is None:
                 break
@@ -522,12 +996,38 @@ class PPTAgent(PPTGen):
                 raise Exception(
                     f"Failed to generate slide, tried too many times at editing\ntraceback: {feedback[1]}"
                 )
-            edit_actions = await self.staffs["coder"].retry(
-                feedback[0], feedback[1], turn_id, error_idx + 1
+            edit_actions = await self.pipeline["edit_slide"].run(
+                self.staffs["coder"].retry,
+                feedback[0],
+                feedback[1],
+                turn_id,
+                error_idx + 1,
             )
-        self.empty_prs.validate(edit_slide)
+        await self.pipeline["validate"].run(self.empty_prs.validate, edit_slide)
         return edit_slide, code_executor
 
+    def get_template_html(self, template_id: int) -> str:
+        """
+        Get the HTML of a template slide, rendered once per reference presentation.
+        """
+        if template_id not in self.template_html:
+            self.template_html[template_id] = self.presentation.slides[
+                template_id - 1
+            ].to_html()
+        return self.template_html[template_id]
+
+    def _execute_actions(
+        self, code_executor: CodeExecutor, edit_actions: str, template_id: int
+    ) -> tuple[SlidePage, tuple[str, str] | None]:
+        """
+        Apply the edit actions to a fresh copy of the template slide.
+        """
+        edit_slide: SlidePage = self.presentation.slides[template_id - 1].snapshot()
+        feedback = code_executor.execute_actions(
+            edit_actions, edit_slide, self.source_doc
+        )
+        return edit_slide, feedback
+
     async def _validate_content(
         self, editor_output: EditorOutput, layout: Layout, turn_id: int, retry: int = 0
     ):
@@ -547,8 +1047,7 @@ class PPTAgent(PPTGen):
             Exception: If command generation fails.
         """
         try:
-            allowed_images = [m.path for m in self.source_doc.iter_medias()]
-            layout.validate(editor_output, allowed_images)
+            layout.validate(editor_output, self.source_doc.media_index)
             if self.length_factor is not None:
                 await layout.length_rewrite(
                     editor_output, self.length_factor, self.language_model
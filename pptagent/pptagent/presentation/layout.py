@@ -8,7 +8,7 @@ from pydantic import BaseModel, field_validator
 
 from pptagent.llms import AsyncLLM
 from pptagent.response import EditorOutput
-from pptagent.utils import edit_distance, get_logger, package_join
+from pptagent.utils import FuzzyIndex, get_logger, package_join
 
 logger = get_logger(__name__)
 
@@ -74,7 +74,11 @@ class Layout(BaseModel):
 
         return template_id, old_data
 
-    def validate(self, editor_output: EditorOutput, allowed_images: list[str]):
+    def validate(
+        self, editor_output: EditorOutput, allowed_images: list[str] | FuzzyIndex
+    ):
+        if not isinstance(allowed_images, FuzzyIndex):
+            allowed_images = FuzzyIndex(allowed_images)
         for el in self.elements:
             if el.name not in editor_output:
                 raise ValueError(f"Element {el.name} not found in editor output")
@@ -84,13 +88,9 @@ class Layout(BaseModel):
                 "No images provided for slide generation, please leave a blank list for this element"
             )
             for i in range(len(editor_output[el.name].data)):
-                sim_image = max(
-                    allowed_images,
-                    key=lambda x: edit_distance(x, editor_output[el.name].data[i]),
-                )
-                if edit_distance(
-                    sim_image, editor_output[el.name].data[i]
-                ) < 0.5 or not exists(sim_image):
+                idx, similarity = allowed_images.best(editor_output[el.name].data[i])
+                sim_image = allowed_images.items[idx]
+                if similarity < 0.5 or not exists(sim_image):
                     raise ValueError(
                         f"Image {editor_output[el.name].data[i]} not found\n"
                         "Please check the image path and use only existing images\n"
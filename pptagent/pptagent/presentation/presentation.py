@@ -1,6 +1,8 @@
+import os
 import tempfile
 import traceback
 from collections.abc import Generator
+from copy import copy
 from dataclasses import dataclass
 from functools import partial
 from typing import Literal
@@ -142,6 +144,21 @@ class SlidePage:
                     raise ValueError(f"Failed to apply closures to slides: {e}")
         return slide
 
+    def snapshot(self) -> "SlidePage":
+        """
+        Copy the slide page for editing, a cheap replacement of `deepcopy`.
+
+        Shapes are copied with `ShapeElement.snapshot`, sharing their XML with the template slide,
+        and the backgrounds, which are never edited, are shared as well.
+
+        Returns:
+            SlidePage: The snapshot of the slide page.
+        """
+        snapshot = copy(self)
+        snapshot.shapes = [shape.snapshot() for shape in self.shapes]
+        snapshot.backgrounds = list(self.backgrounds)
+        return snapshot
+
     def iter_paragraphs(self) -> Generator[Paragraph, None, None]:
         for shape in self:  # this considered the group shapes
             if not shape.text_frame.is_textframe:
@@ -349,6 +366,22 @@ class Presentation:
             slides, error_history, slide_width, slide_height, file_path, num_pages
         )
 
+    def snapshot(self) -> "Presentation":
+        """
+        Copy the presentation with snapshots of its slides and a freshly loaded pptx.
+
+        Returns:
+            Presentation: The snapshot of the presentation.
+        """
+        return Presentation(
+            [slide.snapshot() for slide in self.slides],
+            list(self.error_history),
+            self.slide_width,
+            self.slide_height,
+            self.source_file,
+            self.num_pages,
+        )
+
     def save(self, file_path: str, layout_only: bool = False) -> None:
         """
         Save the presentation to a file.
@@ -366,6 +399,33 @@ class Presentation:
                 self.clear_text(pptx_slide.shapes)
         self.prs.save(file_path)
 
+    def insert_slide(self, slide: SlidePage, index: int) -> PPTXSlide:
+        """
+        Build a slide and insert it at `index`, keeping the already built slides.
+        """
+        pptx_slide = self.build_slide(slide)
+        sld_id_lst = self.prs.slides._sldIdLst
+        sld_id = sld_id_lst[-1]
+        sld_id_lst.remove(sld_id)
+        sld_id_lst.insert(index, sld_id)
+        self.slides.insert(index, slide)
+        return pptx_slide
+
+    def save_built(self, file_path: str) -> None:
+        """
+        Atomically save the slides built so far, readers never see a partially written file.
+        """
+        fd, temp_path = tempfile.mkstemp(
+            suffix=".pptx", dir=os.path.dirname(os.path.abspath(file_path))
+        )
+        os.close(fd)
+        try:
+            self.prs.save(temp_path)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
     def build_slide(self, slide: SlidePage) -> PPTXSlide:
         """
         Build a slide in the presentation.
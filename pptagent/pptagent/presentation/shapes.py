@@ -1,7 +1,7 @@
 import re
 from collections.abc import Callable
-from copy import deepcopy
-from dataclasses import dataclass, field
+from copy import copy, deepcopy
+from dataclasses import dataclass, field, replace
 from enum import Enum, auto
 from os.path import join
 from types import MappingProxyType
@@ -423,6 +423,15 @@ class TextFrame:
             font=font,
         )
 
+    def snapshot(self) -> "TextFrame":
+        """
+        Copy the text frame for editing, the paragraphs are copied while their fonts are shared.
+
+        Returns:
+            TextFrame: The snapshot of the text frame.
+        """
+        return replace(self, paragraphs=[copy(para) for para in self.paragraphs])
+
     def to_html(self, style_args: StyleArg) -> str:
         """
         Convert the text frame to HTML.
@@ -578,6 +587,25 @@ class ShapeElement:
             self.line.build(shape.line, shape.part)
         return shape
 
+    def snapshot(self) -> "ShapeElement":
+        """
+        Copy the shape element for editing while sharing its template parts.
+
+        The XML element, fill and line are never modified after parsing and are shared with the original,
+        edits are recorded in the copied style, data, paragraphs and closures, and only applied to a copy of the XML in `build`.
+
+        Returns:
+            ShapeElement: The snapshot of the shape element.
+        """
+        snapshot = copy(self)
+        snapshot.style = {
+            k: dict(v) if isinstance(v, dict) else v for k, v in self.style.items()
+        }
+        snapshot.data = list(self.data)
+        snapshot.text_frame = self.text_frame.snapshot()
+        snapshot._closures = {k: list(v) for k, v in self._closures.items()}
+        return snapshot
+
     def to_html(self, style_args: StyleArg) -> str:
         """
         Convert the shape element to HTML.
@@ -1045,6 +1073,17 @@ class GroupShape(ShapeElement):
             shape.build(slide)
         return slide
 
+    def snapshot(self) -> "GroupShape":
+        """
+        Copy the group shape for editing, taking a snapshot of each shape in the group.
+
+        Returns:
+            GroupShape: The snapshot of the group shape.
+        """
+        snapshot = super().snapshot()
+        snapshot.data = [shape.snapshot() for shape in self.data]
+        return snapshot
+
     def shape_filter(
         self, shape_type: type["ShapeElement"], return_father: bool = False
     ):
@@ -1,11 +1,12 @@
 from .induct import SlideSchema
 from .outline import Outline, OutlineItem
-from .pptgen import EditorOutput, LayoutChoice
+from .pptgen import EditorOutput, LayoutChoice, SlideElement
 
 __all__ = [
     "LogicHeadings",
     "EditorOutput",
     "LayoutChoice",
+    "SlideElement",
     "SlideSchema",
     "Outline",
     "OutlineItem",
@@ -1,23 +1,45 @@
 import asyncio
+import atexit
+import contextlib
+import contextvars
+import hashlib
 import io
 import json
 import logging
+import multiprocessing
 import os
+import posixpath
+import queue
+import random
+import re
 import shutil
+import socket
 import subprocess
+import sys
+import sysconfig
 import tempfile
-import traceback
+import threading
+import zipfile
+import zlib
+from collections.abc import Callable, Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.utils import parsedate_to_datetime
+from functools import partial
 from itertools import product
 from os.path import dirname, exists, join
 from pathlib import Path
 from shutil import which
-from time import sleep, time
-from typing import Any
+from time import perf_counter, sleep, time
+from typing import Any, Literal
 
 import json_repair
 import Levenshtein
+import numpy as np
+import openai
 from html2image import Html2Image
-from pdf2image import convert_from_path
+from lxml import etree
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image as PILImage
 from pptagent_pptx.dml.color import RGBColor
 from pptagent_pptx.oxml import parse_xml
@@ -26,7 +48,13 @@ from pptagent_pptx.shapes.group import GroupShape
 from pptagent_pptx.text.text import _Paragraph, _Run
 from pptagent_pptx.util import Length, Pt
 from pydantic import BaseModel
-from tenacity import RetryCallState, retry, stop_after_attempt, wait_fixed
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+)
+from tenacity.wait import wait_base
 
 
 class Language(BaseModel):
@@ -87,10 +115,22 @@ def get_logger(name="pptagent", level=None):
 
 logger = get_logger(__name__)
 
+unoserver_url = os.environ.get("UNOSERVER_URL", "127.0.0.1")
+unoserver_port = os.environ.get("UNOSERVER_PORT", "2003")
+OFFICE_POOL_SIZE = int(os.environ.get("PPTAGENT_OFFICE_WORKERS", 2))
+OFFICE_POOL_QUEUE = int(os.environ.get("PPTAGENT_OFFICE_QUEUE", 64))
+# executors running blocking work off the event loop:
+# threads for I/O and GIL-releasing work, processes for pure Python CPU work
+BLOCKING_WORKERS = int(
+    os.environ.get("PPTAGENT_BLOCKING_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+)
+CPU_WORKERS = int(os.environ.get("PPTAGENT_CPU_WORKERS", os.cpu_count() or 1))
+# report event loop blocks longer than this many seconds, 0 disables the monitor
+LOOP_LAG_THRESHOLD = float(os.environ.get("PPTAGENT_LOOP_LAG_THRESHOLD", 0))
+# seconds to render tables with html2image after Chromium failed to launch
+BROWSER_RETRY_INTERVAL = 60
 if which("unoconvert"):
     logger.info("using `unoconvert` for pptx to images conversion")
-    unoserver_url = os.environ.get("UNOSERVER_URL", "127.0.0.1")
-    unoserver_port = os.environ.get("UNOSERVER_PORT", "2003")
 elif which("soffice"):
     logger.info("using `soffice` for pptx to images conversion")
 else:
@@ -209,6 +249,125 @@ def edit_distance(text1: str, text2: str) -> float:
     return 1 - Levenshtein.distance(text1, text2) / max(len(text1), len(text2))
 
 
+def most_similar(text: str, candidates: Iterable[str]) -> str | None:
+    """
+    Find the candidate most similar to the text by `edit_distance`, the first one on ties.
+
+    Each Levenshtein computation is bounded by the best similarity found so far,
+    and candidates whose length difference alone rules them out are skipped.
+
+    Args:
+        text (str): The text to match.
+        candidates (Iterable[str]): The candidates.
+
+    Returns:
+        str | None: The most similar candidate, or None if there are no candidates.
+    """
+    best, best_distance, best_length = None, 1, 1
+    for candidate in candidates:
+        length = max(len(text), len(candidate))
+        if length == 0:
+            return candidate
+        if best is None:
+            distance = Levenshtein.distance(text, candidate)
+        else:
+            # a better candidate has distance / length < best_distance / best_length
+            cutoff = -(-best_distance * length // best_length) - 1
+            if cutoff < 0 or abs(len(text) - len(candidate)) > cutoff:
+                continue
+            distance = Levenshtein.distance(text, candidate, score_cutoff=cutoff)
+            if distance > cutoff:
+                continue
+        best, best_distance, best_length = candidate, distance, length
+        if distance == 0:
+            break
+    return best
+
+
+class FuzzyIndex:
+    """
+    An approximate-match index over a fixed list of strings, scored by `edit_distance`.
+
+    Exact matches are answered by a hash lookup. Otherwise the strings are ranked by the MinHash estimate of the Jaccard
+    similarity of their character n-grams, one vectorized comparison for all of them,
+    and only the `top_k` best candidates are scored with Levenshtein.
+    With at most `top_k` strings every string is scored, the same as a full scan.
+    """
+
+    def __init__(
+        self, items: list[str], ngram: int = 3, num_perm: int = 64, top_k: int = 8
+    ):
+        """
+        Initialize the FuzzyIndex.
+
+        Args:
+            items (list[str]): The strings to match against.
+            ngram (int): The length of the character n-grams.
+            num_perm (int): The number of hash permutations of the MinHash signatures.
+            top_k (int): The number of candidates scored with Levenshtein.
+        """
+        self.items = list(items)
+        self.ngram = ngram
+        self.top_k = top_k
+        self._exact: dict[str, int] = {}
+        for idx, item in enumerate(self.items):
+            self._exact.setdefault(item, idx)
+        self._signatures = None
+        if len(self.items) > top_k:
+            rng = np.random.default_rng(0)
+            # odd multipliers make (a * x + b) mod 2**64 a permutation of the hash values
+            self._a = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+            self._a = self._a * np.uint64(2) + np.uint64(1)
+            self._b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+            self._signatures = np.stack([self._signature(item) for item in self.items])
+
+    def _signature(self, text: str) -> np.ndarray:
+        n = self.ngram
+        grams = {text[i : i + n] for i in range(max(len(text) - n + 1, 1))}
+        # the built-in `hash` of strings is salted per process, candidates must not change between runs
+        hashes = np.fromiter(
+            (zlib.crc32(g.encode()) for g in grams), np.uint64, len(grams)
+        )
+        with np.errstate(over="ignore"):
+            permuted = hashes[:, None] * self._a + self._b
+        return permuted.min(axis=0)
+
+    def search(self, query: str, top_k: int | None = None) -> list[tuple[int, float]]:
+        """
+        Find the items most similar to the query.
+
+        Args:
+            query (str): The string to match.
+            top_k (int | None): The number of candidates scored with Levenshtein, defaults to the index's `top_k`.
+
+        Returns:
+            list[tuple[int, float]]: (item index, `edit_distance`) of the candidates, most similar first, earlier items first on ties.
+        """
+        if query in self._exact:
+            return [(self._exact[query], 1.0)]
+        top_k = top_k or self.top_k
+        if self._signatures is None or len(self.items) <= top_k:
+            candidates = range(len(self.items))
+        else:
+            estimates = (self._signatures == self._signature(query)).mean(axis=1)
+            candidates = np.argsort(-estimates, kind="stable")[:top_k].tolist()
+        scored = [(idx, edit_distance(self.items[idx], query)) for idx in candidates]
+        return sorted(scored, key=lambda x: (-x[1], x[0]))
+
+    def best(self, query: str) -> tuple[int, float] | None:
+        """
+        Find the item most similar to the query.
+
+        Returns:
+            tuple[int, float] | None: (item index, `edit_distance`) of the best match, or None if the index is empty.
+        """
+        matches = self.search(query)
+        return matches[0] if matches else None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
 def tenacity_log(retry_state: RetryCallState) -> None:
     """
     Log function for tenacity retries.
@@ -216,8 +375,16 @@ def tenacity_log(retry_state: RetryCallState) -> None:
     Args:
         retry_state (RetryCallState): The retry state.
     """
-    logger.warning("tenacity retry: %s", retry_state)
-    traceback.print_tb(retry_state.outcome.exception().__traceback__)
+    exception = retry_state.outcome.exception()
+    logger.warning(
+        "Retrying %s in %.1fs (attempt %d): %s: %s",
+        getattr(retry_state.fn, "__qualname__", retry_state.fn),
+        retry_state.upcoming_sleep,
+        retry_state.attempt_number,
+        type(exception).__name__,
+        str(exception)[:200],
+    )
+    logger.debug("Retried exception", exc_info=exception)
 
 
 def get_json_from_response(response: str) -> dict[str, Any]:
@@ -231,7 +398,7 @@ def get_json_from_response(response: str) -> dict[str, Any]:
         Dict[str, Any]: The extracted JSON.
 
     Raises:
-        Exception: If JSON cannot be extracted from the response.
+        json.JSONDecodeError: If JSON cannot be extracted from the response.
     """
     response = response.strip()
 
@@ -267,13 +434,197 @@ def get_json_from_response(response: str) -> dict[str, Any]:
         except Exception:
             pass
 
-    raise Exception("JSON not found in the given output", response)
+    raise json.JSONDecodeError("JSON not found in the given output", response, 0)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit of {name} is open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker shared by all callers of an endpoint.
+    It opens after `failure_threshold` consecutive transient failures and rejects calls until `reset_timeout`
+    (or a longer server-provided Retry-After) has passed, then lets a single probe through to decide whether to close again.
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, reset_timeout: float = 30
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_until = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_until is None:
+            return "closed"
+        if self.probing or time() >= self.opened_until:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """
+        Raises:
+            CircuitOpenError: If the circuit is open or another caller is probing it.
+        """
+        with self._lock:
+            if self.opened_until is None:
+                return
+            remaining = self.opened_until - time()
+            if remaining > 0:
+                raise CircuitOpenError(self.name, remaining)
+            if self.probing:
+                raise CircuitOpenError(self.name, self.reset_timeout / 10)
+            self.probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_until = None
+            self.probing = False
+
+    def record_failure(self, retry_after: float | None = None):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_until is None:
+                    logger.warning("Circuit of %s opened", self.name)
+                self.opened_until = time() + max(self.reset_timeout, retry_after or 0)
+                self.probing = False
+
+    def record_cancel(self):
+        with self._lock:
+            self.probing = False
+
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """
+    Classify an exception as retryable (transient, or a fresh sample may succeed) or fatal.
+
+    Only endpoint failures, network errors and unparsable model outputs are retried,
+    everything else (missing binaries or files, failed assertions, bad arguments) is fatal.
+    """
+    if isinstance(exception, CircuitOpenError):
+        return True
+    if isinstance(exception, openai.APIStatusError):
+        return exception.status_code in RETRYABLE_STATUS or exception.status_code >= 500
+    if isinstance(exception, openai.APIConnectionError):
+        return True
+    if isinstance(exception, (ConnectionError, TimeoutError, socket.gaierror)):
+        return True
+    return isinstance(exception, json.JSONDecodeError)
+
+
+def is_transient(exception: BaseException) -> bool:
+    """
+    Whether an exception signals an overloaded or unreachable endpoint.
+    """
+    return not isinstance(exception, CircuitOpenError) and (
+        isinstance(exception, openai.APIConnectionError)
+        or (isinstance(exception, openai.APIStatusError) and is_retryable(exception))
+    )
+
+
+def _parse_duration(value: str) -> float | None:
+    """
+    Parse durations such as "20ms", "1.5s" or "6m0s" used by rate-limit headers.
+    """
+    match = re.fullmatch(
+        r"(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m(?!s))?(?:(\d+(?:\.\d+)?)s)?(?:(\d+(?:\.\d+)?)ms)?",
+        value,
+    )
+    if match is None or not any(match.groups()):
+        return None
+    hours, minutes, seconds, millis = (float(g) if g else 0 for g in match.groups())
+    return hours * 3600 + minutes * 60 + seconds + millis / 1000
+
+
+def retry_after(exception: BaseException) -> float | None:
+    """
+    Get the delay the server asked for through Retry-After or rate-limit reset headers.
+    """
+    if isinstance(exception, CircuitOpenError):
+        return exception.retry_after
+    response = getattr(exception, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if value := headers.get("retry-after-ms"):
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if value := headers.get("retry-after"):
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0, parsedate_to_datetime(value).timestamp() - time())
+            except (TypeError, ValueError):
+                pass
+    resets = [
+        _parse_duration(headers[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if headers.get(name)
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class wait_backoff(wait_base):
+    """
+    Exponential backoff with jitter that honours server-provided retry delays.
+    The jitter keeps concurrent callers that failed together from retrying in lockstep.
+    """
+
+    def __init__(self, base: float = 1, max_wait: float = 60):
+        self.base = base
+        self.max_wait = max_wait
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        backoff = min(self.max_wait, self.base * 2 ** (retry_state.attempt_number - 1))
+        backoff = random.uniform(backoff / 2, backoff)
+        delay = retry_after(retry_state.outcome.exception())
+        if delay is not None:
+            backoff = max(backoff, min(self.max_wait, delay) + random.uniform(0, 1))
+        return backoff
 
 
 # Create a tenacity decorator with custom settings
-def tenacity_decorator(_func=None, *, wait: int = 3, stop: int = 5):
+def tenacity_decorator(
+    _func=None, *, wait: float = 1, stop: int = 5, max_wait: float = 60
+):
+    """
+    Retry a function on retryable errors with jittered exponential backoff, fatal errors are raised at once.
+
+    Args:
+        wait (float): The base delay in seconds, doubled on every attempt.
+        stop (int): The maximum number of attempts.
+        max_wait (float): The maximum delay in seconds between attempts.
+    """
+
     def decorator(func):
-        return retry(wait=wait_fixed(wait), stop=stop_after_attempt(stop))(func)
+        return retry(
+            wait=wait_backoff(wait, max_wait),
+            stop=stop_after_attempt(stop),
+            retry=retry_if_exception(is_retryable),
+            before_sleep=tenacity_log,
+            reraise=True,
+        )(func)
 
     if _func is None:
         # Called with arguments
@@ -301,43 +652,54 @@ th {
 """
 
 
-def manual_scan_crop(img_path: str):
-    """Manually detect and crop image boundaries by scanning pixels."""
+TABLE_VIEWPORT = (1000, 600)
+MAX_TABLE_VIEWPORT = (4000, 4000)
+
+
+def content_bbox(img: PILImage.Image, threshold: int = 248):
+    """
+    Get the bounding box (left, top, right, bottom) of the non-white content of an image.
+
+    Args:
+        img (PIL.Image.Image): The image.
+        threshold (int): Pixels with any channel below this value count as content.
+
+    Returns:
+        tuple[int, int, int, int] | None: The inclusive bounding box, or None for a blank image.
+    """
+    # a relaxed threshold accounts for anti-aliasing
+    mask = (np.asarray(img.convert("RGB")) < threshold).any(axis=2)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])
+
+
+def manual_scan_crop(img_path: str, padding: int = 20):
+    """Detect the content boundaries of an image and crop it in place."""
     img = PILImage.open(img_path).convert("RGB")
     width, height = img.size
-    pixels = img.load()
-    left, top, right, bottom = width, height, 0, 0
-    found_content = False
-
-    # Scan all pixels to find non-white areas
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            # Detect non-white pixels (using a relaxed threshold to account for anti-aliasing)
-            if r < 248 or g < 248 or b < 248:
-                left = min(left, x)
-                right = max(right, x)
-                top = min(top, y)
-                bottom = max(bottom, y)
-                found_content = True
-
-    if found_content:
-        padding = 20
-        bbox = (
+    bbox = content_bbox(img)
+    if bbox is None:
+        return
+    left, top, right, bottom = bbox
+    img.crop(
+        (
             max(0, left - padding),
             max(0, top - padding),
             min(width, right + 1 + padding),
             min(height, bottom + 1 + padding),
         )
-
-        cropped_img = img.crop(bbox)
-        cropped_img.save(img_path)
+    ).save(img_path)
 
 
 def get_html_table_image(html: str, output_path: str, css: str = None):
     """
     Convert a html table to the image
 
+    The capture viewport starts at `TABLE_VIEWPORT` and grows up to `MAX_TABLE_VIEWPORT` until the table is not clipped.
+
     Args:
     html (str): html text containing a table
     output_path (str): Output image path, defaults to 'table_cropped.png'
@@ -358,96 +720,904 @@ def get_html_table_image(html: str, output_path: str, css: str = None):
         custom_flags=["--no-sandbox", "--headless", "--disable-gpu"],
     )
     hti.browser.use_new_headless = None
-    hti.screenshot(
-        html_str=html,
-        css_str=css,
-        save_as=base_name,
-        size=(1000, 600),
-    )
+    width, height = TABLE_VIEWPORT
+    while True:
+        hti.screenshot(
+            html_str=html,
+            css_str=css,
+            save_as=base_name,
+            size=(width, height),
+        )
+        with PILImage.open(output_path) as img:
+            bbox = content_bbox(img)
+        if bbox is None:
+            break
+        clipped_x = bbox[2] >= width - 1 and width < MAX_TABLE_VIEWPORT[0]
+        clipped_y = bbox[3] >= height - 1 and height < MAX_TABLE_VIEWPORT[1]
+        if not (clipped_x or clipped_y):
+            break
+        if clipped_x:
+            width = min(width * 2, MAX_TABLE_VIEWPORT[0])
+        if clipped_y:
+            height = min(height * 2, MAX_TABLE_VIEWPORT[1])
     manual_scan_crop(output_path)
 
 
-async def _is_unoserver_running(host: str, port: int) -> bool:
-    try:
-        _, writer = await asyncio.wait_for(
-            asyncio.open_connection(host, port), timeout=10.0
+class TableRenderer:
+    """
+    Render html tables with one shared headless Chromium (Playwright).
+
+    Each table is laid out in its own page and captured as an element screenshot clipped to the table
+    (plus padding), so no cropping pass is needed.
+    Falls back to `get_html_table_image` when Playwright or its browser is not available.
+    """
+
+    # (playwright, browser) per event loop, as they are bound to the loop they were launched in
+    _instances: dict[asyncio.AbstractEventLoop, tuple[Any, Any]] = {}
+    _launch_locks: dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+    _shutdown_hooks: dict[asyncio.AbstractEventLoop, Any] = {}
+    _available: bool | None = None
+    _retry_at = 0.0
+
+    @classmethod
+    async def _get_browser(cls):
+        if cls._available is False or perf_counter() < cls._retry_at:
+            return None
+        loop = asyncio.get_running_loop()
+        for closed_loop in [other for other in cls._launch_locks if other.is_closed()]:
+            # closed without shutting down its async generators, nothing is left to await the browser
+            logger.warning("Table renderer of a closed event loop was not closed")
+            cls._instances.pop(closed_loop, None)
+            cls._launch_locks.pop(closed_loop, None)
+            cls._shutdown_hooks.pop(closed_loop, None)
+        lock = cls._launch_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            if loop not in cls._instances:
+                try:
+                    from playwright.async_api import async_playwright
+                except ImportError as e:
+                    logger.warning(
+                        "Playwright is not available, falling back to html2image: %s",
+                        e,
+                    )
+                    cls._available = False
+                    return None
+                playwright = None
+                try:
+                    playwright = await async_playwright().start()
+                    browser = await playwright.chromium.launch(
+                        headless=True,
+                        args=[
+                            "--no-sandbox",
+                            "--disable-gpu",
+                            "--disable-dev-shm-usage",
+                        ],
+                    )
+                except Exception as e:
+                    logger.warning(
+                        "Failed to launch Chromium, falling back to html2image for %ds: %s",
+                        BROWSER_RETRY_INTERVAL,
+                        e,
+                    )
+                    cls._retry_at = perf_counter() + BROWSER_RETRY_INTERVAL
+                    if playwright is not None:
+                        with contextlib.suppress(Exception):
+                            await playwright.stop()
+                    return None
+                cls._instances[loop] = (playwright, browser)
+                cls._available = True
+                # closes the browser when the loop shuts down its async generators, as `asyncio.run` does
+                hook = cls._shutdown_hook(browser)
+                await hook.asend(None)
+                cls._shutdown_hooks[loop] = hook
+        return cls._instances[loop][1]
+
+    @classmethod
+    async def _shutdown_hook(cls, browser):
+        try:
+            yield
+        finally:
+            # unless closed already, the hook is also finalized after an explicit `close`
+            instance = cls._instances.get(asyncio.get_running_loop())
+            if instance is not None and instance[1] is browser:
+                await cls.close()
+
+    @classmethod
+    async def render(
+        cls, html: str, output_path: str, css: str | None = None, padding: int = 20
+    ) -> str:
+        """
+        Render a html table to an image.
+
+        Args:
+            html (str): html text containing a table.
+            output_path (str): The output image path.
+            css (str | None): Custom css for the table, defaults to `TABLE_CSS`.
+            padding (int): The white padding around the table in pixels.
+
+        Returns:
+            str: The path of the generated image.
+        """
+        if css is None:
+            css = TABLE_CSS
+        parent_dir = os.path.dirname(output_path)
+        if parent_dir:
+            os.makedirs(parent_dir, exist_ok=True)
+        browser = await cls._get_browser()
+        if browser is None:
+            await run_in_thread(get_html_table_image, html, output_path, css)
+            return output_path
+
+        page = await browser.new_page(
+            viewport={"width": TABLE_VIEWPORT[0], "height": TABLE_VIEWPORT[1]}
         )
-        writer.close()
-        await writer.wait_closed()
-        return True
-    except:
+        try:
+            await page.set_content(
+                f"<html><head><style>body {{ margin: 0; background: white; }}\n{css}</style></head>"
+                f'<body><div id="pptagent-table" style="display: inline-block; padding: {padding}px; background: white;">'
+                f"{html}</div></body></html>"
+            )
+            await page.locator("#pptagent-table").screenshot(path=output_path)
+        finally:
+            await page.close()
+        return output_path
+
+    @classmethod
+    async def render_many(
+        cls,
+        tables: list[tuple[str, str]],
+        css: str | None = None,
+        max_at_once: int | None = 8,
+    ) -> list[str]:
+        """
+        Render html tables concurrently in the shared browser.
+
+        Args:
+            tables (list[tuple[str, str]]): (html, output_path) pairs.
+            css (str | None): Custom css for the tables.
+            max_at_once (int | None): The maximum number of pages rendering at once.
+
+        Returns:
+            list[str]: The paths of the generated images.
+        """
+        limiter = (
+            asyncio.Semaphore(max_at_once)
+            if max_at_once is not None
+            else contextlib.nullcontext()
+        )
+
+        async def render_one(html: str, output_path: str):
+            async with limiter:
+                return await cls.render(html, output_path, css)
+
+        return await asyncio.gather(
+            *[render_one(html, output_path) for html, output_path in tables]
+        )
+
+    @classmethod
+    async def close(cls):
+        """
+        Close the browser of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        instance = cls._instances.pop(loop, None)
+        cls._launch_locks.pop(loop, None)
+        cls._shutdown_hooks.pop(loop, None)
+        if instance is not None:
+            playwright, browser = instance
+            try:
+                await browser.close()
+            finally:
+                await playwright.stop()
+
+
+def _is_port_open(host: str, port: int, timeout: float = 1.0) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
         return False
 
 
-async def ppt_to_images(file: str, output_dir: str, dpi: int = 100):
-    assert exists(file), f"File {file} does not exist"
-    if exists(output_dir) and len(os.listdir(output_dir)) > 0:
-        logger.debug(f"ppt2images: {output_dir} already exists")
-        return
-    os.makedirs(output_dir, exist_ok=True)
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
 
-    with (
-        tempfile.TemporaryDirectory() as out_dir,
-        tempfile.TemporaryDirectory() as profile_dir,
-    ):
-        unoconvert_path = which("unoconvert")
-        soffice_path = which("soffice")
-        pdf_path = None
-        if unoconvert_path is not None and await _is_unoserver_running(
-            unoserver_url, int(unoserver_port)
+
+class OfficeWorker:
+    """
+    A warm LibreOffice instance owned by an `OfficePool`.
+
+    Modes:
+        unoserver: keeps a long-lived `unoserver` process and converts through `unoconvert`.
+        soffice: keeps a persistent user profile, so every `soffice --convert-to` call starts warm.
+        external: forwards conversions to the unoserver at `UNOSERVER_URL:UNOSERVER_PORT`.
+    """
+
+    def __init__(self, mode: str, startup_timeout: float = 60):
+        self.mode = mode
+        self.startup_timeout = startup_timeout
+        self.host = unoserver_url
+        self.port = int(unoserver_port)
+        self.process: subprocess.Popen | None = None
+        self.profile_dir = tempfile.mkdtemp(prefix="pptagent-office-")
+        self.restarts = 0
+
+    def is_healthy(self) -> bool:
+        if self.mode == "soffice":
+            return True
+        if self.mode == "unoserver" and (
+            self.process is None or self.process.poll() is not None
         ):
-            converter = "unoconvert"
-            pdf_output = os.path.join(out_dir, os.path.basename(file)) + ".pdf"
-            pdf_path = pdf_output
-            command_list = [
-                unoconvert_path,
-                "--host",
-                unoserver_url,
+            return False
+        return _is_port_open(self.host, self.port)
+
+    def ensure_healthy(self):
+        if self.is_healthy():
+            return
+        if self.mode == "external":
+            raise RuntimeError(f"unoserver is not running at {self.host}:{self.port}")
+        if self.process is not None:
+            self.restarts += 1
+            logger.warning("office worker on port %d is down, restarting", self.port)
+        self.start()
+
+    def start(self):
+        self.stop()
+        self.host, self.port = "127.0.0.1", _free_port()
+        self.process = subprocess.Popen(
+            [
+                which("unoserver"),
+                "--interface",
+                self.host,
                 "--port",
-                unoserver_port,
-                file,
-                pdf_output,
-            ]
-        elif soffice_path is not None:
-            converter = "soffice"
-            profile_dir_uri = Path(profile_dir).as_uri()
+                str(self.port),
+                "--uno-port",
+                str(_free_port()),
+                "--user-installation",
+                Path(self.profile_dir).as_uri(),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time() + self.startup_timeout
+        while not _is_port_open(self.host, self.port):
+            if self.process.poll() is not None or time() > deadline:
+                self.stop()
+                raise RuntimeError(f"unoserver failed to start on port {self.port}")
+            sleep(0.5)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def convert(self, file: str, output_dir: str, convert_to: str, timeout: float):
+        stem = os.path.splitext(os.path.basename(file))[0]
+        output_path = join(output_dir, f"{stem}.{convert_to}")
+        if self.mode == "soffice":
             command_list = [
-                soffice_path,
-                f"-env:UserInstallation={profile_dir_uri}",
+                which("soffice"),
+                f"-env:UserInstallation={Path(self.profile_dir).as_uri()}",
                 "--headless",
                 "--convert-to",
-                "pdf",
+                convert_to,
                 file,
                 "--outdir",
-                out_dir,
+                output_dir,
             ]
         else:
-            raise RuntimeError("Neither unoconvert nor soffice is installed")
+            command_list = [
+                which("unoconvert"),
+                "--host",
+                self.host,
+                "--port",
+                str(self.port),
+                "--convert-to",
+                convert_to,
+                file,
+                output_path,
+            ]
+        result = subprocess.run(command_list, capture_output=True, timeout=timeout)
+        if result.returncode != 0 or not exists(output_path):
+            raise RuntimeError(
+                f"{self.mode} failed to convert {file} to {convert_to}\n"
+                f"Output: {result.stdout.decode(errors='ignore')}\n"
+                f"Error: {result.stderr.decode(errors='ignore')}"
+            )
+        return output_path
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class OfficePool:
+    """
+    A pool of warm LibreOffice workers shared by all office conversions in the process.
+
+    Workers are started lazily, health-checked before each conversion and restarted after a crash or timeout.
+    At most `size` conversions run at once and up to `max_pending` callers may queue for a worker,
+    further callers block until the queue drains.
+    """
+
+    def __init__(
+        self,
+        size: int = OFFICE_POOL_SIZE,
+        max_pending: int = OFFICE_POOL_QUEUE,
+        conversion_timeout: float = 300,
+        startup_timeout: float = 60,
+    ):
+        assert size > 0, "office pool size must be positive"
+        self.size = size
+        self.max_pending = max_pending
+        self.conversion_timeout = conversion_timeout
+        self.startup_timeout = startup_timeout
+        self._mode = None
+        self._workers: list[OfficeWorker] = []
+        self._idle: queue.LifoQueue[OfficeWorker] = queue.LifoQueue()
+        self._admission = threading.BoundedSemaphore(size + max_pending)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    @property
+    def mode(self) -> str:
+        if self._mode is None:
+            if which("unoconvert") and _is_port_open(
+                unoserver_url, int(unoserver_port)
+            ):
+                self._mode = "external"
+            elif which("unoconvert") and which("unoserver"):
+                self._mode = "unoserver"
+            elif which("soffice"):
+                self._mode = "soffice"
+            else:
+                raise RuntimeError("Neither unoconvert nor soffice is installed")
+            logger.debug("office pool uses %s workers", self._mode)
+        return self._mode
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of conversions waiting for a free worker."""
+        return self._waiting
+
+    @property
+    def restarts(self) -> int:
+        return sum(worker.restarts for worker in self._workers)
+
+    def _acquire(self) -> OfficeWorker:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._workers) < self.size:
+                worker = OfficeWorker(self.mode, self.startup_timeout)
+                self._workers.append(worker)
+                return worker
+            self._waiting += 1
+        try:
+            return self._idle.get()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _ensure_healthy(self, worker: OfficeWorker):
+        try:
+            worker.ensure_healthy()
+        except (RuntimeError, OSError) as e:
+            # e.g. the external unoserver went away, probe again for another mode
+            self._mode = None
+            if self.mode == worker.mode:
+                raise
+            logger.warning(
+                "office worker failed to start in %s mode, switching to %s: %s",
+                worker.mode,
+                self.mode,
+                e,
+            )
+            worker.stop()
+            worker.mode = self.mode
+            worker.ensure_healthy()
+
+    def _restart_hung(self, worker: OfficeWorker):
+        """Restart a worker after a conversion timed out, the unoserver may still be stuck on it."""
+        if worker.mode != "unoserver":
+            return
+        worker.restarts += 1
+        try:
+            worker.start()
+        except Exception as e:
+            # the next conversion restarts the worker again
+            logger.warning("Failed to restart office worker after a timeout: %s", e)
+
+    def convert(self, file: str, output_dir: str, convert_to: str = "pdf") -> str:
+        """
+        Convert a document with a warm office worker.
+
+        Args:
+            file (str): The file to convert.
+            output_dir (str): The directory to write the converted file to.
+            convert_to (str): The target format, e.g. pdf or png.
+
+        Returns:
+            str: The path of the converted file.
+        """
+        file = os.path.abspath(file)
+        output_dir = os.path.abspath(output_dir)
+        with self._admission:
+            worker = self._acquire()
+            try:
+                for attempt in range(2):
+                    self._ensure_healthy(worker)
+                    try:
+                        return worker.convert(
+                            file, output_dir, convert_to, self.conversion_timeout
+                        )
+                    except subprocess.TimeoutExpired as e:
+                        self._restart_hung(worker)
+                        raise RuntimeError(
+                            f"office conversion timed out after {self.conversion_timeout}s: {file}"
+                        ) from e
+                    except RuntimeError:
+                        # a crashed worker is restarted and the conversion retried once
+                        if attempt == 1 or worker.is_healthy():
+                            raise
+            finally:
+                self._idle.put(worker)
+
+    async def aconvert(
+        self, file: str, output_dir: str, convert_to: str = "pdf"
+    ) -> str:
+        """Asynchronous version of `convert`, running in a worker thread."""
+        return await run_in_thread(self.convert, file, output_dir, convert_to)
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.close()
+            self._workers.clear()
+            self._idle = queue.LifoQueue()
+
+
+_OFFICE_POOL: OfficePool | None = None
+_OFFICE_POOL_LOCK = threading.Lock()
+
+
+def get_office_pool() -> OfficePool:
+    """
+    Get the process-wide office worker pool, configured by `PPTAGENT_OFFICE_WORKERS` and `PPTAGENT_OFFICE_QUEUE`.
+    """
+    global _OFFICE_POOL
+    with _OFFICE_POOL_LOCK:
+        if _OFFICE_POOL is None:
+            _OFFICE_POOL = OfficePool()
+            atexit.register(_OFFICE_POOL.close)
+    return _OFFICE_POOL
+
+
+_EXECUTORS: dict[str, Executor] = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def get_executor(kind: Literal["thread", "process"] = "thread") -> Executor:
+    """
+    Get the process-wide executor for blocking work, sized by `PPTAGENT_BLOCKING_WORKERS` and `PPTAGENT_CPU_WORKERS`.
+    """
+    with _EXECUTORS_LOCK:
+        if kind not in _EXECUTORS:
+            if not _EXECUTORS:
+                atexit.register(shutdown_executors)
+            if kind == "thread":
+                _EXECUTORS[kind] = ThreadPoolExecutor(
+                    BLOCKING_WORKERS, thread_name_prefix="pptagent-blocking"
+                )
+            elif kind == "process":
+                # spawn, as forking a process running threads may deadlock the children
+                _EXECUTORS[kind] = ProcessPoolExecutor(
+                    CPU_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                raise ValueError(f"Unknown executor kind: {kind}")
+        return _EXECUTORS[kind]
+
+
+def shutdown_executors(wait: bool = False):
+    with _EXECUTORS_LOCK:
+        for executor in _EXECUTORS.values():
+            executor.shutdown(wait=wait, cancel_futures=True)
+        _EXECUTORS.clear()
+
+
+async def run_in_thread(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function in the shared thread executor, keeping the context variables like `asyncio.to_thread`.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor("thread"), partial(context.run, func, *args, **kwargs)
+    )
+
+
+async def run_in_process(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a CPU-bound function in the shared process executor, the function and its arguments must be picklable.
+    Falls back to a thread if the process pool is broken, e.g. a worker was killed.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            get_executor("process"), partial(func, *args, **kwargs)
+        )
+    except BrokenProcessPool:
+        logger.warning("Process pool is broken, restarting it and running in a thread")
+        with _EXECUTORS_LOCK:
+            _EXECUTORS.pop("process", None)
+        return await run_in_thread(func, *args, **kwargs)
+
+
+_LIBRARY_PATHS = tuple(
+    {sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"]}
+)
+
+
+class LoopLagMonitor:
+    """
+    Detect the event loop being blocked and the callsites blocking it.
+
+    A heartbeat coroutine ticks every `interval` seconds, and a watchdog thread samples the stack of the loop's thread
+    whenever the heartbeat is late by more than `threshold` seconds. Each late sample charges `interval` seconds to the
+    innermost frame outside the standard library and site-packages, i.e. the code that made the blocking call.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float | None = None):
+        """
+        Initialize the LoopLagMonitor.
+
+        Args:
+            threshold (float): Seconds the loop may be blocked before it is reported.
+            interval (float | None): Seconds between heartbeats and samples, defaults to half the threshold.
+        """
+        self.threshold = threshold
+        self.interval = interval or threshold / 2
+        self.callsites: dict[str, dict[str, float]] = {}
+        self.blocks = 0
+        self.max_lag = 0.0
+        self._beat = perf_counter()
+        self._thread_id: int | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> "LoopLagMonitor":
+        """
+        Start monitoring the running event loop.
+        """
+        self._thread_id = threading.get_ident()
+        self._beat = perf_counter()
+        self._stopped.clear()
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._heartbeat())
+        # the heartbeat is cancelled when the loop shuts down, e.g. at the end of `asyncio.run`
+        self._task.add_done_callback(lambda _: self.stop())
+        threading.Thread(
+            target=self._watch, name="pptagent-loop-monitor", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                now = perf_counter()
+                self.max_lag = max(self.max_lag, now - self._beat - self.interval)
+                self._beat = now
+        finally:
+            # the loop is closing or the monitor was stopped
+            self._stopped.set()
+
+    def _callsite(self, frame) -> str:
+        innermost = frame
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if not filename.startswith(_LIBRARY_PATHS) and filename != __file__:
+                break
+            frame = frame.f_back
+        frame = frame or innermost
+        if frame is None:
+            return "<unknown>"
+        return f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+    def _watch(self):
+        blocked_beat, blocked_site = None, None
+        # a loop closed without cancelling its tasks never ends the heartbeat
+        while not self._stopped.wait(self.interval) and not self._loop.is_closed():
+            beat = self._beat
+            if perf_counter() - beat > self.threshold + self.interval:
+                frame = sys._current_frames().get(self._thread_id)
+                site = self._callsite(frame)
+                stats = self.callsites.setdefault(site, {"samples": 0, "blocked": 0.0})
+                stats["samples"] += 1
+                stats["blocked"] += self.interval
+                if blocked_beat != beat:
+                    self.blocks += 1
+                    blocked_beat, blocked_site = beat, site
+            elif blocked_beat is not None and beat != blocked_beat:
+                logger.warning(
+                    "Event loop blocked for %.2fs at %s",
+                    beat - blocked_beat - self.interval,
+                    blocked_site,
+                )
+                blocked_beat, blocked_site = None, None
+
+    def report(self, top: int = 10) -> list[dict[str, Any]]:
+        """
+        Get the callsites that blocked the event loop longest.
+
+        Returns:
+            list[dict[str, Any]]: The callsites with their number of samples and seconds blocked, longest first.
+        """
+        return [
+            {"callsite": site, **stats}
+            for site, stats in sorted(
+                self.callsites.items(), key=lambda x: x[1]["blocked"], reverse=True
+            )[:top]
+        ]
+
+    def log_report(self, top: int = 10):
+        if not self.callsites:
+            return
+        logger.info(
+            "Event loop blocked %d times, max lag %.2fs, longest callsites:\n%s",
+            self.blocks,
+            self.max_lag,
+            "\n".join(
+                f"  {r['blocked']:.2f}s {r['callsite']}" for r in self.report(top)
+            ),
+        )
+
+    async def __aenter__(self) -> "LoopLagMonitor":
+        return self.start()
+
+    async def __aexit__(self, *exc_info):
+        self.stop()
+
+
+_LOOP_MONITORS: dict[asyncio.AbstractEventLoop, LoopLagMonitor] = {}
+
+
+def monitor_event_loop(
+    threshold: float = LOOP_LAG_THRESHOLD,
+) -> LoopLagMonitor | None:
+    """
+    Start a lag monitor for the running event loop, once per loop, if `PPTAGENT_LOOP_LAG_THRESHOLD` is set.
+
+    Returns:
+        LoopLagMonitor | None: The monitor of the running loop, or None if monitoring is disabled.
+    """
+    if threshold <= 0:
+        return None
+    loop = asyncio.get_running_loop()
+    for closed_loop in [other for other in _LOOP_MONITORS if other.is_closed()]:
+        _LOOP_MONITORS.pop(closed_loop).stop()
+    monitor = _LOOP_MONITORS.get(loop)
+    if monitor is None:
+        monitor = _LOOP_MONITORS[loop] = LoopLagMonitor(threshold).start()
+        # forget the monitor once its loop shuts down
+        monitor._task.add_done_callback(lambda _: _LOOP_MONITORS.pop(loop, None))
+    return monitor
+
+
+_RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_PML_NS = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+# relationships that do not affect how a slide is rendered
+_SKIPPED_RELS = ("/notesSlide", "/slide")
+PPT2IMAGES_MANIFEST = ".ppt2images.json"
+
+
+def _part_rels(package: zipfile.ZipFile, part: str) -> list[tuple[str, str, str]]:
+    """Get (id, type, target part) of the internal relationships of a package part."""
+    part_dir, part_name = posixpath.split(part)
+    rels_path = posixpath.join(part_dir, "_rels", part_name + ".rels")
+    if rels_path not in package.NameToInfo:
+        return []
+    rels = []
+    for rel in etree.fromstring(package.read(rels_path)):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(part_dir, target))
+        rels.append((rel.get("Id"), rel.get("Type"), target))
+    return rels
+
 
-        process = await asyncio.create_subprocess_exec(
-            *command_list,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+def slide_fingerprints(file: str) -> list[str]:
+    """
+    Fingerprint every rendered (non-hidden) slide of a pptx file.
+
+    A fingerprint covers the slide XML and every part it depends on (layout, master, theme, media),
+    so it changes whenever the rendered slide may change.
+
+    Args:
+        file (str): The path to the pptx file.
+
+    Returns:
+        list[str]: The fingerprints in page order, hidden slides are skipped like in the exported PDF.
+    """
+    part_digests = {}
+    fingerprints = []
+    with zipfile.ZipFile(file) as package:
+        prs_part = next(
+            target
+            for _, rel_type, target in _part_rels(package, "")
+            if rel_type.endswith("/officeDocument")
         )
-        stdout, stderr = await process.communicate()
-        returncode = process.returncode
-        if returncode != 0:
-            raise RuntimeError(f"{converter} failed with error: {stderr.decode()}")
-
-        if pdf_path is None:
-            pdf_files = [f for f in os.listdir(out_dir) if f.endswith(".pdf")]
-            if len(pdf_files) != 1:
-                raise RuntimeError(
-                    f"Expected 1 PDF file in the temporary directory, got "
-                    f"{len(pdf_files)}: {file}\n"
-                    f"Output: {stdout.decode()}\n"
-                    f"Error: {stderr.decode()}"
+        presentation = etree.fromstring(package.read(prs_part))
+        slide_parts = {
+            rel_id: target for rel_id, _, target in _part_rels(package, prs_part)
+        }
+        slide_size = presentation.find(f"{_PML_NS}sldSz")
+        deck_digest = b"" if slide_size is None else etree.tostring(slide_size)
+
+        for sld_id in presentation.iter(f"{_PML_NS}sldId"):
+            slide_part = slide_parts[sld_id.get(_REL_ID)]
+            slide = etree.fromstring(package.read(slide_part))
+            if slide.get("show") in ("0", "false"):
+                continue
+            # collect the slide and the parts it depends on
+            visited, stack = set(), [slide_part]
+            while stack:
+                part = stack.pop()
+                if part in visited or part not in package.NameToInfo:
+                    continue
+                visited.add(part)
+                stack.extend(
+                    target
+                    for _, rel_type, target in _part_rels(package, part)
+                    if not rel_type.endswith(_SKIPPED_RELS)
                 )
-            pdf_path = join(out_dir, pdf_files[0])
+            digest = hashlib.sha256(deck_digest)
+            for part in sorted(visited):
+                if part not in part_digests:
+                    part_digests[part] = hashlib.sha256(package.read(part)).digest()
+                digest.update(part.encode() + part_digests[part])
+            fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+
+async def ppt_to_images(
+    file: str,
+    output_dir: str,
+    dpi: int = 100,
+    slides: Iterable[int] | None = None,
+):
+    """
+    Render the slides of a presentation to `slide_0001.jpg`, `slide_0002.jpg`, ... in `output_dir`.
 
-        images = convert_from_path(pdf_path, dpi=dpi)
-        for i, img in enumerate(images):
-            img.save(join(output_dir, f"slide_{i + 1:04d}.jpg"))
+    Rendering is incremental: the fingerprint of each slide is kept in a manifest in `output_dir`,
+    and only slides that are new or have changed since the last run are rasterised, one page at a time.
+
+    Args:
+        file (str): The presentation file.
+        output_dir (str): The directory to save the slide images.
+        dpi (int): The resolution of the slide images.
+        slides (Iterable[int] | None): 1-based page indexes to (re-)render, e.g. `range(3, 6)`, regardless of fingerprints.
+    """
+    assert exists(file), f"File {file} does not exist"
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = join(output_dir, PPT2IMAGES_MANIFEST)
+    try:
+        fingerprints = await run_in_thread(slide_fingerprints, file)
+    except (zipfile.BadZipFile, KeyError, StopIteration, etree.XMLSyntaxError):
+        fingerprints = None
+
+    if fingerprints is None and slides is None:
+        # not an OOXML package, cannot tell what changed
+        if len(os.listdir(output_dir)) > 0:
+            logger.debug(f"ppt2images: {output_dir} already exists")
+            return
+        pages = None
+    else:
+        manifest = {"dpi": dpi, "slides": []}
+        if exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        if manifest.get("dpi") != dpi:
+            manifest = {"dpi": dpi, "slides": []}
+        old_fingerprints = manifest["slides"]
+        if slides is not None:
+            pages = sorted(set(slides))
+        else:
+            pages = [
+                idx
+                for idx, fingerprint in enumerate(fingerprints, start=1)
+                if idx > len(old_fingerprints)
+                or old_fingerprints[idx - 1] != fingerprint
+                or not exists(join(output_dir, f"slide_{idx:04d}.jpg"))
+            ]
+            for idx in range(len(fingerprints) + 1, len(old_fingerprints) + 1):
+                Path(join(output_dir, f"slide_{idx:04d}.jpg")).unlink(missing_ok=True)
+        if len(pages) == 0:
+            logger.debug(f"ppt2images: {output_dir} is up to date")
+            return
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        pdf_path = await get_office_pool().aconvert(file, out_dir, "pdf")
+        num_pages = (await run_in_thread(pdfinfo_from_path, pdf_path))["Pages"]
+        if fingerprints is not None and num_pages != len(fingerprints):
+            logger.warning(
+                "ppt2images: %s has %d rendered slides but %d pages, rendering all pages",
+                file,
+                len(fingerprints),
+                num_pages,
+            )
+            fingerprints = None
+            pages = None
+        if pages is None:
+            pages = list(range(1, num_pages + 1))
+        pages = [p for p in pages if 1 <= p <= num_pages]
+        await run_in_thread(_rasterize_pages, pdf_path, pages, output_dir, dpi)
+
+    if fingerprints is not None:
+        rendered = set(pages)
+        slides_manifest = [
+            fingerprint
+            if idx in rendered
+            or (
+                idx <= len(old_fingerprints)
+                and old_fingerprints[idx - 1] == fingerprint
+            )
+            else None
+            for idx, fingerprint in enumerate(fingerprints, start=1)
+        ]
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"dpi": dpi, "slides": slides_manifest}, f)
+
+
+def _rasterize_pages(pdf_path: str, pages: list[int], output_dir: str, dpi: int):
+    """
+    Rasterise the given pages of a pdf to slide images, one contiguous run of pages at a time.
+    pdftoppm writes the pages straight to disk, so no page is held in memory.
+    """
+    runs = []
+    for page in sorted(pages):
+        if runs and runs[-1][1] == page - 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    for first_page, last_page in runs:
+        with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+            image_paths = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                output_folder=tmp_dir,
+                first_page=first_page,
+                last_page=last_page,
+                fmt="jpeg",
+                paths_only=True,
+            )
+            assert len(image_paths) == last_page - first_page + 1, (
+                f"Expected {last_page - first_page + 1} pages, got {len(image_paths)}"
+            )
+            for page, image_path in enumerate(image_paths, start=first_page):
+                os.replace(image_path, join(output_dir, f"slide_{page:04d}.jpg"))
 
 
 def parsing_image(image: Image, image_path: str) -> str:
@@ -482,16 +1652,7 @@ def wmf_to_images(blob: bytes, filepath: str):
     with tempfile.TemporaryDirectory() as temp_dir:
         with open(join(temp_dir, f"{base_name}.wmf"), "wb") as f:
             f.write(blob)
-        command_list = [
-            "soffice",
-            "--headless",
-            "--convert-to",
-            "png",
-            join(temp_dir, f"{base_name}.wmf"),
-            "--outdir",
-            dirname,
-        ]
-        subprocess.run(command_list, check=True, stdout=subprocess.DEVNULL)
+        get_office_pool().convert(join(temp_dir, f"{base_name}.wmf"), dirname, "png")
 
     assert exists(filepath), f"File {filepath} does not exist"
 
@@ -1,12 +1,18 @@
+import tempfile
+
 from bs4 import BeautifulSoup
 from pptagent_pptx import Presentation
 from src.apis import (
     API_TYPES,
     CodeExecutor,
+    compile_commands,
     markdown,
     process_element,
     replace_para,
 )
+from src.presentation import Picture
+from src.presentation import Presentation as PPTAgentPresentation
+from src.utils import Config
 
 from test.conftest import test_config
 
@@ -43,3 +49,26 @@ def test_list_parsing():
     blocks = process_element(soup)
     assert len(blocks) == 1
     assert "ol" not in html and "ul" not in html
+
+
+def test_compile_commands():
+    prs = PPTAgentPresentation.from_file(test_config.ppt, Config(tempfile.mkdtemp()))
+    slide = prs.slides[0]
+    for shape in slide:
+        if not isinstance(shape, Picture):
+            shape.text_frame.paragraphs[0].text = f"text {shape.shape_idx}"
+    command_list = [
+        ("title", "text", "quantity_change: 1", ["text 0"], ["a", "b"]),
+        ("subtitle", "text", "quantity_change: -1", ["text 1"], []),
+    ]
+    actions = compile_commands(command_list, slide)
+    assert "clone_paragraph(0, 0)" in actions
+    assert "del_paragraph(1, 0)" in actions
+    executor = CodeExecutor(3)
+    executor.command_history.append(command_list)
+    assert executor.execute_actions(actions, slide, None) is None
+
+    # paragraphs sharing the same text cannot be told apart
+    command_list = [("title", "text", "quantity_change: 0", ["text 2"], ["a"])]
+    slide.shapes[0].text_frame.paragraphs[0].text = "text 2"
+    assert compile_commands(command_list, slide) is None
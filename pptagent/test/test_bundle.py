@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+from src.bundle import TemplateBundle, TemplateCache, compile_template, load_bundle
+from src.utils import Config, package_join
+
+
+def test_template_bundle():
+    template_dir = join(tempfile.mkdtemp(), "default")
+    shutil.copytree(package_join("templates", "default"), template_dir)
+    os.chmod(template_dir, 0o755)
+    bundle = TemplateBundle(compile_template(template_dir))
+    assert not bundle.is_stale(template_dir)
+    assert bundle.description
+    assert bundle.template_html(hide_small_pic_ratio=None) is None
+
+    presentation = bundle.load_presentation(Config(tempfile.mkdtemp()))
+    template_html = bundle.template_html()
+    for layout in bundle.metadata["layouts"].values():
+        assert layout["template_id"] in template_html
+    for slide in presentation.slides:
+        slide.to_html()
+    presentation.save(join(tempfile.mkdtemp(), "bundle.pptx"))
+    assert load_bundle(template_dir).path == bundle.path
+
+    # bundles other users can write to are never unpickled, but compiled again
+    os.chmod(bundle.path, 0o666)
+    bundle = load_bundle(template_dir)
+    assert os.stat(bundle.path).st_mode & 0o077 == 0
+
+
+def test_template_cache():
+    templates_dir = tempfile.mkdtemp()
+    for name in ["beamer", "cip", "hit"]:
+        shutil.copytree(package_join("templates", name), join(templates_dir, name))
+    cache = TemplateCache(templates_dir, max_templates=2)
+    assert cache.keys() == ["beamer", "cip", "hit"]
+    assert all(cache.descriptions.values())
+    assert cache.resident == []
+
+    beamer = cache.get("beamer")
+    assert cache.get("beamer") is beamer
+    cache.get("cip")
+    cache.get("beamer")
+    cache.get("hit")
+    assert cache.resident == ["beamer", "hit"]
+    assert cache.metrics()["evictions"] == 1
+    assert beamer.presentation.snapshot().slides[0].to_html()
+
+    # evicted bundles are unmapped, their metadata stays available
+    cip = cache.get("cip")
+    assert beamer.bundle._mmap.closed and beamer.description
+    assert cache.resident == ["hit", "cip"]
+
+    # concurrent loads of a template are loaded once
+    misses = cache.metrics()["misses"]
+    with ThreadPoolExecutor(4) as executor:
+        templates = list(executor.map(cache.get, ["beamer"] * 4))
+    assert all(template is templates[0] for template in templates)
+    assert cache.metrics()["misses"] == misses + 1
+    assert cip.bundle._mmap.closed is False
+
+    cache.max_bytes = 1
+    cache.get("hit")
+    assert cache.resident == ["hit"]
+    assert templates[0].bundle._mmap.closed
@@ -1,5 +1,17 @@
+import json
+
 import pytest
-from src.document import Document
+from PIL import Image
+from src.document import Document, Media, Section, SubSection, document
+from src.document.cache import DocumentCache
+from src.document.doc_utils import (
+    HeadingIndex,
+    MarkdownOutline,
+    get_tree_structure,
+    process_markdown_content,
+)
+from src.llms import AsyncLLM
+from src.utils import Language
 
 from test.conftest import test_config
 
@@ -23,3 +35,170 @@ def test_document_from_dict():
     document = Document(**test_config.get_document_json())
     document.get_overview(include_summary=True)
     document.metainfo
+
+
+class FakeLLM(AsyncLLM):
+    """Answers every prompt with a fixed response and counts the calls."""
+
+    calls: int = 0
+
+    async def __call__(
+        self,
+        content: str,
+        images=None,
+        return_json: bool = False,
+        return_message: bool = False,
+        **kwargs,
+    ):
+        self.calls += 1
+        if return_message:
+            section = {"title": content[-32:], "summary": "", "subsections": []}
+            return json.dumps(section), []
+        if return_json:
+            return {"metadata": [{"name": "title", "value": "test"}]}
+        return f"caption {self.calls}"
+
+
+@pytest.mark.asyncio
+async def test_document_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(document, "language_id", lambda _: Language(lid="en"))
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    Image.new("RGB", (8, 8)).save(image_dir / "figure.png")
+    sections = [f"# Section {i}\n\n" + f"paragraph {i} " * 64 for i in range(3)]
+    sections[0] += "\n\n![figure](figure.png)"
+    language_model, vision_model = FakeLLM("language"), FakeLLM("vision")
+
+    async def parse(markdown: str, image_dir: str = str(image_dir)):
+        return await Document.from_markdown(
+            markdown,
+            language_model,
+            vision_model,
+            image_dir,
+            cache_dir=str(tmp_path / "cache"),
+        )
+
+    parsed = await parse("\n\n".join(sections))
+    assert (language_model.calls, vision_model.calls) == (4, 1)
+
+    # an unchanged document is reused as a whole, with media paths in the new image directory
+    moved_dir = tmp_path / "moved"
+    image_dir.rename(moved_dir)
+    cached = await parse("\n\n".join(sections), str(moved_dir))
+    assert (language_model.calls, vision_model.calls) == (4, 1)
+    assert cached.metadata == parsed.metadata
+    media = next(cached.iter_medias())
+    assert media.caption == next(parsed.iter_medias()).caption
+    assert media.path == str(moved_dir / "figure.png")
+
+    # only the edited chunk is extracted again, captions of unchanged images are reused
+    sections[2] += " edited"
+    await parse("\n\n".join(sections), str(moved_dir))
+    assert (language_model.calls, vision_model.calls) == (6, 1)
+
+    # other model settings never reuse the entries
+    namespaces = {
+        DocumentCache(str(tmp_path / "cache"), model, vision_model).namespace
+        for model in [
+            language_model,
+            FakeLLM("language", base_url="http://localhost:8000/v1"),
+            FakeLLM("language", use_batch=True),
+        ]
+    }
+    assert len(namespaces) == 3
+
+
+def test_document_index():
+    def media(name: str):
+        return Media(markdown_content=f"![]({name})", near_chunks=("", ""), path=name)
+
+    sections = [
+        Section(
+            title=f"Section {i}",
+            summary="",
+            content=[SubSection(title=f"Sub {i}.{j}", content="") for j in range(3)]
+            + [media(f"{i}.png")],
+        )
+        for i in range(3)
+    ]
+    doc = Document(
+        image_dir=".", language=Language(lid="en"), metadata={}, sections=sections
+    )
+    doc = Document.model_validate_json(doc.model_dump_json())
+    assert "Section 2" in doc and "Section 3" not in doc
+    assert doc["Section 1"]["Sub 1.2"].title == "Sub 1.2"
+    assert doc[5].title == "Sub 1.1" and doc.index(doc[5]) == 5
+    assert doc.find_media(path="2.png") is doc[11]
+
+    # medias captioned in place are found by their new caption
+    doc[7].caption = "a figure"
+    assert doc.find_media(caption="a figure", path="2.png") is doc[7]
+    assert doc["Section 1"]["a figure"] is doc[7]
+
+    item = doc.pop(0)
+    assert doc[0].title == "Sub 0.1"
+    doc.insert(item, 1)
+    assert [c.title for c in doc[:3]] == ["Sub 0.1", "Sub 0.0", "Sub 0.2"]
+    doc.remove(item)
+    assert doc.index(doc.find_media(path="2.png")) == 10
+    with pytest.raises(ValueError):
+        doc.index(item)
+
+    # sections renamed or replaced in place are found without an explicit reindex
+    doc.sections[0].title = "Renamed"
+    assert "Renamed" in doc and doc["Renamed"] is doc.sections[0]
+    assert "Section 0" not in doc
+    replaced = doc.sections[1].model_copy(deep=True)
+    replaced.content[0] = SubSection(title="Replaced", content="")
+    doc.sections[1] = replaced
+    assert doc[3] is replaced.content[0]
+    assert doc["Section 1"]["Replaced"] is replaced.content[0]
+    replaced.content[1] = SubSection(title="Sub 1.0", content="")
+    assert doc["Section 1"]["Sub 1.0"] is replaced.content[1]
+
+    # content removed in place is not found, even at the end of the document
+    removed = doc.sections[2].content.pop()
+    with pytest.raises(ValueError):
+        doc.find_media(path="2.png")
+    with pytest.raises(ValueError):
+        doc.index(removed)
+
+
+def test_markdown_outline():
+    markdown = "# A\nabc\n## B\nde\n### C\nf\n## D\n\n# E\nghij\n####### not a heading"
+    outline = MarkdownOutline(markdown)
+    assert [n.heading for n in outline.nodes] == ["A", "B", "C", "D", "E"]
+    assert [n.parent for n in outline.nodes] == [None, 0, 1, 0, None]
+    assert [n.total_char_count for n in outline.nodes] == [6, 3, 1, 0, 26]
+    assert outline.slice((outline.nodes[1].start, outline.nodes[1].end)) == (
+        "## B\nde\n### C\nf\n"
+    )
+    assert "■ <title>A</title> [Total Characters:6]" in get_tree_structure(markdown)
+
+    spans = outline.split_span(0, len(markdown), 20)
+    # cut at the heading nearest the middle until the chunks fit or have no heading left
+    assert [outline.slice(span) for span in spans] == [
+        "# A\nabc\n## B\nde",
+        "### C\nf\n## D",
+        "# E\nghij\n####### not a heading",
+    ]
+
+
+def test_heading_index():
+    index = HeadingIndex(["# 1. Introduction", "## 1.1 Background", "# 2. Method"])
+    assert index.resolve("## 1.1 Background") == "## 1.1 Background"
+    assert index.resolve("1. Introduction") == "# 1. Introduction"
+    assert index.resolve("2 Methods") == "# 2. Method"
+    assert index.match("# 2. Method") and index.match("# 2. Methods and data")
+    assert not index.match("# 3. Results") and not HeadingIndex([]).match("# 1")
+
+
+def test_media_context():
+    paragraphs = [" ".join([f"paragraph {i}"] * 10) for i in range(6)]
+    markdown = "\n\n".join(paragraphs[:4] + ["![figure](figure.png)"] + paragraphs[4:])
+    cleaned, medias = process_markdown_content(markdown, max_chunk_size=200)
+    assert cleaned == "\n\n".join(paragraphs)
+    # the nearest paragraphs on each side, until the context exceeds the size limit
+    before, after = medias[0]["near_chunks"]
+    assert before == f"{paragraphs[2]}\n\n{paragraphs[3]}\n\n"
+    assert after == f"{paragraphs[4]}\n\n{paragraphs[5]}\n\n"
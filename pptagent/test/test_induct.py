@@ -1,7 +1,11 @@
+from collections import defaultdict
 from os.path import join as pjoin
 from pathlib import Path
+from types import SimpleNamespace
 
+import numpy as np
 import pytest
+import src.induct as induct
 from src.induct import SlideInducter
 from src.multimodal import ImageLabler
 from src.presentation import Presentation
@@ -76,3 +80,39 @@ async def test_content_induct():
         layout_induction[layout_name] = cluster
         break
     await inducter.content_induct(layout_induction=layout_induction)
+
+
+@pytest.mark.asyncio
+async def test_layout_split(monkeypatch):
+    poolings = []
+
+    def get_image_embedding(image_dir, extractor, model, pooling):
+        poolings.append(pooling)
+        vectors = [[1, 0], [1, 0.1], [0, 1]]
+        return {f"slide_{i + 1:04d}.jpg": np.array(v) for i, v in enumerate(vectors)}
+
+    async def vision_model(prompt, image):
+        return Path(image).stem
+
+    class Slides(list):
+        slides = property(list)
+
+    slide = SimpleNamespace(
+        get_content_type=lambda: "text", slide_layout_name="Title", shapes=[]
+    )
+    monkeypatch.setattr(induct, "get_image_embedding", get_image_embedding)
+    inducter = object.__new__(SlideInducter)
+    inducter.__dict__.update(
+        prs=Slides([slide] * 3),
+        template_image_folder="",
+        ppt_image_folder="",
+        image_models=[None, None],
+        vision_model=vision_model,
+        pooling="cls",
+        sim_bound=0.85,
+    )
+    layout_induction = defaultdict(dict)
+    await inducter.layout_split({1, 2, 3}, layout_induction)
+    # layout induction clusters pooled features with a bound tuned for them
+    assert poolings == ["cls"]
+    assert sorted(c["slides"] for c in layout_induction.values()) == [[1, 2], [3]]
@@ -1,6 +1,15 @@
+import tempfile
 from copy import deepcopy
+from os.path import join
 
 import pytest
+from src.llms import (
+    AsyncLLM,
+    MemoryCache,
+    ResponseCache,
+    SQLiteCache,
+    TokenBucket,
+)
 
 from test.conftest import test_config
 
@@ -50,3 +59,35 @@ def test_sync_llm():
     response = sync_language_model("Hello, how are you?", max_tokens=1)
     assert response is not None, "Sync LLM returned None response"
     assert len(response) > 0, "Sync LLM returned empty response"
+
+
+def test_response_cache():
+    key = ResponseCache.make_key(
+        "model", [{"role": "user", "content": "hi"}], client_kwargs={"max_tokens": 1}
+    )
+    assert key != ResponseCache.make_key(
+        "model", [{"role": "user", "content": "hi"}], client_kwargs={"max_tokens": 2}
+    )
+    memory = MemoryCache(max_entries=1)
+    memory.set("a", "1")
+    memory.set("b", "2")
+    assert memory.get("a") is None and memory.get("b") == "2"
+    assert memory.stats() == {"hits": 1, "misses": 1}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sqlite = SQLiteCache(join(temp_dir, "cache.db"), max_bytes=2)
+        sqlite.set("a", "1")
+        sqlite.set("b", "2")
+        sqlite.set("c", "3")
+        assert sqlite.get("a") is None and sqlite.get("c") == "3"
+        assert SQLiteCache(join(temp_dir, "cache.db")).get("b") == "2"
+
+
+def test_shared_endpoint():
+    language_model = AsyncLLM("language", "http://localhost/v1")
+    vision_model = AsyncLLM("vision", "http://localhost/v1")
+    assert language_model.endpoint is vision_model.endpoint
+    assert deepcopy(language_model).endpoint is language_model.endpoint
+
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.1)
@@ -0,0 +1,38 @@
+import asyncio
+
+from src.llms import AsyncLLM
+from src.mcp_server import SessionManager
+
+
+async def test_session_manager():
+    sessions = SessionManager(AsyncLLM("gpt-4.1", api_key="test"), max_sessions=2)
+    async with sessions.use("a") as session_a:
+        async with sessions.use("b") as session_b:
+            assert session_a is not session_b
+            session_a.slides.append("slide")
+            assert session_b.slides == []
+        # the running session "a" is kept, the idle session "b" is evicted
+        sessions.get("c")
+        assert list(sessions.sessions) == ["a", "c"]
+    assert sessions.get("a").slides == ["slide"]
+
+    sessions.ttl = 0
+    await asyncio.sleep(0.01)
+    sessions.evict_idle()
+    assert not sessions.sessions
+
+
+async def test_session_concurrency():
+    sessions = SessionManager(AsyncLLM("gpt-4.1", api_key="test"))
+    running, peak = 0, 0
+
+    async def call():
+        nonlocal running, peak
+        async with sessions.use("a"):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*[call() for _ in range(4)])
+    assert peak == 1
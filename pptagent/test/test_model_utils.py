@@ -1,8 +1,18 @@
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from os.path import exists, join
+from types import SimpleNamespace
 
 import pytest
-from src.model_utils import parse_pdf
+import torch
+from PIL import Image
+from src.model_utils import (
+    EmbeddingStore,
+    get_cluster,
+    get_image_embedding,
+    images_cosine_similarity,
+    parse_pdf,
+)
 
 from test.conftest import test_config
 
@@ -16,3 +26,79 @@ async def test_parse_pdf():
             temp_dir,
         )
         assert exists(join(temp_dir, "source.md"))
+
+
+def test_get_cluster():
+    embeddings = [[1.0, 0.0], [0.99, 0.1], [0.0, 1.0], [0.1, 0.99], [-1.0, 0.0]]
+    similarity = images_cosine_similarity(embeddings)
+    assert similarity.shape == (5, 5)
+    assert similarity[0, 0] == 0
+    assert get_cluster(similarity) == [[0, 1], [2, 3], [4]]
+
+
+def test_embedding_store():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        store = EmbeddingStore(cache_dir, {"model": "test"})
+        store.put({"a": [0.5, 1.0, 2.0], "b": [1.0, 0.0, 0.0]})
+        store.put({"a": [0.0, 0.0, 0.0], "c": [3.0, 2.0, 1.0]})
+        store = EmbeddingStore(cache_dir, {"model": "test"})
+        cached = store.get(["a", "c", "d"])
+        assert set(cached) == {"a", "c"}
+        assert cached["a"].tolist() == [0.5, 1.0, 2.0]
+        assert cached["c"].tolist() == [3.0, 2.0, 1.0]
+        assert EmbeddingStore(cache_dir, {"model": "other"}).get(["a"]) == {}
+
+        # a row being appended by another writer is not visible yet
+        with open(store.data_path, "ab") as f:
+            f.write(b"\0" * 3)
+        assert store.get(["c"])["c"].tolist() == [3.0, 2.0, 1.0]
+        # unreadable entries are cache misses
+        with open(store.index_path, "w") as f:
+            f.write("{")
+        assert store.get(["a"]) == {}
+
+
+def _put_embeddings(cache_dir: str, worker: int):
+    store = EmbeddingStore(cache_dir, {"model": "test"})
+    for i in range(20):
+        store.put({f"{worker}-{i}": [worker, i, 1.0]})
+
+
+def test_embedding_store_processes():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with ProcessPoolExecutor(4) as executor:
+            list(executor.map(_put_embeddings, [cache_dir] * 4, range(4)))
+        keys = {f"{w}-{i}": [w, i, 1.0] for w in range(4) for i in range(20)}
+        cached = EmbeddingStore(cache_dir, {"model": "test"}).get(list(keys))
+        assert {k: v.tolist() for k, v in cached.items()} == keys
+
+
+def test_image_embedding_pooling():
+    class Model(torch.nn.Module):
+        name_or_path = "test"
+        dtype = torch.float32
+        device = torch.device("cpu")
+
+        def forward(self, pixel_values):
+            tokens = pixel_values.flatten(2).transpose(1, 2)[:, :5]
+            return SimpleNamespace(last_hidden_state=tokens)
+
+    extractor = SimpleNamespace(
+        size={"height": 8}, image_mean=[0.5] * 3, image_std=[0.5] * 3
+    )
+    with tempfile.TemporaryDirectory() as image_dir:
+        for i in range(3):
+            Image.new("RGB", (16, 16), (i * 80, 0, 0)).save(join(image_dir, f"{i}.png"))
+        # clustering thresholds are tuned for the features of all tokens
+        embeddings = get_image_embedding(image_dir, extractor, Model(), cache_dir=None)
+        assert embeddings["0.png"].shape == (15,)
+        embeddings = get_image_embedding(
+            image_dir, extractor, Model(), cache_dir=None, pooling="cls"
+        )
+        assert embeddings["0.png"].shape == (3,)
+        # an unwritable cache only disables caching
+        cache_dir = join(image_dir, "0.png", "cache")
+        embeddings = get_image_embedding(
+            image_dir, extractor, Model(), cache_dir=cache_dir
+        )
+        assert embeddings["0.png"].shape == (15,)
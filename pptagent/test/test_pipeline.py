@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+from src.pipeline import Admission, StagePipeline
+
+
+@pytest.mark.asyncio
+async def test_stage_pipeline():
+    pipeline = StagePipeline({"select_layout": 2})
+    running = []
+
+    async def job():
+        running.append(pipeline["select_layout"].running)
+        await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[pipeline["select_layout"].run(job) for _ in range(6)])
+    assert max(running) == 2
+    assert await pipeline["validate"].run(sum, [1, 2]) == 3
+
+    metrics = pipeline.metrics()
+    assert metrics["select_layout"]["completed"] == 6
+    assert metrics["select_layout"]["queued"] == 0
+    assert metrics["validate"]["avg_service"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_admission():
+    pipeline = StagePipeline({"select_layout": 2})
+    admission = Admission(1)
+    started = asyncio.Event()
+
+    async def slide(job):
+        async with admission.slot():
+            await pipeline["select_layout"].run(job)
+
+    async def first():
+        started.set()
+        await asyncio.sleep(10)
+
+    async def second():
+        # admitted while the first slide is still running its stage
+        assert pipeline["select_layout"].running == 2
+
+    task = asyncio.create_task(slide(first))
+    await started.wait()
+    await asyncio.wait_for(slide(second), 1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    # slots of slides leaving before any stage are released on exit
+    for _ in range(2):
+        async with admission.slot():
+            pass
@@ -1,9 +1,19 @@
+import asyncio
 from os.path import join
+from types import SimpleNamespace
 
 import pytest
 from src.document import Document
 from src.multimodal import ImageLabler
-from src.pptgen import PPTAgent
+from src.pipeline import StagePipeline
+from src.pptgen import (
+    METADATA_KEYWORDS,
+    PPTAgent,
+    element_role,
+    find_metadata,
+    fit_length,
+    strip_numbering,
+)
 from src.presentation import Presentation
 
 from test.conftest import test_config
@@ -26,3 +36,100 @@ async def test_pptgen():
 
     document = Document(**test_config.get_document_json())
     await pptgen.generate_pres(document, 3)
+
+
+def test_functional_helpers():
+    assert strip_numbering("1.2 Method") == "Method"
+    assert strip_numbering("章节一. 我到底是谁") == "我到底是谁"
+    assert fit_length("A very long title: with a subtitle", 20) == "A very long title"
+    assert fit_length("Supercalifragilistic", 5) == "Supercalifragilistic"
+    assert element_role("presenter affiliation") == "composite"
+    assert element_role("affiliation") == "affiliation"
+    assert element_role("subtitle") == "subtitle"
+    assert element_role("presenters and department") == "composite"
+    assert element_role("section list") == "list"
+    assert element_role("main title") == "title"
+
+
+def test_find_metadata():
+    metadata = {
+        "subtitle": "A subtitle",
+        "title": "The title",
+        "author affiliation": "University",
+        "company name": "Company",
+        "presenter": "Someone",
+    }
+    assert find_metadata(metadata, ["title"], ["subtitle"]) == "The title"
+    metadata.pop("title")
+    assert find_metadata(metadata, ["title"], ["subtitle"]) is None
+    metadata["paper title"] = "The title"
+    assert find_metadata(metadata, ["title"], ["subtitle"]) == "The title"
+    presenter_keywords = METADATA_KEYWORDS["presenter"]
+    affiliation_keywords = METADATA_KEYWORDS["affiliation"]
+    assert (
+        find_metadata(metadata, presenter_keywords, affiliation_keywords) == "Someone"
+    )
+    assert find_metadata(metadata, affiliation_keywords) == "University"
+
+
+@pytest.mark.asyncio
+async def test_generate_pres_error_exit():
+    cancelled = []
+
+    class Agent(PPTAgent):
+        async def _prepare_generation(self, *args):
+            pass
+
+        async def generate_slide(self, slide_idx, outline_item, semaphore):
+            if slide_idx == 0:
+                raise ValueError("failed")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(slide_idx)
+                raise
+
+    agent = object.__new__(Agent)
+    agent.__dict__.update(
+        outline=[None] * 3,
+        error_exit=True,
+        staffs={},
+        pipeline=StagePipeline(),
+        command_stats={"compiled": 0, "coder": 0},
+        presentation=SimpleNamespace(snapshot=lambda: None),
+    )
+    prs, _ = await agent.generate_pres(None)
+    # the slides still running are cancelled before returning
+    assert prs is None and sorted(cancelled) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_generate_pres_admission():
+    running = []
+
+    class Agent(PPTAgent):
+        async def _prepare_generation(self, *args):
+            pass
+
+        async def generate_slide(self, slide_idx, outline_item, semaphore):
+            stage = self.pipeline["select_layout"]
+
+            async def select_layout():
+                running.append(stage.running)
+                await asyncio.sleep(0.05)
+
+            await stage.run(select_layout)
+            raise ValueError("stop after the first stage")
+
+    agent = object.__new__(Agent)
+    agent.__dict__.update(
+        outline=[None] * 3,
+        error_exit=True,
+        staffs={},
+        pipeline=StagePipeline({"select_layout": 3}),
+        command_stats={"compiled": 0, "coder": 0},
+        presentation=SimpleNamespace(snapshot=lambda: None),
+    )
+    await agent.generate_pres(None, max_at_once=1)
+    # max_at_once only bounds admission, the slides share the workers of the stage
+    assert max(running) == 3
@@ -14,3 +14,18 @@ def test_presentation():
         sld.to_html(show_image=False)
     deepcopy(presentation)
     presentation.save("test.pptx", layout_only=True)
+
+
+def test_slide_snapshot():
+    presentation = Presentation.from_file(test_config.ppt, Config(tempfile.mkdtemp()))
+    slide = presentation.slides[0]
+    before = slide.to_html(show_image=False)
+    snapshot = slide.snapshot()
+    for shape in snapshot:
+        assert shape.sp is next(s for s in slide if s.shape_idx == shape.shape_idx).sp
+        for para in shape.text_frame.paragraphs:
+            para.text = "edited"
+        shape.style["shape_bounds"]["left"] = 0
+    snapshot.shapes.clear()
+    assert slide.to_html(show_image=False) == before
+    presentation.snapshot().save("test.pptx")
@@ -1,8 +1,35 @@
+import asyncio
+import json
 import os
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import types
 
 import pytest
-from src.utils import get_json_from_response, package_join, ppt_to_images
+import src.utils as utils
+from PIL import Image
+from src.utils import (
+    _LOOP_MONITORS,
+    CircuitBreaker,
+    CircuitOpenError,
+    FuzzyIndex,
+    LoopLagMonitor,
+    OfficePool,
+    TableRenderer,
+    content_bbox,
+    edit_distance,
+    get_json_from_response,
+    is_retryable,
+    manual_scan_crop,
+    monitor_event_loop,
+    package_join,
+    ppt_to_images,
+    run_in_thread,
+    tenacity_decorator,
+)
 
 from test.conftest import test_config
 
@@ -106,7 +133,200 @@ def test_json_not_found():
     assert "JSON not found" in str(excinfo.value)
 
 
+def test_manual_scan_crop():
+    """Test cropping an image to its non-white content."""
+    img = Image.new("RGB", (1000, 600), "white")
+    img.paste((0, 0, 0), (100, 50, 300, 150))
+    assert content_bbox(img) == (100, 50, 299, 149)
+    assert content_bbox(Image.new("RGB", (10, 10), "white")) is None
+    with tempfile.NamedTemporaryFile(suffix=".png") as f:
+        img.save(f.name)
+        manual_scan_crop(f.name)
+        assert Image.open(f.name).size == (240, 140)
+
+
 def test_ppt_to_images_conversion():
     """Test converting a PPTX file to images."""
     # Run the conversion
     ppt_to_images(test_config.ppt, tempfile.mkdtemp())
+
+
+def test_retry_policy():
+    attempts = []
+
+    @tenacity_decorator(wait=0)
+    def flaky(exception: Exception):
+        attempts.append(exception)
+        if len(attempts) < 3:
+            raise exception
+        return len(attempts)
+
+    assert flaky(ConnectionError()) == 3
+    attempts.clear()
+    with pytest.raises(TypeError):
+        flaky(TypeError())
+    assert len(attempts) == 1 and not is_retryable(TypeError())
+    attempts.clear()
+    with pytest.raises(FileNotFoundError):
+        flaky(FileNotFoundError())
+    assert len(attempts) == 1
+    for exception in [
+        RuntimeError("unoconvert or soffice not found"),
+        FileNotFoundError(),
+        AssertionError(),
+        ValueError("filepath must end with .png"),
+    ]:
+        assert not is_retryable(exception)
+    for exception in [
+        TimeoutError(),
+        ConnectionResetError(),
+        json.JSONDecodeError("JSON not found in the given output", "", 0),
+        CircuitOpenError("test", 1),
+    ]:
+        assert is_retryable(exception)
+
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()  # the first call after the timeout probes the endpoint
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor():
+    async with LoopLagMonitor(threshold=0.05) as monitor:
+        await run_in_thread(time.sleep, 0.3)
+        assert monitor.blocks == 0
+        time.sleep(0.3)
+        await asyncio.sleep(0.1)
+    assert monitor.blocks == 1
+    assert "test_loop_lag_monitor" in monitor.report(1)[0]["callsite"]
+
+
+def test_monitor_event_loop_shutdown():
+    async def main():
+        return monitor_event_loop(threshold=0.05)
+
+    # the monitor of a loop is stopped and dropped when the loop shuts down
+    monitors = [asyncio.run(main()) for _ in range(2)]
+    assert monitors[0] is not monitors[1]
+    assert all(monitor._stopped.is_set() for monitor in monitors)
+    assert _LOOP_MONITORS == {}
+    time.sleep(0.1)
+    assert "pptagent-loop-monitor" not in [t.name for t in threading.enumerate()]
+
+
+def test_fuzzy_index():
+    paths = [f"images/figure_{i}_{i * 7919 % 1000}.png" for i in range(50)]
+    index = FuzzyIndex(paths)
+    assert index.best(paths[17]) == (17, 1.0)
+    query = "images/figure_17_62x.png"
+    expected = max(range(len(paths)), key=lambda i: edit_distance(paths[i], query))
+    assert index.best(query)[0] == expected == 17
+    # small indexes are scanned fully
+    small = FuzzyIndex(paths[:5])
+    assert small.best("figure_3") == max(
+        enumerate(edit_distance(p, "figure_3") for p in paths[:5]),
+        key=lambda x: x[1],
+    )
+    assert FuzzyIndex([]).best("figure") is None
+
+    # candidates do not depend on the string hash seed of the process
+    code = (
+        f"from {FuzzyIndex.__module__} import FuzzyIndex\n"
+        f"paths = {paths!r}\n"
+        "print(FuzzyIndex(paths).search('figure_2', top_k=4))"
+    )
+    results = {
+        subprocess.run(
+            [sys.executable, "-c", code],
+            env=os.environ
+            | {"PYTHONHASHSEED": seed, "PYTHONPATH": os.pathsep.join(sys.path)},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()[-1]
+        for seed in ["1", "2"]
+    }
+    assert results == {str(index.search("figure_2", top_k=4))}
+
+
+def test_table_renderer_lifecycle(monkeypatch):
+    events = []
+
+    class Playwright:
+        fail = True
+
+        async def start(self):
+            self.chromium = self
+            return self
+
+        async def launch(self, **kwargs):
+            if Playwright.fail:
+                raise RuntimeError("no browser")
+            events.append("launch")
+            return self
+
+        async def close(self):
+            events.append("close")
+
+        async def stop(self):
+            events.append("stop")
+
+    playwright = types.ModuleType("playwright.async_api")
+    playwright.async_playwright = Playwright
+    monkeypatch.setitem(sys.modules, "playwright.async_api", playwright)
+    monkeypatch.setattr(TableRenderer, "_available", None)
+    monkeypatch.setattr(TableRenderer, "_retry_at", 0.0)
+
+    # a failed launch falls back for a while, then is retried
+    assert asyncio.run(TableRenderer._get_browser()) is None
+    assert events == ["stop"]
+    TableRenderer._retry_at = 0.0
+    Playwright.fail = False
+
+    async def get_browsers():
+        browsers = await asyncio.gather(
+            *[TableRenderer._get_browser() for _ in range(3)]
+        )
+        assert browsers[0] is not None and len(set(map(id, browsers))) == 1
+
+    # every event loop launches its own browser, closed when the loop shuts down
+    for _ in range(2):
+        events.clear()
+        asyncio.run(get_browsers())
+        assert events == ["launch", "close", "stop"]
+    assert TableRenderer._instances == {}
+
+
+def test_office_pool_recovery(monkeypatch):
+    monkeypatch.setattr(utils, "_is_port_open", lambda *args, **kwargs: False)
+    monkeypatch.setattr(utils, "which", lambda name: f"/usr/bin/{name}")
+    pool = OfficePool(size=1)
+    pool._mode = "external"
+    worker = pool._acquire()
+    pool._idle.put(worker)
+
+    # a vanished external unoserver falls back to the next available mode
+    monkeypatch.setattr(utils.OfficeWorker, "start", lambda self: None)
+    pool._ensure_healthy(worker)
+    assert worker.mode == pool.mode == "unoserver"
+
+    # a failed restart after a timeout does not hide the timeout
+    def convert(*args):
+        raise subprocess.TimeoutExpired("unoconvert", 1)
+
+    def start(self):
+        raise RuntimeError("failed to start")
+
+    monkeypatch.setattr(worker, "is_healthy", lambda: True)
+    monkeypatch.setattr(worker, "convert", convert)
+    monkeypatch.setattr(utils.OfficeWorker, "start", start)
+    with pytest.raises(RuntimeError, match="timed out") as error:
+        pool.convert("test.pptx", ".")
+    assert isinstance(error.value.__cause__, subprocess.TimeoutExpired)
+    assert worker.restarts == 1